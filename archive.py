@@ -0,0 +1,113 @@
+import datetime as dt
+import glob
+import gzip
+import json
+import os
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+# archiv surovych odpovedi: kazdy zdroj ma casove rotovane segmenty
+# `{zdroj}-{YYYYmmdd-HH}.seg`, kazdy zaznam je samostatny gzip member
+# (hlavicka v JSON na prvnim radku, pak payload), takze jde na zaznam skocit
+# primo podle offsetu; k segmentu patri `.idx` (TSV: ts, druh, id vlaku,
+# offset, delka), podle ktereho se filtruje bez rozbalovani
+
+
+@dataclass
+class Record:
+    ts: float
+    kind: str
+    train_id: Optional[int]
+    name: Optional[str]
+    payload: bytes
+
+
+class Archive:
+    def __init__(self, directory: str, source: str, rotate_hours: int = 1):
+        self.directory = directory
+        self.source = source
+        self.rotate = rotate_hours * 3600
+        self.segment = None
+        self.fseg = None
+        self.fidx = None
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def open_segment(self, ts: float):
+        segment = int(ts // self.rotate) * self.rotate
+        if segment == self.segment:
+            return
+        self.close()
+        stamp = dt.datetime.fromtimestamp(segment, dt.timezone.utc)
+        base = os.path.join(
+            self.directory, f"{self.source}-{stamp.strftime('%Y%m%d-%H%M')}"
+        )
+        self.segment = segment
+        self.fseg = open(base + ".seg", "ab")
+        self.fidx = open(base + ".idx", "at")
+
+    def append(self, kind: str, payload, ts: float = None, train_id=None, name=None):
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        ts = dt.datetime.now().timestamp() if ts is None else ts
+        header = json.dumps(
+            dict(ts=ts, kind=kind, train_id=train_id, name=name), ensure_ascii=False
+        )
+        blob = gzip.compress(header.encode("utf-8") + b"\n" + payload, compresslevel=6)
+        with self.lock:
+            self.open_segment(ts)
+            offset = self.fseg.tell()
+            self.fseg.write(blob)
+            self.fseg.flush()
+            self.fidx.write(
+                f"{ts}\t{kind}\t{'' if train_id is None else train_id}\t{offset}\t{len(blob)}\n"
+            )
+            self.fidx.flush()
+
+    def close(self):
+        if self.fseg:
+            self.fseg.close()
+            self.fidx.close()
+        self.segment, self.fseg, self.fidx = None, None, None
+
+
+def read_record(fseg, offset: int, length: int) -> Record:
+    fseg.seek(offset)
+    header, _, payload = gzip.decompress(fseg.read(length)).partition(b"\n")
+    header = json.loads(header)
+    return Record(
+        ts=header["ts"],
+        kind=header["kind"],
+        train_id=header["train_id"],
+        name=header["name"],
+        payload=payload,
+    )
+
+
+def iter_records(
+    directory: str,
+    source: str,
+    since: float = None,
+    until: float = None,
+    kind: str = None,
+    train_id: int = None,
+):
+    # zaznamy jednoho zdroje v casovem poradi, filtrovane podle indexu
+    for idx in sorted(glob.glob(os.path.join(directory, f"{source}-*.idx"))):
+        with open(idx) as fidx, open(idx[: -len(".idx")] + ".seg", "rb") as fseg:
+            for line in fidx:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) != 5:
+                    continue  # useknuty posledni radek po padu
+                ts, rkind, rtrain, offset, length = fields
+                ts = float(ts)
+                if since is not None and ts < since:
+                    continue
+                if until is not None and ts >= until:
+                    break
+                if kind is not None and rkind != kind:
+                    continue
+                if train_id is not None and rtrain != str(train_id):
+                    continue
+                yield read_record(fseg, int(offset), int(length))
@@ -0,0 +1,964 @@
+import argparse
+import asyncio
+import datetime as dt
+import gc
+import glob
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+import lxml.html
+
+import datel
+import dl
+import fake
+import partition
+import payload
+import pipeline
+import positions
+import rollup
+import timeline
+import writer
+
+# benchmarky proti lokalnimu fake serveru, nikdy proti produkci
+# python bench.py fetch --trains 300 --latency 0.1 --concurrency 1,2,4,8,16
+
+
+def bench_fetch(args):
+    app = fake.FakeGrapp(fake.make_fleet(args.trains), latency=args.latency)
+    server, url = fake.start(app)
+    dl.URL_ROUTEINFO = url + "/OneTrain/RouteInfo/{APP_ID}?trainId={train_id}&_={ts}"
+    trains = [dl.Train(id=t.id, name=t.name) for t in app.fleet.values()]
+    session = dl.Session(url)
+
+    parsers = dl.parser_pool(args.parsers)
+    print(
+        f"{args.trains} vlaku, latence {args.latency}s, strop {args.rps} req/s, "
+        f"{args.parsers} procesu na parsovani"
+    )
+    print("soubeznost  cas kola [s]  vlaku/s")
+    for concurrency in map(int, args.concurrency.split(",")):
+        conn = sqlite3.connect(":memory:")
+        conn.execute(dl.SQLITE_TRAINS)
+        db = writer.Writer(conn)
+        all_routes = {}
+        t0 = time.perf_counter()
+        asyncio.run(
+            dl.fetch_routes(
+                session,
+                trains,
+                lambda train, data, route: dl.store_route(db, all_routes, train, route),
+                concurrency=concurrency,
+                rps=args.rps,
+                parsers=parsers,
+                parse_workers=args.parsers,
+            )
+        )
+        db.flush()
+        took = time.perf_counter() - t0
+        print(f"{concurrency:>10}  {took:>12.2f}  {len(trains) / took:>7.1f}")
+        conn.close()
+
+    if parsers:
+        parsers.shutdown()
+    server.shutdown()
+
+
+def train_rows(n, cycle):
+    now = time.time()
+    for j in range(n):
+        yield (
+            now,
+            now,
+            j % 1500 + 1500 * cycle,
+            f"Os {j}",
+            "České dráhy, a.s.",
+            "Praha hl.n.",
+            "Kolín",
+            "12:00:00",
+            "12:01:00",
+            "12:50:00",
+            "12:52:00",
+            50,
+            1,
+            2,
+            j % 3 == 0,
+        )
+
+
+def bench_writer(args):
+    # stejne upserty jako dl.py: pred = commit po kazdem radku (puvodni stav),
+    # po = WAL + jedna transakce za kolo
+    print(f"{args.cycles} kol po {args.rows} radcich")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "pred.db")
+        conn = sqlite3.connect(path)
+        conn.execute(dl.SQLITE_TRAINS)
+        t0 = time.perf_counter()
+        for cycle in range(args.cycles):
+            for row in train_rows(args.rows, cycle):
+                conn.execute(dl.UPSERT_TRAIN, row)
+                conn.commit()
+        before = args.rows * args.cycles / (time.perf_counter() - t0)
+        conn.close()
+
+        conn = writer.connect(os.path.join(tmp, "po.db"), dl.SQLITE_TRAINS)
+        db = writer.Writer(conn)
+        t0 = time.perf_counter()
+        for cycle in range(args.cycles):
+            for row in train_rows(args.rows, cycle):
+                db.add(dl.UPSERT_TRAIN, row)
+            db.flush()
+        after = args.rows * args.cycles / (time.perf_counter() - t0)
+        conn.close()
+
+    print(f"commit po radku:   {before:>10.0f} radku/s")
+    print(f"Writer (WAL):      {after:>10.0f} radku/s ({after / before:.1f}x)")
+
+
+def rollup_rows(n, carriers=20, stations=50, days=30):
+    start = dt.datetime(2023, 1, 1, 12, tzinfo=dl.tz)
+    for j in range(n):
+        updated = (start + dt.timedelta(days=j % days)).isoformat()
+        yield (
+            updated,
+            updated,
+            j,
+            f"Os {j}",
+            f"Dopravce {j % carriers}",
+            f"Stanice {j % stations}",
+            f"Stanice {j * 7 % stations}",
+            "12:00:00",
+            "12:01:00",
+            "12:50:00",
+            "12:52:00",
+            50,
+            1,
+            j % 23 - 3,
+            j % 4 != 0,
+        )
+
+
+def bench_rollup(args):
+    # cena triggeru pri zapisu a dotaz z dl.py (cely scan) vs ze souhrnu
+    print("vlaku     zapis bez/se souhrny [radku/s]   dotaz scan/souhrn [ms]   shoda")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in map(int, args.sizes.split(",")):
+            speeds = []
+            for name, statements in (("bez", ()), ("se", rollup.STATEMENTS)):
+                path = os.path.join(tmp, f"{name}{n}.db")
+                conn = writer.connect(path, dl.SQLITE_TRAINS, statements)
+                db = writer.Writer(conn, flush_every=n + 1)
+                t0 = time.perf_counter()
+                for row in rollup_rows(n):
+                    db.add(dl.UPSERT_TRAIN, row)
+                db.flush()
+                speeds.append(n / (time.perf_counter() - t0))
+
+            t0 = time.perf_counter()
+            conn.execute(
+                rollup.RAW_CARRIERS, (rollup.FIRST_DAY, rollup.LAST_DAY)
+            ).fetchall()
+            scan = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            rollup.carriers([conn])
+            fast = time.perf_counter() - t0
+            ok = not rollup.verify([conn])
+            conn.close()
+            print(
+                f"{n:>7}   {speeds[0]:>12.0f} {speeds[1]:>12.0f}"
+                f"   {scan * 1000:>12.2f} {fast * 1000:>8.2f}   {'ano' if ok else 'NE'}"
+            )
+
+
+def parse_or_error(fn, *args):
+    try:
+        return fn(*args)
+    except Exception as e:
+        return type(e).__name__
+
+
+def bench_routeinfo(args):
+    # korpus ulozenych stranek + vygenerovane z fake serveru
+    pages = []
+    for path in sorted(glob.glob(os.path.join(args.corpus, "*.html"))):
+        with open(path) as f:
+            pages.append((os.path.basename(path), f.read()))
+    for t in fake.make_fleet(args.generated):
+        for minute in range(0, 1440, 240):
+            pages.append((t.name, fake.routeinfo_html(t, minute)))
+
+    # diferencialni test: rychla cesta musi vracet presne totez co puvodni
+    train = dl.Train(id=1, name="test")
+    old = lambda data: dl.parse_route_from_html(lxml.html.fromstring(data), train)
+    new = lambda data: dl.parse_route_fast(data, train)
+    diffs = 0
+    for name, data in pages:
+        a, b = parse_or_error(old, data), parse_or_error(new, data)
+        if a != b:
+            diffs += 1
+            print(f"ROZDIL {name}: {a!r} != {b!r}")
+    print(f"{len(pages)} stranek, {diffs} rozdilu")
+
+    for label, fn in [("lxml.html + xpath", old), ("target parser", new)]:
+        t0 = time.perf_counter()
+        for _ in range(args.rounds):
+            for _, data in pages:
+                parse_or_error(fn, data)
+        took = time.perf_counter() - t0
+        print(f"{label:<20} {len(pages) * args.rounds / took:>8.0f} stranek/s")
+
+    if diffs:
+        raise SystemExit(1)
+
+
+def deep_size(root) -> int:
+    # sys.getsizeof vseho, co je z `root` dosazitelne, kazdy objekt jednou
+    # (sdilene a internovane retezce se tak nepocitaji vickrat)
+    seen, stack, total = set(), [root], 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(
+            obj, (type, types.ModuleType, types.FunctionType)
+        ):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        stack.extend(gc.get_referents(obj))
+    return total
+
+
+def bench_memory(args):
+    # all_routes po jednom kole: Route se Station (jak to bylo) proti
+    # StoredRoute; stranky se parsuji pro kazdy vlak zvlast, at retezce
+    # vznikaji stejne jako za provozu
+    fleet = fake.make_fleet(args.distinct)
+    pages = [fake.routeinfo_html(t, 600) for t in fleet]
+    print("vlaku     Route [MiB]  StoredRoute [MiB]  B/vlak pred  B/vlak po")
+    for size in map(int, args.sizes.split(",")):
+        routes = dict()
+        for j in range(size):
+            train = dl.Train(id=j, name=f"Os {j}")
+            routes[train] = dl.parse_route_fast(pages[j % len(pages)], train)
+        stored = {
+            train: dl.StoredRoute.from_route(route) for train, route in routes.items()
+        }
+        # hodnoty vcetne Train, na ktery obe varianty odkazuji
+        before = deep_size(list(routes.values()))
+        after = deep_size(list(stored.values()))
+        print(
+            f"{size:>6}  {before / 2**20:>12.1f}  {after / 2**20:>17.1f}"
+            f"  {before / size:>11.0f}  {after / size:>9.0f}"
+        )
+        del routes, stored
+
+
+def bench_partitions(args):
+    # simulovane dny provozu: kazdy den nove vlaky, kazdy nekolikrat upsertnuty,
+    # a dotaz ze startu dl.py (load_from_db); jeden soubor vs oddil po dnech
+    start = dt.datetime(2023, 1, 1, 12, tzinfo=dl.tz)
+    startup = (
+        "SELECT id, nazev, ocekavany_prijezd, dojel FROM vlaky WHERE aktualizovano > ?"
+    )
+    print(f"{args.rows} vlaku/den, {args.updates} upserty na vlak")
+    print("den    jeden soubor: radku/s  start [ms]    po dnech: radku/s  start [ms]")
+    with tempfile.TemporaryDirectory() as tmp:
+        tw = writer.ThreadedWriter()
+        single = tw.open(os.path.join(tmp, "jeden.db"), dl.SQLITE_TRAINS)
+        parts = partition.Partitioned(
+            tw,
+            os.path.join(tmp, "vlaky.db"),
+            dl.SQLITE_TRAINS,
+            carry={"vlaky": dl.CARRY_TRAINS},
+            period="day",
+        )
+        for day in range(args.days):
+            now = start + dt.timedelta(days=day)
+            rows = list(rollup_rows(args.rows))
+            for j, row in enumerate(rows):
+                updated = (now + dt.timedelta(seconds=j)).isoformat()
+                rows[j] = (updated, updated, day * args.rows + j) + row[3:]
+            # jako dl.LIVE_TRAINS, jen v simulovanem case
+            since = (now - dt.timedelta(days=1)).isoformat()
+            results = []
+            for db in (single, parts.current(now.timestamp())):
+                t0 = time.perf_counter()
+                for _ in range(args.updates):
+                    for row in rows:
+                        db.add(dl.UPSERT_TRAIN, row)
+                db.flush()
+                speed = len(rows) * args.updates / (time.perf_counter() - t0)
+                t0 = time.perf_counter()
+                db.conn.execute(startup, (since,)).fetchall()
+                results.append((speed, (time.perf_counter() - t0) * 1000))
+            if day % max(args.days // 10, 1) == 0 or day == args.days - 1:
+                (a, sa), (b, sb) = results
+                print(f"{day + 1:>3}  {a:>22.0f}  {sa:>10.1f}  {b:>19.0f}  {sb:>10.1f}")
+        tw.close()
+
+
+NAIVE_STOPS = """
+CREATE TABLE zastavky (
+    stazeno TIMESTAMP NOT NULL,
+    vlak INT NOT NULL,
+    poradi INT NOT NULL,
+    stanice TEXT NOT NULL,
+    ocekavany_prijezd TIME NOT NULL,
+    realny_prijezd TIME NOT NULL,
+    ocekavany_odjezd TIME NOT NULL,
+    realny_odjezd TIME NOT NULL
+)
+"""
+
+
+def bench_timeline(args):
+    # casy na zastavkach: radek na zastavku a stazeni vs blob na vlak a den
+    # zapisovany jen pri zmene; zpozdeni se mezi stazenimi obcas zmeni
+    fleet = fake.make_fleet(args.trains)
+    rng = random.Random(0)
+    now = dt.datetime.now(dl.tz)
+    with tempfile.TemporaryDirectory() as tmp:
+        naive_path = os.path.join(tmp, "naivne.db")
+        naive = writer.connect(naive_path, NAIVE_STOPS)
+        naive.execute("CREATE INDEX zastavky_stanice ON zastavky(stanice)")
+        naive.execute("CREATE INDEX zastavky_vlak ON zastavky(vlak, stazeno)")
+        naive_db = writer.Writer(naive)
+        blob_path = os.path.join(tmp, "prubehy.db")
+        blob = writer.connect(blob_path, timeline.SCHEMA, timeline.INDEXES)
+        store = timeline.TimelineStore(writer.Writer(blob))
+
+        previous, written = dict(), 0
+        for poll in range(args.polls):
+            ts = (now + dt.timedelta(minutes=poll)).isoformat()
+            for t in fleet:
+                if rng.random() < args.change:
+                    t.delay += rng.choice([-1, 1, 2])
+                train = dl.Train(id=t.id, name=t.name)
+                route = dl.parse_route_fast(fake.routeinfo_html(t, 0), train)
+                for order, st in enumerate(route.stations):
+                    naive_db.add(
+                        "INSERT INTO zastavky VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (ts, t.id, order, st.name)
+                        + tuple(
+                            tm.isoformat()
+                            for tm in (
+                                st.planned_arrival,
+                                st.actual_arrival,
+                                st.planned_departure,
+                                st.actual_departure,
+                            )
+                        ),
+                    )
+                stored = dl.StoredRoute.from_route(route)
+                written += store.store(train, previous.get(train), stored, now)
+                previous[train] = stored
+        naive_db.flush()
+        store.db.flush()
+
+        station = fake.STATIONS[0]
+        day = blob.execute("SELECT den FROM jizdy LIMIT 1").fetchone()[0]
+        t0 = time.perf_counter()
+        hits = timeline.TimelineReader(blob).at_station(station, day)
+        fast = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        naive.execute(
+            """SELECT vlak, realny_prijezd FROM zastavky z WHERE stanice = ? AND
+            stazeno = (SELECT max(stazeno) FROM zastavky WHERE vlak = z.vlak)""",
+            (station,),
+        ).fetchall()
+        slow = time.perf_counter() - t0
+        for conn in (naive, blob):
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.close()
+
+        print(f"{args.trains} vlaku, {args.polls} stazeni, zmena {args.change:.0%}")
+        print(
+            f"radek na zastavku: {os.path.getsize(naive_path) / 2**20:>7.2f} MiB, "
+            f"{station} {slow * 1000:.1f} ms"
+        )
+        print(
+            f"blob na vlak:      {os.path.getsize(blob_path) / 2**20:>7.2f} MiB, "
+            f"{station} {fast * 1000:.1f} ms ({len(hits)} vlaku), "
+            f"zapsano {written}x z {args.trains * args.polls}"
+        )
+
+
+NAIVE_POSITIONS = """
+CREATE TABLE polohy (
+    cas INT NOT NULL,
+    cislo TEXT NOT NULL,
+    nazev TEXT NOT NULL,
+    provozovatel TEXT NOT NULL,
+    lon REAL NOT NULL,
+    lat REAL NOT NULL,
+    a REAL NOT NULL,
+    zpozdeni INT NOT NULL,
+    sr70 INT NOT NULL
+)
+"""
+
+
+def moving_feed(fleet, tick: int, rng):
+    # feed map, kde se vlaky mezi stanicemi posouvaji (fake.py je drzi v pulce
+    # useku), kazdy dvacaty vlak zrovna stoji
+    features = []
+    for j, t in enumerate(fleet):
+        segment, step = divmod(tick, 40)
+        el = fake.feed_feature(t, segment % len(t.stations))
+        el["properties"]["cp"] = fake.fmt_minutes(t.times[0][1])
+        if j % 20:
+            lon, lat = el["geometry"]["coordinates"]
+            el["geometry"]["coordinates"] = [lon + step * 3e-4, lat + step * 1e-4]
+        if rng.random() < 0.01:
+            t.delay += 1
+        el["properties"]["de"] = t.delay
+        features.append(el)
+    return features
+
+
+def bench_positions(args):
+    # polohy z feedu map: radek na vlak a tick vs useky s delta/varint bloby
+    # (s prorezanim starsich nez GRAPPER_POSITIONS_DOWNSAMPLE_HOURS)
+    rng = random.Random(0)
+    now = dt.datetime.now(fake.TZ).replace(hour=4, minute=0, second=0, microsecond=0)
+    fleet = fake.make_fleet(args.trains, now=now)
+    ticks = int(args.hours * 3600 / 15)
+    with tempfile.TemporaryDirectory() as tmp:
+        naive_path = os.path.join(tmp, "naivne.db")
+        naive = writer.connect(naive_path, NAIVE_POSITIONS)
+        naive.execute("CREATE INDEX polohy_vlak ON polohy(cislo, cas)")
+        naive.execute("CREATE INDEX polohy_cas ON polohy(cas)")
+        naive_db = writer.Writer(naive)
+        blob_path = os.path.join(tmp, "polohy.db")
+        blob = writer.connect(blob_path, positions.SCHEMA, positions.INDEXES)
+        store = positions.PositionStore(writer.Writer(blob))
+
+        samples, t_naive, t_blob = 0, 0.0, 0.0
+        for tick in range(ticks):
+            ts = now.timestamp() + tick * 15
+            features = moving_feed(fleet, tick, rng)
+            t0 = time.perf_counter()
+            for el in features:
+                row = positions.to_row(el, int(ts))
+                props = el["properties"]
+                naive_db.add(
+                    "INSERT INTO polohy VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (int(ts),)
+                    + row[0]
+                    + tuple(el["geometry"]["coordinates"])
+                    + (props["a"], props["de"], row[2][-1]),
+                )
+            naive_db.flush()
+            t1 = time.perf_counter()
+            samples += store.add(features, ts, now + dt.timedelta(seconds=tick * 15))
+            t_blob += time.perf_counter() - t1
+            t_naive += t1 - t0
+        store.flush()
+
+        at = now.timestamp() + ticks * 15 * 0.3  # uz prorezana cast
+        reader = positions.PositionReader(blob)
+        t0 = time.perf_counter()
+        snap = reader.snapshot(at)
+        fast_snap = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        naive.execute(
+            """SELECT cislo, max(cas), lon, lat FROM polohy
+            WHERE cas BETWEEN ? AND ? GROUP BY cislo, nazev, provozovatel""",
+            (at - positions.SNAPSHOT_GAP, at),
+        ).fetchall()
+        slow_snap = time.perf_counter() - t0
+        train_no = fleet[1].name
+        t0 = time.perf_counter()
+        traj = reader.trajectory(train_no)
+        fast_traj = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        naive.execute(
+            "SELECT * FROM polohy WHERE cislo = ? ORDER BY cas", (train_no,)
+        ).fetchall()
+        slow_traj = time.perf_counter() - t0
+        levels = dict(
+            blob.execute("SELECT uroven, count(*) FROM polohy GROUP BY uroven")
+        )
+        for conn in (naive, blob):
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.close()
+
+        print(f"{args.trains} vlaku, {args.hours:g} h po 15 s ({ticks} ticku)")
+        print(
+            f"radek na tick: {os.path.getsize(naive_path) / 2**20:>7.2f} MiB, "
+            f"zapis {t_naive:.1f}s, snapshot {slow_snap * 1000:.1f} ms, "
+            f"trajektorie {slow_traj * 1000:.1f} ms"
+        )
+        print(
+            f"useky:         {os.path.getsize(blob_path) / 2**20:>7.2f} MiB, "
+            f"zapis {t_blob:.1f}s, snapshot {fast_snap * 1000:.1f} ms "
+            f"({len(snap)} vlaku), trajektorie {fast_traj * 1000:.1f} ms "
+            f"({sum(map(len, traj.values()))} vzorku)"
+        )
+        print(
+            f"vzorku {samples} z {ticks * args.trains}, useku "
+            f"{levels.get(0, 0)} plnych a {levels.get(1, 0)} prorezanych"
+        )
+
+
+def bench_rate(args):
+    # pevny strop vs AIMD regulator s jisticem proti fake serveru, ktery
+    # strida zdravi, zpomaleni a vypadek (--phases jako u fake.py)
+    phases = fake.parse_phases(args.phases)
+    duration = sum(p[0] for p in phases)
+    controllers = {
+        "pevny": lambda: pipeline.RateController(
+            args.rps, min_rps=args.rps, max_rps=args.rps, failures=10**9
+        ),
+        "AIMD": lambda: pipeline.RateController(args.rps),
+    }
+    print(f"{args.trains} vlaku, start {args.rps} req/s, soubeznost {args.concurrency}")
+    for label, make in controllers.items():
+        app = fake.FakeGrapp(fake.make_fleet(args.trains), phases=phases)
+        started = time.time()
+        server, url = fake.start(app)
+        dl.URL_ROUTEINFO = (
+            url + "/OneTrain/RouteInfo/{APP_ID}?trainId={train_id}&_={ts}"
+        )
+        session = dl.Session(url)
+        trains = [dl.Train(id=t.id, name=t.name) for t in app.fleet.values()]
+        limiter = make()
+        rates = []  # (cas od startu, strop, stav jistice)
+
+        async def run():
+            stop = time.monotonic() + duration
+
+            async def sample():
+                while time.monotonic() < stop:
+                    rates.append((time.time() - started, limiter.rate, limiter.state))
+                    await asyncio.sleep(0.5)
+
+            sampler = asyncio.ensure_future(sample())
+            await dl.fetch_routes(
+                session,
+                itertools.takewhile(
+                    lambda _: time.monotonic() < stop, itertools.cycle(trains)
+                ),
+                lambda train, data, route: None,
+                concurrency=args.concurrency,
+                limiter=limiter,
+            )
+            await sampler
+
+        asyncio.run(run())
+        server.shutdown()
+
+        print(f"\n{label}: {limiter.report()}")
+        print("faze (delka:latence:chybovost)   ok/s  chyb/s  strop min-max  jistic")
+        offset = 0.0
+        for length, latency, error_rate in phases:
+            window = [
+                status
+                for ts, name, status in app.log
+                if name == "RouteInfo" and offset <= ts - started < offset + length
+            ]
+            in_phase = [r for r in rates if offset <= r[0] < offset + length]
+            opened = sum(r[2] != pipeline.CLOSED for r in in_phase) / max(
+                len(in_phase), 1
+            )
+            print(
+                f"{length:>6g}:{latency:<6g}:{error_rate:<18g}"
+                f"{window.count(200) / length:>6.1f}  "
+                f"{(len(window) - window.count(200)) / length:>6.1f}  "
+                f"{min(r[1] for r in in_phase):>5.2f}-{max(r[1] for r in in_phase):<5.2f}  "
+                f"{opened:>6.0%}"
+            )
+            offset += length
+
+
+def datel_features(n: int, rng, now: dt.datetime):
+    # tick feedu s `n` vlaky: casy kolem `now` (obcas mimo 8 hodin nebo ve
+    # formatu, jaky zvlada jen skalarni cesta), obcas jiny typ nebo duplicita
+    fleet = fake.make_fleet(max(n // 4, 1), seed=rng.randrange(1000))
+    features = []
+    for j in range(n):
+        t = fleet[j % len(fleet)]
+        el = fake.feed_feature(t, rng.randrange(len(t.stations)))
+        props = el["properties"]
+        planned = now.hour * 60 + now.minute + rng.randint(-360, 120)
+        if rng.random() < 0.02:
+            planned = rng.randrange(1440)
+        props["cp"] = fake.fmt_minutes(planned)
+        props["cr"] = fake.fmt_minutes(planned + rng.choice([0, 0, 0, 1, 3, 5, 30, 90]))
+        if rng.random() < 0.02 and props["cr"][0] == "0":
+            props["cr"] = props["cr"][1:]  # "7:05"
+        if rng.random() < 0.01:
+            props["type"] = "X"
+        if j >= len(fleet) and rng.random() < 0.98:
+            props["tn"] = f"{j}"  # jinak stejny vlak podruhe v jednom ticku
+        features.append(el)
+    return features
+
+
+def datel_check(features, now):
+    # skalarni a sloupcova cesta musi dat stejne radky i stejne KnownTrains
+    results = []
+    for fn in (datel.tick_rows, datel.tick_rows_batch):
+        conn = sqlite3.connect(":memory:")
+        conn.execute(datel.SQLITE_TRAINS)
+        known = datel.KnownTrains(conn, now.date())
+        # cast vlaku uz "mame v db"
+        for el in features[::3]:
+            p = el["properties"]
+            known.add(
+                (now.date().isoformat(), p["tt"] + " " + p["tn"], p["na"], p["d"])
+            )
+        rows = fn(features, known, now)
+        results.append((rows, known.keys))
+    return results[0] == results[1], len(results[0][0])
+
+
+def bench_datel(args):
+    if datel.np is None:
+        print("bez numpy jde jen skalarni cesta")
+        return
+    logging.disable(logging.INFO)
+    rng = random.Random(0)
+    tz = datel.SZ_TZ
+    # poledne, kolem pulnoci a prechody na letni/zimni cas
+    moments = [
+        dt.datetime(2023, 1, 30, 12, 0, 0, 0, tz),
+        dt.datetime(2023, 1, 30, 0, 7, 12, 345678, tz),
+        dt.datetime(2023, 1, 30, 23, 58, 59, 999999, tz),
+        dt.datetime(2023, 3, 26, 2, 30, 0, 0, tz),
+        dt.datetime(2023, 3, 26, 20, 0, 0, 1, tz),
+        dt.datetime(2023, 10, 29, 2, 30, 0, 0, tz, fold=1),
+        dt.datetime(2023, 10, 28, 19, 0, 0, 0, tz),
+    ]
+    ok = True
+    for now in moments:
+        for n in (10, 1000):
+            same, rows = datel_check(datel_features(n, rng, now), now)
+            ok &= same
+            if not same:
+                print(f"ROZDIL: {now.isoformat()} {n} vlaku")
+    print(f"shoda skalarni a sloupcove cesty ({len(moments)} okamziku): {ok}")
+
+    now = dt.datetime.now(tz)
+    print("vlaku    skalarne [ms]  po sloupcich [ms]  zrychleni  radku")
+    for n in map(int, args.sizes.split(",")):
+        features = datel_features(n, rng, now)
+        timings = []
+        for fn in (datel.tick_rows, datel.tick_rows_batch):
+            best = float("inf")
+            for _ in range(args.rounds):
+                conn = sqlite3.connect(":memory:")
+                conn.execute(datel.SQLITE_TRAINS)
+                known = datel.KnownTrains(conn, now.date())
+                t0 = time.perf_counter()
+                rows = fn(features, known, now)
+                best = min(best, time.perf_counter() - t0)
+            timings.append(best)
+        print(
+            f"{n:>6}  {timings[0] * 1000:>14.1f}  {timings[1] * 1000:>17.1f}  "
+            f"{timings[0] / timings[1]:>8.1f}x  {len(rows):>5}"
+        )
+
+    if not ok:
+        raise SystemExit(1)
+
+
+def payload_bodies(n: int, rng):
+    # surove odpovedi feedu a seznamu vlaku s `n` vlaky, jak je posila server
+    now = dt.datetime.now(datel.SZ_TZ)
+    feed = dict(success=True, result=datel_features(n, rng, now))
+    app = fake.FakeGrapp(fake.make_fleet(n, seed=rng.randrange(1000)))
+    listing = dict(Trains=[app.listed(t, 600) for t in app.fleet.values()])
+    return [
+        ("feed", "result", json.dumps(feed).encode()),
+        ("seznam", "Trains", json.dumps(listing, ensure_ascii=False).encode()),
+    ]
+
+
+def consume_loads(body, key):
+    return sum(1 for _ in json.loads(body)[key])
+
+
+def consume_stream(body, key):
+    return sum(1 for _ in payload.iter_array(body, key))
+
+
+def peak_memory(fn, *args) -> int:
+    tracemalloc.start()
+    try:
+        fn(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_payload(args):
+    # json.loads cele odpovedi vs prvky po jednom (payload.iter_array) a cena
+    # otisku (payload.Digest) proti dekodovani odpovedi, ktera se nezmenila
+    rng = random.Random(0)
+    ok = True
+    for n in (0, 1, 50):
+        for _, key, body in payload_bodies(n, rng):
+            whole = json.loads(body)
+            rest = dict()
+            ok &= list(payload.iter_array(body, key, rest)) == whole.pop(key)
+            ok &= rest == whole
+    print(f"shoda iter_array s json.loads: {ok}")
+    if not ok:
+        raise SystemExit(1)
+
+    print(
+        "odpoved  vlaku   [KiB]  loads [ms]  proud [ms]  otisk [ms]"
+        "  spicka loads [MiB]  spicka proud [MiB]"
+    )
+    for n in map(int, args.sizes.split(",")):
+        for name, key, body in payload_bodies(n, rng):
+            timings = []
+            for fn in (consume_loads, consume_stream):
+                best = float("inf")
+                for _ in range(args.rounds):
+                    t0 = time.perf_counter()
+                    fn(body, key)
+                    best = min(best, time.perf_counter() - t0)
+                timings.append(best)
+            digest = payload.Digest("bench")
+            best = float("inf")
+            for _ in range(args.rounds):
+                t0 = time.perf_counter()
+                digest.unchanged(body)
+                best = min(best, time.perf_counter() - t0)
+            peaks = [
+                peak_memory(fn, body, key) for fn in (consume_loads, consume_stream)
+            ]
+            print(
+                f"{name:<7} {n:>6}  {len(body) / 1024:>6.0f}  {timings[0] * 1000:>10.1f}"
+                f"  {timings[1] * 1000:>10.1f}  {best * 1000:>10.2f}"
+                f"  {peaks[0] / 2**20:>18.1f}  {peaks[1] / 2**20:>18.1f}"
+            )
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def event_ts(minute: int, now: dt.datetime) -> float:
+    # minuta od pulnoci (Praha) -> unix cas, nejblizsi nasledujici `now - 12h`
+    tm = dt.datetime.combine(now.date(), dt.time(minute // 60, minute % 60), fake.TZ)
+    if tm > now + dt.timedelta(hours=12):
+        tm -= dt.timedelta(days=1)
+    return tm.timestamp()
+
+
+def freshness_dl(app, dbfile, started):
+    # zpozdeni zapisu dojezdu vlaku za okamzikem, kdy ve fake serveru dojel
+    now = dt.datetime.now(fake.TZ)
+    lags = []
+    conn = sqlite3.connect(dbfile)
+    for tid, updated in conn.execute("SELECT id, aktualizovano FROM vlaky WHERE dojel"):
+        train = app.fleet[tid]
+        event = event_ts(fake.event_minute(train, len(train.stations) - 1), now)
+        if event >= started:
+            lags.append(dt.datetime.fromisoformat(updated).timestamp() - event)
+    return lags
+
+
+def freshness_datel(app, dbfile, started):
+    # zpozdeni zapisu posledni potvrzene stanice za okamzikem, kdy ji vlak projel
+    now = dt.datetime.now(fake.TZ)
+    by_name = {t.name: t for t in app.fleet.values()}
+    lags = []
+    conn = sqlite3.connect(dbfile)
+    for name, station, updated in conn.execute(
+        "SELECT cislo, posledni_potvrzena_stanice, aktualizovano FROM vlaky"
+    ):
+        train = by_name[name]
+        event = event_ts(fake.event_minute(train, train.stations.index(station)), now)
+        if event >= started:
+            lags.append(dt.datetime.fromisoformat(updated).timestamp() - event)
+    return lags
+
+
+COLLECTORS = {
+    # skript: (db, endpointy, radek s delkou kola, freshness)
+    "dl.py": (
+        "vlaky.db",
+        ("GetTrainsWithFilter", "RouteInfo"),
+        "Kolo trvalo",
+        freshness_dl,
+    ),
+    "datel.py": ("prehled.db", ("request2.php",), "Tick zpracovan za", freshness_datel),
+}
+
+
+def bench_e2e(args):
+    app = fake.FakeGrapp(
+        fake.make_fleet(args.trains),
+        latency=args.latency,
+        error_rate=args.error_rate,
+        expiry_rate=args.expiry_rate,
+    )
+    server, url = fake.start(app)
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, GRAPP_URL=url, MAPY_URL=url, GRAPPER_RPS=str(args.rps))
+    env.pop("CI", None)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        started = time.time()
+        procs = dict()
+        for name in args.collectors.split(","):
+            # do souboru, ne do pipe - plna pipe by kolektor zablokovala
+            with open(os.path.join(tmp, name + ".log"), "w") as flog:
+                procs[name] = subprocess.Popen(
+                    [sys.executable, os.path.join(here, name)],
+                    cwd=tmp,
+                    env=env,
+                    stdout=flog,
+                    stderr=subprocess.STDOUT,
+                )
+        time.sleep(args.duration)
+        for proc in procs.values():
+            proc.terminate()
+            proc.wait()
+        took = time.time() - started
+        logs = dict()
+        for name in procs:
+            with open(os.path.join(tmp, name + ".log")) as flog:
+                logs[name] = flog.read()
+
+        print(f"{args.trains} vlaku, {args.duration}s, latence {args.latency}s")
+        problems = []
+        for name, log in logs.items():
+            dbfile, endpoints, cycle_line, freshness = COLLECTORS[name]
+            cycles = [float(j) for j in re.findall(cycle_line + r" ([\d.]+)s", log)]
+            rows = sum(int(j) for j in re.findall(r"Zapsano (\d+) zmen do db", log))
+            requests = [j for j in app.log if j[1] in endpoints]
+            errors = sum(1 for j in requests if j[2] >= 400)
+            lags = freshness(app, os.path.join(tmp, dbfile), started)
+            print(f"== {name}")
+            print(
+                f"kolo: prumer {sum(cycles) / max(len(cycles), 1):.2f}s, "
+                f"max {max(cycles, default=0):.2f}s ({len(cycles)} kol)"
+            )
+            print(f"pozadavky: {len(requests) / took:.1f}/s ({errors} chyb)")
+            print(f"db: {rows / took:.1f} radku/s")
+            print(
+                f"cerstvost: p50 {percentile(lags, 0.5):.1f}s, "
+                f"p99 {percentile(lags, 0.99):.1f}s ({len(lags)} udalosti)"
+            )
+            # kontroly pro CI: cisty konec po SIGTERM, zadna chyba zapisu ani
+            # vyjimka, neco v db a dl.py aspon --min-rps pozadavku (datel.py se
+            # pta jednou za tick, tam strop nema smysl)
+            if procs[name].returncode != 0:
+                problems.append(f"{name}: skoncil s kodem {procs[name].returncode}")
+            if log.count("Zapis do db selhal"):
+                problems.append(
+                    f"{name}: {log.count('Zapis do db selhal')}x chyba zapisu"
+                )
+            if "Traceback" in log:
+                problems.append(f"{name}: vyjimka v logu")
+            if not rows:
+                problems.append(f"{name}: nic nezapsal")
+            if name == "dl.py" and len(requests) / took < args.min_rps:
+                problems.append(f"{name}: {len(requests) / took:.1f} pozadavku/s")
+
+    server.shutdown()
+    for problem in problems:
+        print(f"CHYBA {problem}")
+    if problems:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("fetch", help="delka jednoho kola RouteInfo podle soubeznosti")
+    p.add_argument("--trains", type=int, default=300)
+    p.add_argument("--latency", type=float, default=0.1)
+    p.add_argument("--rps", type=float, default=1000)
+    p.add_argument("--concurrency", default="1,2,4,8,16")
+    p.add_argument("--parsers", type=int, default=0)
+    p.set_defaults(func=bench_fetch)
+
+    p = sub.add_parser("writer", help="radky/s do sqlite pred a po davkovani")
+    p.add_argument("--rows", type=int, default=1000)
+    p.add_argument("--cycles", type=int, default=5)
+    p.set_defaults(func=bench_writer)
+
+    p = sub.add_parser("rollup", help="souhrny zpozdeni: cena zapisu a rychlost dotazu")
+    p.add_argument("--sizes", default="10000,100000,1000000")
+    p.set_defaults(func=bench_rollup)
+
+    p = sub.add_parser("routeinfo", help="rychlost a shoda parseru RouteInfo")
+    p.add_argument("--corpus", default="fixtures/routeinfo")
+    p.add_argument("--generated", type=int, default=200)
+    p.add_argument("--rounds", type=int, default=5)
+    p.set_defaults(func=bench_routeinfo)
+
+    p = sub.add_parser("memory", help="pamet all_routes: Route vs StoredRoute")
+    p.add_argument("--sizes", default="1000,10000,100000")
+    p.add_argument("--distinct", type=int, default=1000)
+    p.set_defaults(func=bench_memory)
+
+    p = sub.add_parser("partitions", help="zapis a start: jeden soubor vs oddily")
+    p.add_argument("--days", type=int, default=60)
+    p.add_argument("--rows", type=int, default=10000)
+    p.add_argument("--updates", type=int, default=3)
+    p.set_defaults(func=bench_partitions)
+
+    p = sub.add_parser("timeline", help="casy na zastavkach: radky vs bloby")
+    p.add_argument("--trains", type=int, default=1500)
+    p.add_argument("--polls", type=int, default=30)
+    p.add_argument("--change", type=float, default=0.2)
+    p.set_defaults(func=bench_timeline)
+
+    p = sub.add_parser("positions", help="polohy vlaku: radky vs useky s bloby")
+    p.add_argument("--trains", type=int, default=1000)
+    p.add_argument("--hours", type=float, default=12)
+    p.set_defaults(func=bench_positions)
+
+    p = sub.add_parser("rate", help="pevny strop vs AIMD pri zpomaleni a vypadku")
+    p.add_argument("--trains", type=int, default=300)
+    p.add_argument("--rps", type=float, default=4)
+    p.add_argument("--concurrency", type=int, default=4)
+    p.add_argument("--phases", default="30:0.02:0,20:1.5:0,30:0.02:1,40:0.02:0")
+    p.set_defaults(func=bench_rate)
+
+    p = sub.add_parser("datel", help="tick datel.py: po radcich vs po sloupcich")
+    p.add_argument("--sizes", default="1000,10000,100000")
+    p.add_argument("--rounds", type=int, default=3)
+    p.set_defaults(func=bench_datel)
+
+    p = sub.add_parser("payload", help="json.loads vs proud po prvcich, otisk")
+    p.add_argument("--sizes", default="1000,10000")
+    p.add_argument("--rounds", type=int, default=3)
+    p.set_defaults(func=bench_payload)
+
+    p = sub.add_parser("e2e", help="dl.py a datel.py proti fake serveru")
+    p.add_argument("--trains", type=int, default=1500)
+    p.add_argument("--duration", type=float, default=120)
+    p.add_argument("--latency", type=float, default=0.05)
+    p.add_argument("--error-rate", type=float, default=0.0)
+    p.add_argument("--expiry-rate", type=float, default=0.0)
+    p.add_argument("--rps", type=float, default=20)
+    p.add_argument("--collectors", default="dl.py,datel.py")
+    p.add_argument(
+        "--min-rps", type=float, default=0, help="min. pozadavku/s dl.py (pro CI)"
+    )
+    p.set_defaults(func=bench_e2e)
+
+    args = parser.parse_args()
+    args.func(args)
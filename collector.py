@@ -0,0 +1,134 @@
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import time
+from urllib.parse import urlsplit
+
+import archive
+import metrics
+import pipeline
+import pool
+import scheduler
+import writer
+
+# jeden proces pro vsechny zdroje (grapp = dl.py, mapy = datel.py): jedna
+# asyncio smycka, sdileny HTTP pool, strop pozadavku, writer a metriky
+# python collector.py --sources grapp,mapy
+# zdroj ma `name`, `async step()` (jedno kolo, vraci cas dalsiho) a `close()`
+
+# po spadlem kole zdroje to zkusime znovu za tolik sekund
+RETRY = 15
+
+
+async def drive(sources, http_pool, once: bool, limiter=None):
+    by_name = {source.name: source for source in sources}
+    sched = scheduler.Scheduler()
+    for name in by_name:
+        sched.schedule(name, 0)
+    running = dict()  # task -> jmeno zdroje
+
+    while running or (len(sched) and not pipeline.stopping.is_set()):
+        if not pipeline.stopping.is_set():
+            for name in sched.pop_due():
+                running[asyncio.ensure_future(by_name[name].step())] = name
+
+        # aspon jednou za sekundu se podivame, jestli nemame koncit
+        next_due = sched.next_due()
+        timeout = 1.0 if next_due is None else min(1.0, next_due - time.time())
+        timeout = max(timeout, 0)
+        if not running:
+            await asyncio.sleep(timeout)
+            continue
+        done, _ = await asyncio.wait(
+            running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+        )
+        for task in done:
+            name = running.pop(task)
+            try:
+                wake = task.result()
+            except Exception:
+                if once:
+                    raise
+                metrics.ERRORS.labels(name).inc()
+                logging.exception(
+                    "Zdroj %s spadl, zkusime to znovu za %ds", name, RETRY
+                )
+                wake = time.time() + RETRY
+            # pool je sdileny, cisla jsou za vsechny zdroje od minuleho vypisu
+            logging.info("HTTP: %s", http_pool.report())
+            http_pool.reset_stats()
+            if limiter is not None:
+                logging.info("Strop pozadavku: %s", limiter.report())
+            if not once:
+                sched.schedule(name, wake)
+
+
+def run(sources, http_pool, once: bool = False, limiter=None):
+    try:
+        asyncio.run(drive(sources, http_pool, once, limiter))
+    finally:
+        for source in sources:
+            source.close()
+
+
+if __name__ == "__main__":
+    import datel
+    import dl
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sources", default="grapp,mapy", help="grapp, mapy nebo oba")
+    parser.add_argument("--archive", help="adresar, kam archivovat surove odpovedi")
+    parser.add_argument(
+        "--metrics",
+        type=int,
+        default=os.environ.get("GRAPPER_METRICS_PORT"),
+        help="port pro /metrics (Prometheus), bez nej se nic nesbira",
+    )
+    args = parser.parse_args()
+    enabled = set(args.sources.split(","))
+    if enabled - {"grapp", "mapy"}:
+        parser.error(f"neznamy zdroj: {', '.join(sorted(enabled - {'grapp', 'mapy'}))}")
+
+    logging.basicConfig(
+        format="%(asctime)s %(levelname)s %(message)s", datefmt="%Y-%m-%d %H:%M:%S %Z"
+    )
+    logging.getLogger().setLevel(logging.INFO)
+    is_ci = os.environ.get("CI") is not None
+
+    # mapy maji problem s certifikatem, overeni vypiname jen pro ne
+    http_pool = pool.Pool(
+        cookie_jar=dl.cookie_jar,
+        timeout=dl.HTTP_TIMEOUT,
+        contexts={urlsplit(datel.MAPY_URL).hostname: datel.insecure_context()},
+    )
+    dl.http_pool = http_pool
+    # strop se ridi odezvou serveru (AIMD + jistic), viz pipeline.RateController
+    limiter = pipeline.RateController(dl.FETCH_RPS)
+    tw = writer.ThreadedWriter()
+
+    archives = []
+    sources = []
+    if "grapp" in enabled:
+        if args.archive:
+            dl.raw_archive = archive.Archive(args.archive, dl.ARCHIVE_SOURCE)
+            archives.append(dl.raw_archive)
+        sources.append(dl.GrappSource(dl.Session(), tw, limiter, is_ci))
+    if "mapy" in enabled:
+        raw_archive = None
+        if args.archive:
+            raw_archive = archive.Archive(args.archive, datel.ARCHIVE_SOURCE)
+            archives.append(raw_archive)
+        sources.append(datel.MapySource(http_pool, tw, limiter, raw_archive))
+    if args.metrics:
+        metrics.serve(args.metrics)
+
+    signal.signal(signal.SIGTERM, pipeline.on_sigterm)
+    try:
+        run(sources, http_pool, once=is_ci, limiter=limiter)
+    finally:
+        tw.close()
+        for raw_archive in archives:
+            raw_archive.close()
+    logging.info("Konec")
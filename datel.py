@@ -1,12 +1,32 @@
-import json
+import argparse
+import asyncio
+import http.client
 import logging
 import os
+import signal
 import ssl
-import sqlite3
 import time
 import datetime as dt
-import zoneinfo
-from urllib.request import urlopen
+import functools
+import itertools
+import operator
+
+import archive
+import collector
+import metrics
+import partition
+import payload
+import pipeline
+import pool
+import positions
+import timeutil
+import writer
+from timeutil import datetime_from_stringtime
+
+try:
+    import numpy as np
+except ImportError:  # numpy je volitelne, bez nej se tick zpracuje po radcich
+    np = None
 
 SQLITE_TRAINS = """
 CREATE TABLE vlaky (
@@ -26,197 +46,595 @@ CREATE TABLE vlaky (
     UNIQUE(cislo, nazev, provozovatel, datum_odjezd)
 )
 """
+SQLITE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS vlaky_datum_odjezd ON vlaky(datum_odjezd)",
+    "CREATE INDEX IF NOT EXISTS vlaky_aktualizovano ON vlaky(aktualizovano)",
+]
+
+# pri deleni db (partition.py) se do noveho oddilu prenasi jen vlaky, ktere jeste
+# nedorazily do cilove stanice; dojete zustanou ve svem oddilu (a po prechodu
+# je uz nezname, viz MapySource.step), jinak by se cely den stehoval do
+# dalsiho; a jen vlaky zapsane den pred novym oddilem (:start, viz
+# partition.prepare), starsi uz se nezmeni
+CARRY_TRAINS = """posledni_potvrzena_stanice IS NOT stanice_cilova
+    AND aktualizovano >= date(:start, '-1 day')"""
+
+UPSERT_TRAIN = """INSERT INTO vlaky VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT DO UPDATE SET
+        aktualizovano=excluded.aktualizovano,
+        posledni_potvrzena_stanice=excluded.posledni_potvrzena_stanice,
+        ocekavany_prijezd=excluded.ocekavany_prijezd,
+        realny_prijezd=excluded.realny_prijezd
+"""
 # delka_cesty_minut INT NOT NULL, -- TODO: generated always as (stejne jako dalsi dva)
 # zpozdeni_odjezd INT,
 # zpozdeni_prijezd INT,
 
 
-# e.g. 15:03 -> 2023-01-30 15:03 or 2023-01-29 15:03 (whichever is more likely depending on `now`)
-def datetime_from_stringtime(tm, now):
-    today = now.date()
-    yesterday = today - dt.timedelta(days=1)
-    tomorrow = today + dt.timedelta(days=1)
-    for day in [today, yesterday, tomorrow]:
-        hour, _, minute = tm.partition(":")
-        cmb = dt.datetime.combine(
-            day, dt.time(hour=int(hour), minute=int(minute)), tzinfo=SZ_TZ
+class KnownTrains:
+    # klice (datum_odjezd, cislo, nazev, provozovatel), ktere uz mame v db, at
+    # se nemusime ptat db na kazdy vlak v kazdem ticku; drzime jen vcera az
+    # zitra, dal datetime_from_stringtime stejne nesahne
+    def __init__(self, conn, today: dt.date):
+        self.keys = set()
+        self.today = None
+        self.roll(today)
+        self.keys.update(
+            conn.execute(
+                "SELECT datum_odjezd, cislo, nazev, provozovatel FROM vlaky WHERE datum_odjezd >= ?",
+                (self.oldest,),
+            )
         )
-        diff = max(now, cmb) - min(now, cmb)
-        if diff.total_seconds() < 8 * 3600:
-            return cmb
+        logging.info("Nacteno %d znamych vlaku z db", len(self.keys))
+
+    def roll(self, today: dt.date):
+        if today == self.today:
+            return
+        self.today = today
+        self.oldest = (today - dt.timedelta(days=1)).isoformat()
+        self.keys = {key for key in self.keys if key[0] >= self.oldest}
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def add(self, key):
+        if key[0] >= self.oldest:
+            self.keys.add(key)
+
+    def update(self, keys):
+        self.keys.update(key for key in keys if key[0] >= self.oldest)
+
+
+def diff_snapshot(prev, features, each=None):
+    # porovna tick s predchozim; dal zpracovavame jen nove a zmenene vlaky,
+    # vetsina vlaku se mezi ticky nezmeni; `features` staci projit jednou
+    # (i generator z payload.iter_array), `each` dostane kazdy vlak
+    snapshot, changed, new = dict(), [], 0
+    for el in features:
+        if each is not None:
+            each(el)
+        props = el["properties"]
+        ident = (props.get("tt"), props.get("tn"), props.get("na"), props.get("d"))
+        state = (props.get("cna"), props.get("cp"), props.get("cr"), props.get("de"))
+        snapshot[ident] = state
+        if ident not in prev:
+            new += 1
+            changed.append(el)
+        elif prev[ident] != state:
+            changed.append(el)
 
-    # raise ValueError(f"cannot match time to day: {tm}")
-    return None
+    counts = dict(
+        new=new,
+        changed=len(changed) - new,
+        vanished=len(prev.keys() - snapshot.keys()),
+        unchanged=len(snapshot) - len(changed),
+    )
+    return snapshot, changed, counts
 
 
-URL = r"https://mapy.spravazeleznic.cz/serverside/request2.php?module=Layers\OsVlaky&&action=load"
-SZ_TZ = zoneinfo.ZoneInfo("Europe/Prague")
+# da se prepsat na lokalni fake server (viz fake.py)
+MAPY_URL = os.environ.get("MAPY_URL", "https://mapy.spravazeleznic.cz")
+URL = MAPY_URL + r"/serverside/request2.php?module=Layers\OsVlaky&&action=load"
+# chyby, po kterych tick vynechame (a neshodime tim kolektor)
+FETCH_ERRORS = (OSError, http.client.HTTPException, pool.HTTPError)
+SZ_TZ = timeutil.TZ
 
 FETCH_EVERY = dt.timedelta(seconds=15)
-CACHE_DIR = "cache"
+# tick po sloupcich (tick_rows_batch), kdyz je numpy; GRAPPER_DATEL_BATCH=0 vypne
+BATCH = np is not None and os.environ.get("GRAPPER_DATEL_BATCH", "1") != "0"
+ARCHIVE_SOURCE = "mapy"
 
-if __name__ == "__main__":
+# /metrics (--metrics PORT), viz metrics.py
+FETCH_FEED_SECONDS = metrics.FETCH_SECONDS.labels("request2.php")
+TICK_SECONDS = metrics.histogram("grapper_tick_seconds", "Zpracovani jednoho ticku")
+FEED_SIZE = metrics.gauge("grapper_feed_trains", "Vlaky v poslednim ticku feedu")
+CHANGED_TRAINS = metrics.gauge(
+    "grapper_feed_changed_trains", "Nove a zmenene vlaky v poslednim ticku"
+)
+DIFF_TRAINS = metrics.gauge(
+    "grapper_feed_diff_trains",
+    "Vlaky v poslednim ticku podle porovnani s predchozim (viz diff_snapshot)",
+    ("kind",),
+)
+TICK_LAG = metrics.gauge(
+    "grapper_tick_lag_seconds", "Od stazeni feedu po zapis do db (zpozdeni dat)"
+)
+
+
+def tick_rows(changed, known, now) -> list:
+    # radky pro UPSERT_TRAIN z novych a zmenenych vlaku, po jednom
+    rows = []
+    for el in changed:
+        props = el["properties"]
+        if props["type"] != "V":
+            logging.info("preskakujeme zaznam, ma neznamy typ: %s", props["type"])
+            continue
+
+        train_no = props["tt"] + " " + props["tn"]  # e.g. EC + 332
+        train_name = props["na"]
+        dep_st = props["fn"]
+        dest_st = props["ln"]
+        latest_st = props["cna"]
+        carrier = props["d"]
+        delay = props["de"]
+        planned_time = datetime_from_stringtime(props["cp"], now=now)
+        real_time = datetime_from_stringtime(props["cr"], now=now)
+        if planned_time is None or real_time is None:
+            # TODO: loguj tohle do JSON a inspektuj - tady je nejaka divna vec, kdy nam to
+            # hlasi stary vlak - nebo nejakej, co jel dlouho?
+            logging.info("Problem s casem: %s %s", planned_time, real_time)
+            metrics.ERRORS.labels("cas").inc()
+            continue
+
+        departure_planned, departure_real = planned_time, real_time
+        arrival_planned, arrival_real = planned_time, real_time
+
+        # only departures and arrivals
+        # nakonec jsme to kvuli tomu, ze preshranicni vlaky neumime zpracovat,
+        # protoze nemame mereni ze zahranici
+        # if not ((latest_st == dep_st) or (latest_st == dest_st)):
+        #     continue
+
+        # TODO: prespulnocni vlaky nebudou fungovat
+        date = planned_time.date().isoformat()
+        key = (date, train_no, train_name, carrier)
+        # nemame vlak v db a zaroven uz je na ceste - musime skipnout
+        if key not in known and latest_st != dep_st:
+            continue
+
+        # TODO: tohle reimplementoavt?
+
+        # # UNIQUE(cislo, nazev, provozovatel, datum_odjezd)
+        # last = conn.execute(
+        #     "SELECT ocekavany_odjezd, realny_prijezd FROM vlaky WHERE cislo = ? AND nazev = ? AND provozovatel = ? ORDER BY aktualizovano DESC LIMIT 1",
+        #     (train_no, train_name, carrier),
+        # ).fetchall()
+
+        # ts = dt.datetime.fromisoformat(last[0][0])
+        # if ts < dt.datetime.now(SZ_TZ) - dt.timedelta(hours=12):
+        #     logging.info(
+        #         "Vlak %s %s (%s) nejspis nepatri k nam do dat",
+        #         train_no,
+        #         train_name,
+        #         carrier,
+        #     )
+        #     continue
+        # date = ts.date()
+        # logging.info("Prijezd: %s %s (%s)", train_no, train_name, carrier)
+
+        # TODO: asi by bylo cistsi ziskat si ID v tom prijezdu a podle nej udelat UPDATE
+        # a v te druhe branch udelat jednoduchy INSERT
+        rows.append(
+            (
+                now.isoformat(),
+                now.isoformat(),
+                train_no,
+                train_name,
+                carrier,
+                date,
+                dep_st,
+                dest_st,
+                departure_planned.isoformat(),
+                departure_real.isoformat(),
+                latest_st,
+                arrival_planned.isoformat() if arrival_planned else None,
+                arrival_real.isoformat() if arrival_real else None,
+            )
+        )
+        known.add(key)
+
+    return rows
+
+
+@functools.lru_cache(maxsize=4)
+def iso_table(today: dt.date):
+    # isoformat() pro vcera, dnes a zitra (radek = posun dne + 1) a kazdou
+    # minutu dne, presne jako u datetime_from_stringtime (vcetne prechodu na
+    # letni cas)
+    return np.array(
+        [
+            [
+                dt.datetime.combine(
+                    today + dt.timedelta(days=offset),
+                    timeutil.from_minutes(minute),
+                    tzinfo=SZ_TZ,
+                ).isoformat()
+                for minute in range(24 * 60)
+            ]
+            for offset in (-1, 0, 1)
+        ],
+        dtype=object,
+    )
+
+
+def resolve_times(strings, now):
+    # datetime_from_stringtime pro cely sloupec naraz -> (posun dne -1/0/1,
+    # minuta od pulnoci, nalezeno); "HH:MM" se rozlozi primo z kodu znaku,
+    # cokoli jineho jde po jednom skalarni cestou (i s jejimi vyjimkami)
+    arr = np.asarray(strings, dtype=str)
+    n, width = len(arr), arr.dtype.itemsize // 4
+    regular = np.zeros(n, dtype=bool)
+    minutes = np.zeros(n, dtype=np.int64)
+    if n and width >= 5:
+        codes = arr.view(np.uint32).reshape(n, width).astype(np.int64)
+        digits = codes[:, [0, 1, 3, 4]] - ord("0")
+        regular = ((digits >= 0) & (digits <= 9)).all(axis=1)
+        regular &= codes[:, 2] == ord(":")
+        regular &= (codes[:, 5:] == 0).all(axis=1)
+        hours = digits[:, 0] * 10 + digits[:, 1]
+        mins = digits[:, 2] * 10 + digits[:, 3]
+        regular &= (hours < 24) & (mins < 60)
+        minutes = np.where(regular, hours * 60 + mins, 0)
+
+    # rozdil od `now` v mistnim case (tak ho pocita i datetime_from_stringtime,
+    # now i kandidat maji stejnou zonu), v mikrosekundach at je presny;
+    # do 8 hodin se muze trefit nejvys jeden ze tri dnu
+    day = 24 * 3600 * 10**6
+    limit = 8 * 3600 * 10**6
+    now_us = (now.hour * 3600 + now.minute * 60 + now.second) * 10**6 + now.microsecond
+    delta = minutes * 60 * 10**6 - now_us
+    offsets = np.select(
+        [
+            np.abs(delta) < limit,
+            np.abs(delta - day) < limit,
+            np.abs(delta + day) < limit,
+        ],
+        [0, -1, 1],
+        default=2,
+    )
+    for j in np.flatnonzero(~regular):
+        tm = datetime_from_stringtime(strings[j], now=now)
+        if tm is None:
+            offsets[j] = 2
+        else:
+            offsets[j] = (tm.date() - now.date()).days
+            minutes[j] = tm.hour * 60 + tm.minute
+    found = offsets != 2
+    return np.where(found, offsets, 0), minutes, found
+
+
+FIELDS = [
+    operator.itemgetter(key)
+    for key in ("tt", "tn", "na", "fn", "ln", "cna", "d", "cp", "cr")
+]
+
+
+def tick_rows_batch(changed, known, now) -> list:
+    # totez co tick_rows (stejne radky ve stejnem poradi), ale po sloupcich:
+    # casy, vyber dne a data odjezdu jsou jedna operace nad celym tickem;
+    # `now` musi byt v SZ_TZ
+    props = [el["properties"] for el in changed]
+    if any(p["type"] != "V" for p in props):
+        for p in props:
+            if p["type"] != "V":
+                logging.info("preskakujeme zaznam, ma neznamy typ: %s", p["type"])
+        props = [p for p in props if p["type"] == "V"]
+    if not props:
+        return []
+    columns = [np.array(list(map(get, props)), dtype=object) for get in FIELDS]
+    tt, tn, names, dep, dest, latest, carriers, cp, cr = columns
+
+    planned_off, planned_min, planned_ok = resolve_times(cp, now)
+    real_off, real_min, real_ok = resolve_times(cr, now)
+    table = iso_table(now.date())
+    for j in np.flatnonzero(~(planned_ok & real_ok)):
+        # stejna hlaska jako v tick_rows, bez opakovaneho parsovani
+        planned_time, real_time = [
+            dt.datetime.fromisoformat(table[off[j] + 1, mins[j]]) if found[j] else None
+            for off, mins, found in (
+                (planned_off, planned_min, planned_ok),
+                (real_off, real_min, real_ok),
+            )
+        ]
+        logging.info("Problem s casem: %s %s", planned_time, real_time)
+        metrics.ERRORS.labels("cas").inc()
+
+    days = np.array(
+        [(now.date() + dt.timedelta(days=j)).isoformat() for j in (-1, 0, 1)],
+        dtype=object,
+    )
+    idx = np.flatnonzero(planned_ok & real_ok)
+    train_no = tt[idx] + " " + tn[idx]  # po prvcich, e.g. EC + 332
+    date = days[planned_off[idx] + 1]
+    keys = list(zip(date, train_no, names[idx], carriers[idx]))
+
+    # nemame vlak v db a zaroven uz je na ceste - musime skipnout
+    passing = latest[idx] == dep[idx]
+    passing |= np.fromiter(
+        map(known.keys.__contains__, keys), dtype=bool, count=len(keys)
+    )
+    rest = np.flatnonzero(~passing)
+    if len(rest):
+        # stejny vlak vic v jednom ticku: skalarni cesta ho po prvnim zapisu zna
+        late = {keys[j] for j in rest} & set(itertools.compress(keys, passing))
+        if late:
+            first = dict()
+            for j in np.flatnonzero(passing).tolist():
+                if keys[j] in late:
+                    first.setdefault(keys[j], j)
+            for j in rest.tolist():
+                if first.get(keys[j], len(keys)) < j:
+                    passing[j] = True
+
+    sel = idx[passing]
+    planned = table[planned_off[sel] + 1, planned_min[sel]]
+    real = table[real_off[sel] + 1, real_min[sel]]
+    stamp = itertools.repeat(now.isoformat())
+    planned, real = planned.tolist(), real.tolist()
+    rows = list(
+        zip(
+            stamp,
+            stamp,
+            train_no[passing].tolist(),
+            names[sel].tolist(),
+            carriers[sel].tolist(),
+            date[passing].tolist(),
+            dep[sel].tolist(),
+            dest[sel].tolist(),
+            planned,
+            real,
+            latest[sel].tolist(),
+            planned,
+            real,
+        )
+    )
+    known.update(itertools.compress(keys, passing))
+    return rows
+
+
+def process_tick(db, known, snapshot, body, now, each=None) -> dict:
+    # zpracuje jeden tick feedu (surova odpoved), vraci novy snapshot (viz
+    # diff_snapshot); vlaky se dekoduji po jednom, cely strom z json.loads
+    # se nikdy nepostavi, `each` dostane kazdy vlak (polohy)
+    t0 = time.perf_counter()
+    header = dict()
+    snapshot, changed, counts = diff_snapshot(
+        snapshot, payload.iter_array(body, "result", header), each
+    )
+    assert header.get("success")
+    logging.info("Mame %s vlaku v pohybu", len(snapshot))
+    FEED_SIZE.set(len(snapshot))
+
+    out_there = {
+        j[0]
+        for j in db.conn.execute(
+            "SELECT cislo FROM vlaky WHERE stanice_cilova != posledni_potvrzena_stanice ORDER BY aktualizovano DESC LIMIT 100"
+        )
+    }
+    in_data = {f"{tt} {tn}" for tt, tn, _, _ in snapshot}
+
+    if out_there - in_data:
+        logging.info(
+            "Cekame na vlaky %s, ale nejsou v datech",
+            sorted(out_there - in_data),
+        )
+
+    CHANGED_TRAINS.set(len(changed))
+    for kind, count in counts.items():
+        DIFF_TRAINS.labels(kind).set(count)
+    logging.info(
+        "Novych vlaku: %d, zmenenych: %d, zmizelo: %d, beze zmeny: %d",
+        counts["new"],
+        counts["changed"],
+        counts["vanished"],
+        counts["unchanged"],
+    )
+
+    known.roll(now.date())
+    if BATCH and now.tzinfo is SZ_TZ:
+        rows = tick_rows_batch(changed, known, now)
+    else:
+        rows = tick_rows(changed, known, now)
+    db.add_many(UPSERT_TRAIN, rows)
+
+    db.flush()
+    TICK_SECONDS.observe(time.perf_counter() - t0)
+    logging.info("Tick zpracovan za %.3fs", time.perf_counter() - t0)
+    return snapshot
+
+
+def insecure_context() -> ssl.SSLContext:
     ctx = ssl.create_default_context()
     ctx.check_hostname = False
     ctx.verify_mode = ssl.CERT_NONE
+    return ctx
 
-    logging.getLogger().setLevel(logging.INFO)
 
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-        handlers=[logging.FileHandler("datel.log"), logging.StreamHandler()],
-    )
+class MapySource:
+    # zdroj pro collector.py: jeden tick feedu OsVlaky za FETCH_EVERY
+    name = "mapy"
 
-    os.makedirs(CACHE_DIR, exist_ok=True)
+    def __init__(self, http_pool, tw, limiter, raw_archive=None):
+        self.http_pool = http_pool
+        self.limiter = limiter
+        self.raw_archive = raw_archive
+        self.parts = partition.Partitioned(
+            tw, "prehled.db", SQLITE_TRAINS, SQLITE_INDEXES, {"vlaky": CARRY_TRAINS}
+        )
+        self.db = self.parts.current()
+        self.known = KnownTrains(self.db.conn, dt.datetime.now(SZ_TZ).date())
+        self.snapshot = dict()
+        self.position_parts = partition.Partitioned(
+            tw, "polohy.db", positions.SCHEMA, positions.INDEXES, copy=positions.COPY
+        )
+        self.positions = positions.PositionStore(self.position_parts.current())
+        self.feed = payload.Digest("request2.php")
 
-    dbfile = "prehled.db"
-    dbexists = os.path.isfile(dbfile)
-    conn = sqlite3.connect(dbfile)
-    if not dbexists:
-        conn.execute(SQLITE_TRAINS)
+    def close(self):
+        # rozpracovane useky poloh by se jinak ztratily
+        self.positions.flush()
 
-    run = True
-    is_ci = is_ci = os.environ.get("CI") is not None
-    last_fetch = dt.datetime.now() - dt.timedelta(hours=1)
+    def fetch(self):
+        with FETCH_FEED_SECONDS.time():
+            return self.http_pool.request(URL)
 
-    while run:
-        if is_ci:
-            logging.info("Spoustim v CI, koncim po jednom kole")
-            run = False
+    async def step(self) -> float:
+        loop = asyncio.get_running_loop()
+        await self.limiter.wait()
+        if pipeline.stopping.is_set():
+            return time.time()
+        fetched_at = time.time()
+        try:
+            rr = await loop.run_in_executor(None, self.fetch)
+        except FETCH_ERRORS as e:
+            # tick vynechame, dalsi az to regulator pusti
+            metrics.ERRORS.labels(type(e).__name__).inc()
+            logging.info("Feed se nepodarilo stahnout: %r", e)
+            self.limiter.failure(e)
+            return time.time() + self.limiter.delay()
+        self.limiter.success()
+        if self.raw_archive:
+            self.raw_archive.append("feed", rr.body)
 
-        delta = dt.datetime.now() - last_fetch
-        if delta < FETCH_EVERY:
+        if self.feed.unchanged(rr.body):
+            # feed se obcas neobnovi; stejne bajty = stejny snapshot, jen
+            # polohy stojicich vlaku posuneme v case
             logging.info(
-                "Naposledy nacteno %s, cekam %s do dalsiho ticku",
-                last_fetch,
-                FETCH_EVERY - delta,
+                "Feed beze zmeny, tick preskakujeme (%d. preskok)", self.feed.skipped
             )
-            time.sleep((FETCH_EVERY - delta).total_seconds())
-
-        last_fetch = dt.datetime.now()
-        with urlopen(URL, context=ctx) as rr:
-            data = json.load(rr)
-
-            # with open(
-            #     os.path.join(CACHE_DIR, last_fetch.isoformat() + ".json"), "wt"
-            # ) as fw:
-            #     for el in data["result"]:
-            #         json.dump(el, fw, ensure_ascii=False)
-            #         fw.write("\n")
-
-            # data = json.load(open("payload.json"))
-            assert data["success"]
-            logging.info("Mame %s vlaku v pohybu", len(data["result"]))
-
-            out_there = {
-                j[0]
-                for j in conn.execute(
-                    "SELECT cislo FROM vlaky WHERE stanice_cilova != posledni_potvrzena_stanice ORDER BY aktualizovano DESC LIMIT 100"
-                )
-            }
-            in_data = {
-                j["properties"]["tt"] + " " + j["properties"]["tn"]
-                for j in data["result"]
-            }
-
-            if out_there - in_data:
-                logging.info(
-                    "Cekame na vlaky %s, ale nejsou v datech",
-                    sorted(out_there - in_data),
-                )
-
+            await loop.run_in_executor(None, self.positions.touch, fetched_at)
+        else:
             now = dt.datetime.now(SZ_TZ)
-            for el in data["result"]:
-                props = el["properties"]
-                if props["type"] != "V":
-                    logging.info(
-                        "preskakujeme zaznam, ma neznamy typ: %s", props["type"]
-                    )
-                    continue
-
-                train_no = props["tt"] + " " + props["tn"]  # e.g. EC + 332
-                train_name = props["na"]
-                dep_st = props["fn"]
-                dest_st = props["ln"]
-                latest_st = props["cna"]
-                carrier = props["d"]
-                delay = props["de"]
-                planned_time = datetime_from_stringtime(props["cp"], now=now)
-                real_time = datetime_from_stringtime(props["cr"], now=now)
-                if planned_time is None or real_time is None:
-                    # TODO: loguj tohle do JSON a inspektuj - tady je nejaka divna vec, kdy nam to
-                    # hlasi stary vlak - nebo nejakej, co jel dlouho?
-                    logging.info("Problem s casem: %s %s", planned_time, real_time)
-                    continue
-
-                departure_planned, departure_real = planned_time, real_time
-                arrival_planned, arrival_real = planned_time, real_time
-
-                # only departures and arrivals
-                # nakonec jsme to kvuli tomu, ze preshranicni vlaky neumime zpracovat,
-                # protoze nemame mereni ze zahranici
-                # if not ((latest_st == dep_st) or (latest_st == dest_st)):
-                #     continue
-
-                # TODO: prespulnocni vlaky nebudou fungovat
-                date = planned_time.date().isoformat()
-                have = conn.execute(
-                    "SELECT count(*) FROM vlaky WHERE datum_odjezd = ? AND cislo = ? AND nazev = ? AND provozovatel = ?",
-                    (date, train_no, train_name, carrier),
-                ).fetchall()
-                # nemame vlak v db a zaroven uz je na ceste - musime skipnout
-                if have[0][0] == 0 and latest_st != dep_st:
-                    continue
-
-                # TODO: tohle reimplementoavt?
-
-                # # UNIQUE(cislo, nazev, provozovatel, datum_odjezd)
-                # last = conn.execute(
-                #     "SELECT ocekavany_odjezd, realny_prijezd FROM vlaky WHERE cislo = ? AND nazev = ? AND provozovatel = ? ORDER BY aktualizovano DESC LIMIT 1",
-                #     (train_no, train_name, carrier),
-                # ).fetchall()
-
-                # ts = dt.datetime.fromisoformat(last[0][0])
-                # if ts < dt.datetime.now(SZ_TZ) - dt.timedelta(hours=12):
-                #     logging.info(
-                #         "Vlak %s %s (%s) nejspis nepatri k nam do dat",
-                #         train_no,
-                #         train_name,
-                #         carrier,
-                #     )
-                #     continue
-                # date = ts.date()
-                # logging.info("Prijezd: %s %s (%s)", train_no, train_name, carrier)
-
-                # TODO: asi by bylo cistsi ziskat si ID v tom prijezdu a podle nej udelat UPDATE
-                # a v te druhe branch udelat jednoduchy INSERT
-                conn.execute(
-                    """INSERT INTO vlaky VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        ON CONFLICT DO UPDATE SET
-                            aktualizovano=excluded.aktualizovano,
-                            posledni_potvrzena_stanice=excluded.posledni_potvrzena_stanice,
-                            ocekavany_prijezd=excluded.ocekavany_prijezd,
-                            realny_prijezd=excluded.realny_prijezd
-                        """,
-                    (
-                        now.isoformat(),
-                        now.isoformat(),
-                        train_no,
-                        train_name,
-                        carrier,
-                        date,
-                        dep_st,
-                        dest_st,
-                        departure_planned.isoformat(),
-                        departure_real.isoformat(),
-                        latest_st,
-                        arrival_planned.isoformat() if arrival_planned else None,
-                        arrival_real.isoformat() if arrival_real else None,
-                    ),
+            db = await loop.run_in_executor(None, self.parts.current)
+            if db is not self.db:
+                # novy oddil: dojete vlaky zustaly ve starem, at je v novem
+                # nezakladame znovu
+                self.known = await loop.run_in_executor(
+                    None, KnownTrains, db.conn, now.date()
                 )
-                conn.commit()
+                self.db = db
+            self.positions.db = await loop.run_in_executor(
+                None, self.position_parts.current
+            )
+            each = functools.partial(
+                self.positions.add_feature, fetched_at=fetched_at, now=now
+            )
+            self.snapshot = await loop.run_in_executor(
+                None,
+                process_tick,
+                self.db,
+                self.known,
+                self.snapshot,
+                rr.body,
+                now,
+                each,
+            )
+            self.feed.done()
+            await loop.run_in_executor(None, self.positions.tick_done, fetched_at)
+        TICK_LAG.set(time.time() - fetched_at)
+        pipeline.report_rss(self.name)
+        return fetched_at + FETCH_EVERY.total_seconds()
+
+
+def main(is_ci: bool, raw_archive=None):
+    http_pool = pool.Pool(context=insecure_context())
+    tw = writer.ThreadedWriter()
+    try:
+        # jeden pozadavek za tick, z regulatoru se tu uplatni hlavne jistic
+        limiter = pipeline.RateController(1)
+        source = MapySource(http_pool, tw, limiter, raw_archive)
+        collector.run([source], http_pool, once=is_ci, limiter=limiter)
+    finally:
+        tw.close()
+
+
+def replay(directory: str):
+    # prehraje archivovane ticky pres stejne zpracovani, bez cekani a bez site;
+    # do oddilu (GRAPPER_PARTITION) podle casu zaznamu, ne podle hodin
+    tw = writer.ThreadedWriter()
+    try:
+        parts = partition.Partitioned(
+            tw, "prehled.db", SQLITE_TRAINS, SQLITE_INDEXES, {"vlaky": CARRY_TRAINS}
+        )
+        position_parts = partition.Partitioned(
+            tw, "polohy.db", positions.SCHEMA, positions.INDEXES, copy=positions.COPY
+        )
+        db, store, known, snapshot = None, None, None, dict()
+        feed = payload.Digest("request2.php")
+        ticks, t0 = 0, time.perf_counter()
+        for rec in archive.iter_records(directory, ARCHIVE_SOURCE, kind="feed"):
+            now = dt.datetime.fromtimestamp(rec.ts, SZ_TZ)
+            if store is None:
+                store = positions.PositionStore(position_parts.current(rec.ts))
+            else:
+                store.db = position_parts.current(rec.ts)
+            ticks += 1
+            if feed.unchanged(rec.payload):
+                store.touch(rec.ts)
+                continue
+            current = parts.current(rec.ts)
+            if current is not db:
+                # jako MapySource.step: v novem oddilu jen vlaky, ktere tam jsou
+                db = current
+                known = KnownTrains(db.conn, now.date())
+            each = functools.partial(store.add_feature, fetched_at=rec.ts, now=now)
+            snapshot = process_tick(db, known, snapshot, rec.payload, now, each)
+            feed.done()
+            store.tick_done(rec.ts)
+        if store is not None:
+            store.flush()
+        if db is not None:
+            db.flush()
+    finally:
+        tw.close()
+    logging.info(
+        "Prehrano %d ticku (%d beze zmeny) za %.1fs",
+        ticks,
+        feed.skipped,
+        time.perf_counter() - t0,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--archive", help="adresar, kam archivovat surove odpovedi")
+    parser.add_argument("--replay", help="prehraj archiv z adresare misto stahovani")
+    parser.add_argument(
+        "--metrics",
+        type=int,
+        default=os.environ.get("GRAPPER_METRICS_PORT"),
+        help="port pro /metrics (Prometheus), bez nej se nic nesbira",
+    )
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.INFO)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        handlers=[logging.FileHandler("datel.log"), logging.StreamHandler()],
+    )
 
+    if args.replay:
+        replay(args.replay)
+    else:
+        raw_archive = None
+        if args.archive:
+            raw_archive = archive.Archive(args.archive, ARCHIVE_SOURCE)
+        if args.metrics:
+            metrics.serve(args.metrics)
+        signal.signal(signal.SIGTERM, pipeline.on_sigterm)
+        main(os.environ.get("CI") is not None, raw_archive)
 
 # "type": "V", # assert?
 # "a": 11.506427668344378, # podle me neco jako urazena vzdalenost
@@ -1,21 +1,44 @@
+import argparse
+import array
+import asyncio
 import datetime as dt
+import hashlib
+import http.client
 import http.cookiejar
 import json
 import logging
+import multiprocessing
 import os
 import random
-import socket
-import sqlite3
+import signal
+import sys
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import Optional
-from urllib.request import HTTPCookieProcessor, Request, build_opener
 
+import lxml.etree
 import lxml.html
-import zoneinfo
+
+import archive
+import collector
+import metrics
+import partition
+import payload
+import pipeline
+import pool
+import rollup
+import scheduler
+import snapshot
+import timeline
+import timeutil
+import writer
+from timeutil import from_minutes, time_diff, to_minutes
 
 """
--- zakladni analytika
+-- zakladni analytika (db je ve WAL, takze jde pustit i nad bezici stahovackou)
 SELECT
 	provozovatel,
 	count(*) pocet_jizd,
@@ -29,17 +52,54 @@ GROUP BY
 	1
 ORDER BY 2 desc
 LIMIT 100
+
+-- totez bez scanu cele tabulky (ze souhrnu udrzovanych triggery, viz rollup.py)
+-- python rollup.py dopravci
 """
 
 
 HTTP_TIMEOUT = 10
 
-URL_ALL_TRAINS = (
-    "https://grapp.spravazeleznic.cz/post/trains/GetTrainsWithFilter/{APP_ID}"
+# kolik RouteInfo pozadavku muze byt naraz v letu a kolik jich za sekundu
+# smime poslat celkem (at server nezahltime)
+FETCH_CONCURRENCY = int(os.environ.get("GRAPPER_CONCURRENCY", "4"))
+FETCH_RPS = float(os.environ.get("GRAPPER_RPS", "4"))
+
+# jak casto se ptat na jedouci vlak: cim bliz cili, tim casteji
+POLL_MIN = dt.timedelta(minutes=1)
+POLL_MAX = dt.timedelta(minutes=30)
+# jak casto stahovat seznam vsech vlaku (kvuli novym vlakum)
+CYCLE = dt.timedelta(seconds=15)
+# kdyz se vlak v seznamu nezmenil, RouteInfo preskocime, ale nejdyl takhle dlouho
+LISTED_MAX_SKIP = dt.timedelta(minutes=10)
+# kolik procesu parsuje RouteInfo (0 = parsovat primo v hlavnim procesu)
+PARSE_PROCESSES = int(
+    os.environ.get(
+        "GRAPPER_PARSE_PROCESSES", str(max(0, min(4, (os.cpu_count() or 1) - 1)))
+    )
+)
+# token obnovujeme preventivne, i kdyz jeste funguje
+TOKEN_MAX_AGE = dt.timedelta(minutes=30)
+# dojete vlaky, ktere zmizely i ze seznamu, po teto dobe zapomeneme (v db zustanou)
+ARRIVED_KEEP = dt.timedelta(
+    hours=float(os.environ.get("GRAPPER_ARRIVED_KEEP_HOURS", "6"))
 )
+# vlak, jehoz stranku se nepodarilo stahnout nebo zpracovat, zkusime znovu za
+# tolik sekund (pak za dvojnasobek, nejvys RETRY_MAX), viz scheduler.Backoff
+RETRY = 60
+RETRY_MAX = 3600
+# planovaci stav pro rychly restart (viz snapshot.py), starsi se ignoruje
+SNAPSHOT_FILE = "vlaky.state"
+SNAPSHOT_MAX_AGE = dt.timedelta(days=1)
+# kola jsou i po sekunde, snapshot (zapis + fsync) staci jednou za cas a na konci
+SNAPSHOT_EVERY = float(os.environ.get("GRAPPER_SNAPSHOT_SECONDS", "60"))
+
+# da se prepsat na lokalni fake server (viz fake.py)
+GRAPP_URL = os.environ.get("GRAPP_URL", "https://grapp.spravazeleznic.cz")
+URL_ALL_TRAINS = GRAPP_URL + "/post/trains/GetTrainsWithFilter/{APP_ID}"
 BODY_ALL_TRAINS = b'{"CarrierCode":["991919","992230","992719","993030","990010","993188","991943","993246","991950","992693","991638","991976","993089","993162","991257","991935","991562","991125","992644","992842","991927","993170","991810","992909","991612","542005","f_o_r_e_i_g_n"],"PublicKindOfTrain":["LE","Ex","Sp","rj","TL","EC","SC","AEx","Os","Rx","TLX","IC","EN","R","RJ","NJ","LET","ES"],"FreightKindOfTrain":[],"KindOfExtraordinary":[],"TrainRunning":false,"PMD":false,"TrainNoChange":0,"TrainOutOfOrder":false,"Delay":["0","60","5","61","15","-1","30"],"DelayMin":-99999,"DelayMax":-99999,"SearchByTrainNumber":true,"SearchByTrainName":true,"SearchByTRID":false,"SearchByVehicleNumber":false,"SearchTextType":"0","SearchPhrase":"","SelectedTrain":-1,"RequestedBy":-1,"OrderedBy":"","UnRestriction":true,"PlRestriction":true}'
 
-URL_ROUTEINFO = "https://grapp.spravazeleznic.cz/OneTrain/RouteInfo/{APP_ID}?trainId={train_id}&_={ts}"
+URL_ROUTEINFO = GRAPP_URL + "/OneTrain/RouteInfo/{APP_ID}?trainId={train_id}&_={ts}"
 
 SQLITE_TRAINS = """
 CREATE TABLE vlaky (
@@ -61,16 +121,105 @@ CREATE TABLE vlaky (
 )
 """
 
-tz = zoneinfo.ZoneInfo("Europe/Prague")
+# radky, ktere po startu nacitame do planu
+LIVE_TRAINS = "aktualizovano > date('now', '-1 day')"
+# pri deleni db (partition.py) se do noveho oddilu prenasi jen vlaky, ktere jeste
+# nedojely, dojete zustanou v oddilu dne, kdy dojely (= den v souhrnech, viz
+# rollup.py), jinak by se den D prestehoval do D+1 a rollup.py --od D --do D
+# ho nenasel; a jen vlaky zapsane den pred novym oddilem (:start, viz
+# partition.prepare), starsi uz se nezmeni
+CARRY_TRAINS = """dojel IS NOT TRUE
+    AND aktualizovano >= date(:start, '-1 day')"""
+
+UPSERT_TRAIN = """INSERT INTO vlaky VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT DO UPDATE SET
+        aktualizovano=excluded.aktualizovano,
+        zpozdeni_odjezd=excluded.zpozdeni_odjezd,
+        zpozdeni_prijezd=excluded.zpozdeni_prijezd,
+        dojel=excluded.dojel,
+        realny_odjezd=excluded.realny_odjezd,
+        realny_prijezd=excluded.realny_prijezd
+"""
+
+tz = timeutil.TZ
 
 cookie_jar = http.cookiejar.CookieJar()
-http_opener = build_opener(HTTPCookieProcessor(cookie_jar))
+http_pool = pool.Pool(cookie_jar=cookie_jar, timeout=HTTP_TIMEOUT)
+# surove odpovedi (--archive), viz archive.py
+ARCHIVE_SOURCE = "grapp"
+raw_archive = None
+stopping = pipeline.stopping
+
+# /metrics (--metrics PORT), viz metrics.py
+FETCH_TRAINS_SECONDS = metrics.FETCH_SECONDS.labels("GetTrainsWithFilter")
+FETCH_ROUTEINFO_SECONDS = metrics.FETCH_SECONDS.labels("RouteInfo")
+PARSE_SECONDS = metrics.histogram(
+    "grapper_parse_seconds", "Parsovani jedne RouteInfo stranky"
+)
+QUEUED_TRAINS = metrics.gauge(
+    "grapper_queued_trains", "Vlaky ke stazeni v poslednim kole"
+)
+SCHEDULED_TRAINS = metrics.gauge(
+    "grapper_scheduled_trains", "Vlaky naplanovane na dalsi kola"
+)
+ALL_ROUTES = metrics.gauge("grapper_all_routes", "Velikost all_routes")
+ROUTEINFO_AGE = metrics.gauge(
+    "grapper_routeinfo_age_max_seconds",
+    "Nejstarsi RouteInfo mezi naplanovanymi vlaky (zpozdeni dat)",
+)
+TOKEN_REFRESHES = metrics.counter("grapper_token_refreshes", "Nove ziskane tokeny")
 
 
 class TokenExpired(Exception):
     ...
 
 
+# chyby, po kterych stahovani zkusime znovu (a neshodime tim kolektor)
+FETCH_ERRORS = (OSError, http.client.HTTPException, pool.HTTPError, TokenExpired)
+# HTTP chyby celeho serveru (pretizeni, vypadek, prihlaseni); jina 4xx/5xx u
+# RouteInfo byva jen u jednoho vlaku
+SERVER_STATUSES = (401, 403, 408, 429, 502, 503, 504)
+
+
+def server_wide(error) -> bool:
+    # jen takove chyby ridi strop pozadavku a jistic (pipeline.RateController),
+    # jinak by jeden vlak s rozbitou strankou pribrzdil vsechny ostatni
+    if isinstance(error, pool.HTTPError):
+        return error.status in SERVER_STATUSES
+    return True  # sit, timeout, prosly token
+
+
+class Session:
+    # token grappu; obnovuje se na miste, takze main() bezi dal se vsim, co
+    # ma v pameti (plan, all_routes, spojeni v http_pool)
+    def __init__(self, url: str = GRAPP_URL, max_age=TOKEN_MAX_AGE):
+        self.url = url
+        self.max_age = max_age.total_seconds()
+        self.token = None
+        self.obtained = 0.0
+        self.lock = threading.Lock()
+
+    def get(self) -> str:
+        # vlakna workeru se tu potkaji, token stahne jen prvni z nich
+        with self.lock:
+            if self.token is None or time.monotonic() - self.obtained > self.max_age:
+                self.refresh()
+            return self.token
+
+    def refresh(self):
+        ht = lxml.html.fromstring(http_pool.request(self.url).body)
+        self.token = ht.find(".//input[@id='token']").value
+        self.obtained = time.monotonic()
+        TOKEN_REFRESHES.inc()
+        logging.info("mame token: %s", self.token)
+
+    def invalidate(self, token: str):
+        # jen pokud ho mezitim neobnovil nekdo jiny
+        with self.lock:
+            if self.token == token:
+                self.token = None
+
+
 @dataclass(frozen=True, order=True)
 class Train:
     id: int
@@ -79,6 +228,13 @@ class Train:
 
 @dataclass
 class Station:
+    __slots__ = (
+        "name",
+        "planned_departure",
+        "actual_departure",
+        "planned_arrival",
+        "actual_arrival",
+    )
     name: str
     planned_departure: dt.time
     actual_departure: dt.time
@@ -88,6 +244,14 @@ class Station:
 
 @dataclass
 class Route:
+    __slots__ = (
+        "train",
+        "carrier",
+        "stations",
+        "planned_arrival",
+        "expected_journey_minutes",
+        "arrived",
+    )
     train: Train
     carrier: str
     stations: list[Station]
@@ -96,14 +260,117 @@ class Route:
     arrived: bool
 
 
-def get_all_trains(token):
-    req = Request(URL_ALL_TRAINS.format(APP_ID=token))
-    req.add_header("content-type", "application/json; charset=UTF-8")
-    req.data = BODY_ALL_TRAINS
-    with http_opener.open(req, timeout=HTTP_TIMEOUT) as r:
-        dt = json.load(r)
+class StoredRoute:
+    # co si o vlaku drzime v all_routes mezi stazenimi; misto Station se
+    # ctyrmi dt.time na kazdou stanici jsou tu internovane nazvy a casy
+    # v minutach od pulnoci v jednom poli (po ctyrech, poradi jako ve Station)
+    __slots__ = ("train", "carrier", "names", "times", "arrival", "arrived")
+
+    def __init__(self, train, carrier, names, times, arrival, arrived):
+        self.train = train
+        self.carrier = carrier
+        self.names = names
+        self.times = times
+        self.arrival = arrival  # planovany prijezd do cile, minuty (nebo None)
+        self.arrived = arrived
+
+    @classmethod
+    def from_route(cls, route: Route) -> "StoredRoute":
+        times = array.array("h")
+        for st in route.stations:
+            times.append(to_minutes(st.planned_departure))
+            times.append(to_minutes(st.actual_departure))
+            times.append(to_minutes(st.planned_arrival))
+            times.append(to_minutes(st.actual_arrival))
+        return cls(
+            train=route.train,
+            carrier=sys.intern(route.carrier),
+            names=tuple(sys.intern(st.name) for st in route.stations),
+            times=times,
+            arrival=to_minutes(route.planned_arrival),
+            arrived=route.arrived,
+        )
+
+    @classmethod
+    def stub(cls, train: Train, arrival: Optional[int], arrived: bool):
+        # vlak z db/snapshotu, o kterem zatim vime jen prijezd
+        return cls(train, None, (), array.array("h"), arrival, arrived)
+
+    @property
+    def planned_arrival(self) -> Optional[dt.time]:
+        return None if self.arrival is None else from_minutes(self.arrival)
+
+    @property
+    def expected_arrival(self) -> Optional[dt.time]:
+        # prijezd i se soucasnym zpozdenim (pokud ho zname)
+        if self.names:
+            return from_minutes(self.times[-1])
+        return self.planned_arrival
+
+    @property
+    def stations(self) -> list[Station]:
+        times = self.times
+        return [
+            Station(
+                name=name,
+                planned_departure=from_minutes(times[4 * j]),
+                actual_departure=from_minutes(times[4 * j + 1]),
+                planned_arrival=from_minutes(times[4 * j + 2]),
+                actual_arrival=from_minutes(times[4 * j + 3]),
+            )
+            for j, name in enumerate(self.names)
+        ]
+
+
+def listed_state(j) -> Optional[int]:
+    # otisk vseho, co seznam o vlaku rika krome Id a Title (zpozdeni, poloha,
+    # stav, ...); kdyz se nezmeni, nema smysl stahovat RouteInfo
+    rest = {k: v for k, v in j.items() if k not in ("Id", "Title")}
+    if not rest:
+        return None
+    digest = hashlib.blake2b(
+        json.dumps(rest, sort_keys=True).encode("utf-8"), digest_size=8
+    ).digest()
+    return int.from_bytes(digest, "little")
+
+
+def get_all_trains(session: Session, last: payload.Digest = None) -> Optional[dict]:
+    # Train -> otisk stavu ze seznamu (viz listed_state); None, kdyz je
+    # odpoved bajtove stejna jako posledni zpracovana (`last`)
+    for attempt in range(2):
+        token = session.get()
+        try:
+            with FETCH_TRAINS_SECONDS.time():
+                r = http_pool.request(
+                    URL_ALL_TRAINS.format(APP_ID=token),
+                    data=BODY_ALL_TRAINS,
+                    headers={"content-type": "application/json; charset=UTF-8"},
+                )
+        except pool.HTTPError as e:
+            if e.status not in (401, 403):
+                raise
+            # prosly token jako u RouteInfo, obnovime a zkusime jeste jednou
+            session.invalidate(token)
+            continue
+        if raw_archive:
+            raw_archive.append("trains", r.body)
+        if last is not None and last.unchanged(r.body):
+            return None
+        # vlaky po jednom, bez celeho stromu z json.loads
+        trains = {
+            Train(id=j["Id"], name=j["Title"].strip()): listed_state(j)
+            for j in payload.iter_array(r.body, "Trains")
+        }
+        # s proslym tokenem prijde prazdny seznam
+        if trains:
+            break
+        session.invalidate(token)
+    else:
+        raise TokenExpired()
 
-    return {Train(id=j["Id"], name=j["Title"].strip()) for j in dt["Trains"]}
+    if last is not None:
+        last.done()
+    return trains
 
 
 def parse_route_from_html(ht, train) -> Optional[Route]:
@@ -157,192 +424,743 @@ def parse_route_from_html(ht, train) -> Optional[Route]:
     )
 
 
-def time_diff(planned, actual):
-    today = dt.datetime.today()
-    a = dt.datetime.combine(today, planned)
-    b = dt.datetime.combine(today, actual)
-    # musime nejak resit dojezdy po pulnoci (nemame datum, jen cas)
-    # tak budem hadat, ze kdyz jsme vic jak tri hodiny pozadu, tak to
-    # bude asi dalsi den (tj. vlak nesmi jet vic jak 21 hodin)
-    # testy:
-    #   a=23:59, b=0:12 (13)
-    #   a=0:05, b=23:59 (-6) -- tady bude vetsi delta, protoze zpozdeni muze byt velky
-    if b < a and a - b > dt.timedelta(hours=3):
-        b += dt.timedelta(days=1)
-    if b > a and b - a > dt.timedelta(hours=12):
-        a += dt.timedelta(days=1)
-    return (b - a).total_seconds() / 60
-
-
-def main(token: str, is_ci: bool):
-    dbfile = "vlaky.db"
-    dbexists = os.path.isfile(dbfile)
-    conn = sqlite3.connect(dbfile)
-    if not dbexists:
-        conn.execute(SQLITE_TRAINS)
-
-    all_routes = dict()
+@lru_cache(maxsize=4096)
+def parse_time(tm: str) -> dt.time:
+    return dt.time.fromisoformat(tm.replace("(", "").replace(")", ""))
+
+
+class RouteInfoTarget:
+    # rychla varianta parse_route_from_html: misto stavby celeho stromu
+    # posloucha udalosti parseru a sbira jen text elementu, ktere potrebujeme
+    # (stejna semantika jako find/findall/xpath v parse_route_from_html)
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.depth = 0
+        self.alert = False
+        self.header_depth = None
+        self.header_divs = 0
+        self.carrier = None
+        self.current_station = None
+        self.route_depth = None  # None = jeste nebyl, -1 = uz skoncil
+        self.row_depth = None
+        self.rows = []  # [[nazev, [spany]], ...]
+        self.captures = []  # [(hloubka, [kusy textu], kam s vysledkem)]
+
+    def start(self, tag, attrib):
+        self.depth += 1
+        depth = self.depth
+        attrib = dict(attrib)  # lxml predava pomaly Mapping
+        if tag == "div":
+            cls = attrib.get("class")
+            if cls == "alertTitle":
+                self.alert = True
+            if self.header_depth is None and cls == "routeHeader":
+                self.header_depth = depth
+            elif self.header_depth == depth - 1:
+                self.header_divs += 1
+                if self.header_divs == 2:
+                    self.captures.append((depth, [], "carrier"))
+
+            if self.route_depth is None and cls == "route":
+                self.route_depth = depth
+            elif self.route_depth == depth - 1 and cls == "row":
+                self.row_depth = depth
+                self.rows.append([None, []])
+            elif self.row_depth == depth - 1 and self.rows[-1][0] is None:
+                self.rows[-1][0] = ""
+                self.captures.append((depth, [], "name"))
+
+        if attrib.get("id") == "currentStation":
+            if self.current_station is None:
+                self.current_station = ""
+                self.captures.append((depth, [], "current"))
+        elif tag == "span" and self.row_depth is not None:
+            self.captures.append((depth, [], "span"))
+
+    def end(self, tag):
+        depth = self.depth
+        while self.captures and self.captures[-1][0] == depth:
+            _, chunks, kind = self.captures.pop()
+            text = "".join(chunks).strip()
+            if kind == "carrier":
+                self.carrier = text
+            elif kind == "current":
+                self.current_station = text
+            elif kind == "name":
+                self.rows[-1][0] = text
+            else:
+                self.rows[-1][1].append(text)
+
+        if depth == self.header_depth:
+            self.header_depth = -1
+        if depth == self.row_depth:
+            self.row_depth = None
+        if depth == self.route_depth:
+            self.route_depth = -1
+        self.depth -= 1
+
+    def data(self, data):
+        for _, chunks, _ in self.captures:
+            chunks.append(data)
+
+    def close(self):
+        ret = (self.alert, self.carrier, self.current_station, self.rows)
+        self.reset()
+        return ret
+
+
+# vyroba parseru s targetem je draha, tak si ho drzime (kazde vlakno svuj)
+_routeinfo_parsers = threading.local()
+
+
+def parse_route_fast(data, train: Train) -> Optional[Route]:
+    parser = getattr(_routeinfo_parsers, "parser", None)
+    if parser is None:
+        parser = lxml.etree.HTMLParser(target=RouteInfoTarget())
+        _routeinfo_parsers.parser = parser
+    try:
+        parser.feed(data)
+    finally:
+        # close() vraci vysledek a zaroven resetuje target pro dalsi stranku
+        alert, carrier, current_station, rows = parser.close()
+    if alert:
+        return None
+    if carrier is None:
+        raise ValueError("RouteInfo bez hlavicky s dopravcem")
+    if current_station is None:
+        return None  # vlastne nevim, kdy to nastane
+
+    stations = []
+    for name, spans in rows:
+        # obcas nejsou ctyri, nevim uplne proc
+        spans = spans[:4]
+        assert len(spans) == 4, spans
+        stations.append(
+            Station(
+                name=name,
+                actual_arrival=parse_time(spans[0]),
+                planned_arrival=parse_time(spans[1]),
+                actual_departure=parse_time(spans[2]),
+                planned_departure=parse_time(spans[3]),
+            )
+        )
+
+    assert len(stations) > 0
+
+    return Route(
+        train=train,
+        carrier=carrier,
+        stations=stations,
+        planned_arrival=stations[-1].planned_arrival,
+        expected_journey_minutes=time_diff(
+            stations[0].planned_departure, stations[-1].planned_arrival
+        ),
+        arrived=current_station == stations[-1].name,
+    )
+
+
+def fetch_route(session: Session, train: Train) -> str:
+    for attempt in range(2):
+        token = session.get()
+        ts = int(dt.datetime.now(tz=tz).timestamp())
+        url = URL_ROUTEINFO.format(train_id=train.id, ts=ts, APP_ID=token)
+        try:
+            with FETCH_ROUTEINFO_SECONDS.time():
+                return http_pool.request(url).text()
+        except pool.HTTPError as e:
+            if e.status not in (401, 403):
+                raise
+            # prosly token, obnovime a zkusime jeste jednou
+            session.invalidate(token)
+    raise TokenExpired()
+
+
+def parse_job(data: str, train: Train):
+    # bezi v procesu parseru, vraci i cas, at ho muzeme zapocitat v hlavnim
+    t0 = time.perf_counter()
+    route = parse_route_fast(data, train)
+    return route, time.perf_counter() - t0
+
+
+def init_parser_process():
+    # SIGTERM od systemd dostane cela skupina procesu; parsery ho ignoruji
+    # a nechaji hlavni proces, at je ukonci sam, az dopise rozdelanou praci
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def parser_pool(processes: int = PARSE_PROCESSES):
+    if processes <= 0:
+        return None
+    # spawn, ne fork: v tu chvili uz bezi vlakna (writer, metriky, stahovani)
+    return ProcessPoolExecutor(
+        processes,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_parser_process,
+    )
+
+
+async def fetch_routes(
+    session: Session,
+    trains,
+    handle,
+    concurrency: int = FETCH_CONCURRENCY,
+    rps: float = FETCH_RPS,
+    parsers: Optional[ProcessPoolExecutor] = None,
+    parse_workers: int = 1,
+    stages=None,
+    limiter=None,
+    failed=None,
+):
+    # pipeline: `concurrency` workeru stahuje (ve vlaknech, pool.Pool je
+    # blokujici) -> omezena fronta -> parsovani v procesech `parsers` (nebo
+    # primo ve smycce, kdyz je None) -> `handle(train, data, route)` uz ve
+    # smycce. Plna fronta zdrzi stahovani (backpressure). Vlak, ktery se
+    # nepovede stahnout nebo na kterem spadne parsovani ci handle, dostane
+    # `failed(train, e)` (bez nej se jen preskoci); po `stopping` se nove vlaky
+    # nezacinaji, rozdelane se dodelaji.
+    loop = asyncio.get_running_loop()
+    # bez sdileneho regulatoru pevny strop `rps` (bench.py fetch)
+    limiter = limiter or pipeline.RateController(rps, min_rps=rps, max_rps=rps)
+    pending = iter(trains)
+    parse_workers = parse_workers if parsers else 1
+    fetched = asyncio.Queue(maxsize=parse_workers * 4)
+    if stages is None:
+        stages = [
+            pipeline.Stage("stahovani", concurrency),
+            pipeline.Stage("parsovani", parse_workers),
+        ]
+    fetch_stage, parse_stage = stages
+
+    async def fetcher(executor):
+        for train in pending:
+            if stopping.is_set():
+                return
+            await limiter.wait()
+            if stopping.is_set():
+                return
+            logging.info("Načítám údaje o vlaku %s", train)
+            t0 = time.perf_counter()
+            try:
+                data = await loop.run_in_executor(executor, fetch_route, session, train)
+            except FETCH_ERRORS as e:
+                metrics.ERRORS.labels(type(e).__name__).inc()
+                logging.info("Vlak %s se nepodarilo stahnout: %r", train, e)
+                if server_wide(e):
+                    limiter.failure(e)
+                if failed is not None:
+                    failed(train, e)
+                continue
+            else:
+                limiter.success(time.perf_counter() - t0)
+            finally:
+                fetch_stage.add(time.perf_counter() - t0)
+            await fetched.put((train, data))
+
+    async def parser():
+        while (item := await fetched.get()) is not None:
+            train, data = item
+            try:
+                if parsers:
+                    route, took = await loop.run_in_executor(
+                        parsers, parse_job, data, train
+                    )
+                else:
+                    route, took = parse_job(data, train)
+                parse_stage.add(took)
+                PARSE_SECONDS.observe(took)
+                handle(train, data, route)
+            except Exception as e:
+                # jedna divna stranka nesmi shodit cele kolo
+                metrics.ERRORS.labels(type(e).__name__).inc()
+                logging.exception("Vlak %s se nepodarilo zpracovat", train)
+                if failed is not None:
+                    failed(train, e)
+
+    async def fetch_all():
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            await asyncio.gather(*(fetcher(executor) for _ in range(concurrency)))
+        for _ in range(parse_workers):
+            await fetched.put(None)
+
+    # kdyz nektery stupen presto spadne, ostatni zrusime sami: smycka je
+    # sdilena s ostatnimi zdroji (collector.py) a nikdo jiny by to neudelal
+    tasks = [asyncio.ensure_future(fetch_all())]
+    tasks += [asyncio.ensure_future(parser()) for _ in range(parse_workers)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return stages
+
+
+def store_route(
+    db, all_routes, train: Train, route: Optional[Route], now=None, timelines=None
+):
+    if not route:
+        logging.info("Info o vlaku %s uz neni", train.name)
+        db.add("DELETE FROM vlaky WHERE id = ?", (train.id,))
+        if train in all_routes:
+            del all_routes[train]
+        return
+
+    delay_departure, delay_arrival = None, None
+    if route.arrived:
+        delay_departure = time_diff(
+            route.stations[0].planned_departure,
+            route.stations[0].actual_departure,
+        )
+        delay_arrival = time_diff(
+            route.stations[-1].planned_arrival,
+            route.stations[-1].actual_arrival,
+        )
+        logging.info(
+            "Vlak %s (%s) dojel. [%s, %s]. Plánovaná jízda: %s, zpoždění (minut): %s",
+            train.name,
+            route.carrier,
+            route.stations[0].name,
+            route.stations[-1].name,
+            route.expected_journey_minutes,
+            delay_arrival,
+        )
+    now = now or dt.datetime.now(tz=tz)
+    db.add(
+        UPSERT_TRAIN,
+        (
+            now.isoformat(),
+            now.isoformat(),
+            train.id,
+            train.name,
+            route.carrier,
+            route.stations[0].name,
+            route.stations[-1].name,
+            route.stations[0].planned_departure.isoformat(),
+            route.stations[0].actual_departure.isoformat(),
+            route.stations[-1].planned_arrival.isoformat(),
+            route.stations[-1].actual_arrival.isoformat(),
+            route.expected_journey_minutes,
+            delay_departure,
+            delay_arrival,
+            route.arrived,
+        ),
+    )
+
+    stored = StoredRoute.from_route(route)
+    if timelines is not None:
+        # casy na vsech zastavkach, jen kdyz se od minula zmenily
+        timelines.store(train, all_routes.get(train), stored, now)
+    all_routes[train] = stored
+
+
+def process_route(db, all_routes, train: Train, data: str, now=None, timelines=None):
+    with PARSE_SECONDS.time():
+        route = parse_route_fast(data, train)
+    store_route(db, all_routes, train, route, now, timelines)
+
+
+def next_poll(route: Optional[StoredRoute], now: dt.datetime) -> Optional[dt.datetime]:
+    # kdy se na vlak zeptat priste, None = uz nikdy (dojel)
+    if route is None:
+        return now
+    if route.arrived:
+        return None
+    remaining = dt.timedelta(minutes=time_diff(now.time(), route.expected_arrival))
+    # ptame se v pulce zbyvajici doby do prijezdu (minus 5 minut rezervy)
+    wait = (remaining - dt.timedelta(minutes=5)) / 2
+    return now + max(POLL_MIN, min(POLL_MAX, wait))
+
+
+def plan(sched, train: Train, route: Optional[StoredRoute], now: dt.datetime):
+    due = next_poll(route, now)
+    if due is None:
+        sched.remove(train)
+    else:
+        sched.schedule(train, due.timestamp())
+
+
+def save_state(path: str, all_routes, sched, fetched):
+    t0 = time.perf_counter()
+    entries = []
+    for train, route in all_routes.items():
+        listed, last_fetch = fetched.get(train, (None, 0.0))
+        entries.append(
+            snapshot.TrainState(
+                id=train.id,
+                name=train.name,
+                due=sched.due.get(train),
+                listed_state=listed,
+                last_fetch=last_fetch,
+                arrival_minute=route.arrival if route else None,
+                has_route=route is not None,
+                arrived=bool(route and route.arrived),
+            )
+        )
+    snapshot.save(path, entries)
+    logging.info(
+        "Stav (%d vlaků) uložen za %.3fs", len(entries), time.perf_counter() - t0
+    )
+
+
+def load_state(path: str, all_routes, sched, fetched) -> bool:
+    # naplni all_routes, plan a fetched ze snapshotu; False = neni/nejde pouzit
+    t0 = time.perf_counter()
+    try:
+        saved_at, entries = snapshot.load(path)
+    except FileNotFoundError:
+        return False
+    except (OSError, ValueError, snapshot.SnapshotError) as e:
+        logging.info("Snapshot %s nejde nacist (%r), jedeme z db", path, e)
+        return False
+    if time.time() - saved_at > SNAPSHOT_MAX_AGE.total_seconds():
+        logging.info("Snapshot %s je moc stary, jedeme z db", path)
+        return False
+
+    for e in entries:
+        train = Train(id=e.id, name=e.name)
+        route = None
+        if e.has_route:
+            route = StoredRoute.stub(train, e.arrival_minute, e.arrived)
+        all_routes[train] = route
+        if e.due is not None:
+            sched.schedule(train, e.due)
+        if e.last_fetch:
+            fetched[train] = (e.listed_state, e.last_fetch)
+    logging.info(
+        "Načteno %d vlaků ze snapshotu (%d naplánováno) za %.3fs",
+        len(entries),
+        len(sched),
+        time.perf_counter() - t0,
+    )
+    return True
+
+
+def load_from_db(conn, all_routes, sched):
     cur = conn.execute(
-        "SELECT id, nazev, ocekavany_prijezd, dojel FROM vlaky WHERE aktualizovano > date('now', '-1 day')"
+        "SELECT id, nazev, ocekavany_prijezd, dojel FROM vlaky WHERE " + LIVE_TRAINS
     ).fetchall()
     for tid, name, arrival, arrived in cur:
         train = Train(id=tid, name=name)
-        all_routes[train] = Route(
-            train=train,
-            carrier=None,
-            stations=None,
-            planned_arrival=dt.time.fromisoformat(arrival),
-            expected_journey_minutes=None,
-            arrived=arrived,
-        )
+        arrival = to_minutes(dt.time.fromisoformat(arrival))
+        all_routes[train] = StoredRoute.stub(train, arrival, bool(arrived))
 
     logging.info("Načteno %d vlaků z disku", len(cur))
 
-    run = True
-    while run:
-        if is_ci:
-            logging.info("Spoustim v CI, koncim po jednom kole")
-            run = False
+    now = dt.datetime.now(tz=tz)
+    for train, route in all_routes.items():
+        plan(sched, train, route, now)
+
+
+def evict_arrived(all_routes, sched, fetched, listed, horizon=ARRIVED_KEEP) -> int:
+    # dojete vlaky, ktere uz nejsou ani v seznamu, po `horizon` zapomeneme,
+    # jinak by all_routes (a fetched) rostly celou dobu behu
+    cutoff = time.time() - horizon.total_seconds()
+    gone = [
+        train
+        for train, route in all_routes.items()
+        if route is not None
+        and route.arrived
+        and train not in listed
+        and fetched.get(train, (None, 0.0))[1] < cutoff
+    ]
+    for train in gone:
+        del all_routes[train]
+        fetched.pop(train, None)
+        sched.remove(train)
+    return len(gone)
+
+
+class GrappSource:
+    # zdroj pro collector.py: seznam vlaku + RouteInfo podle planu; step() je
+    # jedno kolo a vraci, kdy ho spustit znovu
+    name = "grapp"
+
+    def __init__(self, session: Session, tw, limiter, is_ci: bool = False):
+        self.session = session
+        self.limiter = limiter
+        self.is_ci = is_ci
+        self.tw = tw
+        self.parts = partition.Partitioned(
+            tw, "vlaky.db", SQLITE_TRAINS, rollup.STATEMENTS, {"vlaky": CARRY_TRAINS}
+        )
+        self.db = self.parts.current()
+        self.timeline_parts = partition.Partitioned(
+            tw,
+            "prubehy.db",
+            timeline.SCHEMA,
+            timeline.INDEXES,
+            timeline.CARRY,
+            timeline.COPY,
+        )
+        self.timelines = timeline.TimelineStore(self.timeline_parts.current())
+
+        self.all_routes = dict()
+        self.sched = scheduler.Scheduler()
+        # Train -> (otisk ze seznamu, cas) z doby, kdy jsme naposledy stahli RouteInfo
+        self.fetched = dict()
+        if not load_state(SNAPSHOT_FILE, self.all_routes, self.sched, self.fetched):
+            load_from_db(self.db.conn, self.all_routes, self.sched)
+        self.trains, self.last_listed = dict(), 0.0
+        self.last_saved = time.time()
+        self.retry = scheduler.Backoff(self.sched, RETRY, RETRY_MAX)
+        self.listing = payload.Digest("GetTrainsWithFilter")
+
+        # stahovani -> parsovani (procesy) -> zapis (vlakno writeru), viz fetch_routes
+        self.parsers = parser_pool()
+        self.stages = [
+            pipeline.Stage("stahovani", FETCH_CONCURRENCY),
+            pipeline.Stage("parsovani", PARSE_PROCESSES if self.parsers else 1),
+        ]
+
+    def close(self):
+        if self.parsers:
+            self.parsers.shutdown()
+        # posledni snapshot az po zapisu rozdelaneho do db (writer jeste bezi);
+        # kdyz zapis selze, snapshot radsi nechame stary
+        try:
+            self.db.flush()
+            self.timelines.db.flush()
+        except Exception:
+            logging.exception("Zapis pred ulozenim stavu selhal, stav neukladame")
+            return
+        save_state(SNAPSHOT_FILE, self.all_routes, self.sched, self.fetched)
+
+    def handle(self, train, data, route):
+        self.fetched[train] = (self.trains.get(train), time.time())
+        if raw_archive:
+            raw_archive.append("routeinfo", data, train_id=train.id, name=train.name)
+        store_route(self.db, self.all_routes, train, route, timelines=self.timelines)
+        self.retry.succeeded(train)
+        if train in self.all_routes:
+            plan(self.sched, train, self.all_routes[train], dt.datetime.now(tz=tz))
+        else:
+            # store_route vlak s alertem zapomnel, evict_arrived uz ho neuvidi
+            self.fetched.pop(train, None)
+
+    def failed(self, train, error):
+        # stejna stranka by spadla znovu (a chyby serveru nechceme hned
+        # opakovat), dalsi pokus az po case
+        delay = self.retry.failed(train)
+        logging.info("Vlak %s zkusime znovu za %.0fs", train.name, delay)
 
-        trains = get_all_trains(token)
-        if len(trains) == 0:
-            raise TokenExpired()
+    async def list_trains(self) -> bool:
+        loop = asyncio.get_running_loop()
+        now = dt.datetime.now(tz=tz)
+        await self.limiter.wait()
+        if stopping.is_set():
+            return False
+        try:
+            trains = await loop.run_in_executor(
+                None, get_all_trains, self.session, self.listing
+            )
+        except FETCH_ERRORS as e:
+            if not isinstance(e, TokenExpired):
+                self.limiter.failure(e)
+            if self.is_ci:
+                raise
+            # stav v pameti zustava, jen to za chvili zkusime znovu
+            metrics.ERRORS.labels(type(e).__name__).inc()
+            logging.info(r"timeout/token expiration/http chyba ¯\_(ツ)_/¯ (%r)", e)
+            return False
+        self.limiter.success()
+        if trains is None:
+            # stejny seznam jako minule, nedekodovali jsme ho
+            logging.info("Seznam vlaků beze změny (%d. přeskok)", self.listing.skipped)
+            trains = self.trains
+        self.trains, self.last_listed = trains, time.time()
         logging.info("načteno %d vlaků z API", len(trains))
-        new_trains = trains - set(all_routes.keys())
-        if all_routes and new_trains:
+        new_trains = trains.keys() - self.all_routes.keys()
+        if self.all_routes and new_trains:
             logging.info("%d nových vlaků", len(new_trains))
 
         for new_train in new_trains:
-            all_routes[new_train] = None
+            self.all_routes[new_train] = None
+            plan(self.sched, new_train, None, now)
 
-        queued = set()
-        for train in all_routes.keys():
-            if not all_routes.get(train):
-                queued.add(train)
-                continue
-            if all_routes[train].arrived:
+        evicted = evict_arrived(self.all_routes, self.sched, self.fetched, trains)
+        if evicted:
+            logging.info("Zapomínáme %d dávno dojetých vlaků", evicted)
+        self.retry.forget(trains.keys())
+        return True
+
+    async def step(self) -> float:
+        loop = asyncio.get_running_loop()
+        all_routes, sched, fetched = self.all_routes, self.sched, self.fetched
+        cycle_start = time.time()
+        now = dt.datetime.now(tz=tz)
+        # pri deleni db muze zacit novy oddil (prenos radku a VACUUM stareho)
+        self.db = await loop.run_in_executor(None, self.parts.current)
+        self.timelines.db = await loop.run_in_executor(
+            None, self.timeline_parts.current
+        )
+        # seznam stahujeme jednou za CYCLE, RouteInfo podle planu klidne casteji
+        if time.time() - self.last_listed >= CYCLE.total_seconds():
+            if not await self.list_trains():
+                # znovu, az to regulator pusti (pri otevrenem jistici pozdeji)
+                return time.time() + self.limiter.delay()
+
+        queued, skipped = [], 0
+        for train in sched.pop_due():
+            state = self.trains.get(train)
+            last_state, last_fetch = fetched.get(train, (None, 0))
+            if (
+                state is not None
+                and state == last_state
+                and time.time() - last_fetch < LISTED_MAX_SKIP.total_seconds()
+            ):
+                skipped += 1
+                plan(sched, train, all_routes[train], now)
                 continue
-            # logging.info("tenhle vlak (%s) jsme uz videli", train)
-            arrival = dt.datetime.combine(
-                dt.date.today(),
-                all_routes[train].planned_arrival,
-                tzinfo=tz,
+            queued.append(train)
+        if skipped:
+            logging.info(
+                "%d vlaků se v seznamu nezměnilo, RouteInfo vynecháme", skipped
             )
-            # logging.info("ocekavame ho v %s", arrival)
-            if dt.datetime.now(tz=tz) < arrival - dt.timedelta(minutes=5):
-                # logging.info("Jeste nebudem nacitat %s, je moc brzo", train)
-                continue
-
-            queued.add(train)
 
-        if is_ci:
+        if self.is_ci:
             logging.info("Spoustim v CI, beru jen cast vlaku")
-            queued = random.sample(list(queued), 20)
+            queued = random.sample(queued, min(len(queued), 20))
 
-        logging.info("Nahravám info o %d vlacích", len(queued))
-        for train in queued:
-            ts = int(dt.datetime.now(tz=tz).timestamp())
-            url = URL_ROUTEINFO.format(train_id=train.id, ts=ts, APP_ID=token)
-            logging.info("Načítám údaje o vlaku %s", train)
-            with http_opener.open(url, timeout=HTTP_TIMEOUT) as r:
-                data = r.read().decode("utf-8")
-                # TODO: smaz (jen pro introspekci)
-                with open(URL_ROUTEINFO.split("/")[4] + ".html", "wt") as fw:
-                    fw.write(data)
-
-                ht = lxml.html.fromstring(data)
-
-            route = parse_route_from_html(ht, train)
-            if not route:
-                logging.info("Info o vlaku %s uz neni", train.name)
-                conn.execute("DELETE FROM vlaky WHERE id = ?", (train.id,))
-                conn.commit()
-                if train in all_routes:
-                    del all_routes[train]
-                continue
+        logging.info(
+            "Nahravám info o %d vlacích (%d dalších naplánováno)",
+            len(queued),
+            len(sched),
+        )
+        # writer je sdileny se vsemi zdroji, jeho vytizeni je od minuleho kola
+        for stage in self.stages + [self.tw.stage]:
+            stage.reset()
+        t0 = time.perf_counter()
+        try:
+            await fetch_routes(
+                self.session,
+                queued,
+                self.handle,
+                limiter=self.limiter,
+                parsers=self.parsers,
+                parse_workers=PARSE_PROCESSES,
+                stages=self.stages,
+                failed=self.failed,
+            )
+        finally:
+            await loop.run_in_executor(None, self.db.flush)
+            await loop.run_in_executor(None, self.timelines.db.flush)
+            # co se nestihlo stahnout (stopping, spadle kolo), zkusime hned v
+            # dalsim kole; vlaky po chybe uz s odkladem naplanoval self.failed
+            # (jsou v sched), ty nechame byt
+            for train in queued:
+                if train in all_routes and train not in sched:
+                    if not (all_routes[train] and all_routes[train].arrived):
+                        sched.schedule(train, time.time())
+        # az po zapisu do db, at snapshot netvrdi, ze mame neco, co v db neni
+        if time.time() - self.last_saved >= SNAPSHOT_EVERY:
+            save_state(SNAPSHOT_FILE, all_routes, sched, fetched)
+            self.last_saved = time.time()
 
-            delay_departure, delay_arrival = None, None
-            if route.arrived:
-                delay_departure = time_diff(
-                    route.stations[0].planned_departure,
-                    route.stations[0].actual_departure,
-                )
-                delay_arrival = time_diff(
-                    route.stations[-1].planned_arrival,
-                    route.stations[-1].actual_arrival,
-                )
-                logging.info(
-                    "Vlak %s (%s) dojel. [%s, %s]. Plánovaná jízda: %s, zpoždění (minut): %s",
-                    train.name,
-                    route.carrier,
-                    route.stations[0].name,
-                    route.stations[-1].name,
-                    route.expected_journey_minutes,
-                    delay_arrival,
-                )
-            now = dt.datetime.now(tz=tz)
-            conn.execute(
-                """INSERT INTO vlaky VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ON CONFLICT DO UPDATE SET
-                    aktualizovano=excluded.aktualizovano,
-                    zpozdeni_odjezd=excluded.zpozdeni_odjezd,
-                    zpozdeni_prijezd=excluded.zpozdeni_prijezd,
-                    dojel=excluded.dojel,
-                    realny_odjezd=excluded.realny_odjezd,
-                    realny_prijezd=excluded.realny_prijezd
-                """,
-                (
-                    now.isoformat(),
-                    now.isoformat(),
-                    train.id,
-                    train.name,
-                    route.carrier,
-                    route.stations[0].name,
-                    route.stations[-1].name,
-                    route.stations[0].planned_departure.isoformat(),
-                    route.stations[0].actual_departure.isoformat(),
-                    route.stations[-1].planned_arrival.isoformat(),
-                    route.stations[-1].actual_arrival.isoformat(),
-                    route.expected_journey_minutes,
-                    delay_departure,
-                    delay_arrival,
-                    route.arrived,
-                ),
+        QUEUED_TRAINS.set(len(queued))
+        SCHEDULED_TRAINS.set(len(sched))
+        ALL_ROUTES.set(len(all_routes))
+        if metrics.enabled:
+            ages = (time.time() - fetched[t][1] for t in sched.due if t in fetched)
+            ROUTEINFO_AGE.set(max(ages, default=0))
+
+        if queued:
+            wall = time.perf_counter() - t0
+            logging.info(
+                "Vytížení: %s", pipeline.report(self.stages + [self.tw.stage], wall)
             )
-            conn.commit()
+        logging.info("Kolo trvalo %.2fs", time.time() - cycle_start)
+        pipeline.report_rss(self.name)
+
+        # dalsi kolo v dalsim terminu, ale nejpozdeji s dalsim stazenim seznamu
+        wake = self.last_listed + CYCLE.total_seconds()
+        next_due = sched.next_due()
+        if next_due is not None:
+            wake = min(wake, next_due)
+        wake = max(wake, time.time() + 1)
+        logging.info(
+            "Prošli jsme naplánované vlaky, další kolečko za %.0fs", wake - time.time()
+        )
+        return wake
+
 
-            all_routes[train] = route
+def main(session: Session, is_ci: bool):
+    tw = writer.ThreadedWriter()
+    try:
+        limiter = pipeline.RateController(FETCH_RPS)
+        source = GrappSource(session, tw, limiter, is_ci)
+        collector.run([source], http_pool, once=is_ci, limiter=limiter)
+    finally:
+        tw.close()
 
-            time.sleep(1)
 
-        if not is_ci:
-            logging.info("Prošli jsme všechny jedoucí vlaky, jde se na další kolečko")
-            time.sleep(15)
+def replay(directory: str):
+    # prehraje archivovane RouteInfo pres stejne zpracovani, bez cekani a bez site;
+    # do oddilu (GRAPPER_PARTITION) podle casu zaznamu, ne podle hodin
+    tw = writer.ThreadedWriter()
+    try:
+        parts = partition.Partitioned(
+            tw, "vlaky.db", SQLITE_TRAINS, rollup.STATEMENTS, {"vlaky": CARRY_TRAINS}
+        )
+        timeline_parts = partition.Partitioned(
+            tw,
+            "prubehy.db",
+            timeline.SCHEMA,
+            timeline.INDEXES,
+            timeline.CARRY,
+            timeline.COPY,
+        )
+        db, timelines = None, None
+        all_routes = dict()
+        pages, t0 = 0, time.perf_counter()
+        for rec in archive.iter_records(directory, ARCHIVE_SOURCE, kind="routeinfo"):
+            train = Train(id=rec.train_id, name=rec.name)
+            now = dt.datetime.fromtimestamp(rec.ts, tz)
+            db = parts.current(rec.ts)
+            if timelines is None:
+                timelines = timeline.TimelineStore(timeline_parts.current(rec.ts))
+            else:
+                timelines.db = timeline_parts.current(rec.ts)
+            page = rec.payload.decode("utf-8")
+            process_route(db, all_routes, train, page, now, timelines)
+            pages += 1
+        if db is not None:
+            db.flush()
+            timelines.db.flush()
+    finally:
+        tw.close()
+    logging.info("Přehráno %d RouteInfo za %.1fs", pages, time.perf_counter() - t0)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--archive", help="adresar, kam archivovat surove odpovedi")
+    parser.add_argument("--replay", help="prehraj archiv z adresare misto stahovani")
+    parser.add_argument(
+        "--metrics",
+        type=int,
+        default=os.environ.get("GRAPPER_METRICS_PORT"),
+        help="port pro /metrics (Prometheus), bez nej se nic nesbira",
+    )
+    args = parser.parse_args()
+
     logging.basicConfig(
         format="%(asctime)s %(levelname)s %(message)s", datefmt="%Y-%m-%d %H:%M:%S %Z"
     )
     logging.getLogger().setLevel(logging.INFO)
 
-    run, is_ci = True, False
-    while run:
-        is_ci = os.environ.get("CI") is not None
-        run = not is_ci
+    if args.replay:
+        replay(args.replay)
+        raise SystemExit
+    if args.archive:
+        raw_archive = archive.Archive(args.archive, ARCHIVE_SOURCE)
+    if args.metrics:
+        metrics.serve(args.metrics)
 
-        try:
-            with http_opener.open(
-                "https://grapp.spravazeleznic.cz", timeout=HTTP_TIMEOUT
-            ) as r:
-                ht = lxml.html.parse(r)
-                token = ht.find(".//input[@id='token']").value
-                logging.info("mame token: %s", token)
-
-            main(token, is_ci)
-        except (socket.timeout, TokenExpired) as e:
-            if is_ci:
-                raise e
-
-            logging.info(r"timeout/token expiration ¯\_(ツ)_/¯")
-            time.sleep(15)
+    signal.signal(signal.SIGTERM, pipeline.on_sigterm)
+    main(Session(), os.environ.get("CI") is not None)
+    if raw_archive:
+        raw_archive.close()
+    logging.info("Konec")
@@ -0,0 +1,394 @@
+import argparse
+import datetime as dt
+import gzip
+import html
+import json
+import random
+import re
+import threading
+import time
+import zoneinfo
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import archive
+
+# lokalni nahrada za grapp.spravazeleznic.cz a mapy.spravazeleznic.cz, at
+# muzeme merit bez produkce
+# python fake.py --port 8000 --trains 1500 --latency 0.2
+# s obdobim zpomaleni a vypadku (delka:latence:chybovost, dokola):
+# python fake.py --phases 60:0.05:0,30:2:0,20:0:1
+# a pak GRAPP_URL=http://127.0.0.1:8000 python dl.py
+# nebo MAPY_URL=http://127.0.0.1:8000 python datel.py
+
+TOKEN = "faketoken"
+TZ = zoneinfo.ZoneInfo("Europe/Prague")
+
+STATIONS = [
+    "Praha hl.n.",
+    "Praha-Libeň",
+    "Kolín",
+    "Pardubice hl.n.",
+    "Česká Třebová",
+    "Olomouc hl.n.",
+    "Přerov",
+    "Ostrava hl.n.",
+    "Brno hl.n.",
+    "Břeclav",
+    "Benešov u Prahy",
+    "Tábor",
+    "České Budějovice",
+    "Plzeň hl.n.",
+    "Cheb",
+]
+# hruby obdelnik CR, souradnice stanic jsou vymyslene
+STATION_COORDS = {
+    name: (12.1 + (j * 7919 % 100) / 100 * 6.7, 48.6 + (j * 104729 % 100) / 100 * 2.4)
+    for j, name in enumerate(STATIONS)
+}
+CARRIERS = [
+    "České dráhy, a.s.",
+    "RegioJet a.s.",
+    "LEO Express s.r.o.",
+    "ARRIVA vlaky s.r.o.",
+]
+KINDS = ["Os", "R", "Sp", "Ex", "EC", "IC", "RJ"]
+
+
+@dataclass
+class FakeTrain:
+    id: int
+    name: str
+    carrier: str
+    stations: list
+    # minuty od pulnoci, pro kazdou stanici (prijezd, odjezd)
+    times: list
+    delay: int
+
+
+def make_fleet(size: int, seed: int = 0, now: dt.datetime = None):
+    # vlaky rozprostrene kolem `now`, aby nektere uz dojely, jine jedou a dalsi
+    # teprve vyjedou
+    rng = random.Random(seed)
+    now = now or dt.datetime.now(TZ)
+    now_min = now.hour * 60 + now.minute
+    fleet = []
+    for j in range(size):
+        stations = rng.sample(STATIONS, rng.randint(2, 8))
+        start = (now_min + rng.randint(-180, 60)) % 1440
+        times, tm = [], start
+        for _ in stations:
+            times.append((tm, tm + 1))
+            tm += rng.randint(5, 40)
+        kind = rng.choice(KINDS)
+        fleet.append(
+            FakeTrain(
+                id=1_000_000 + j,
+                name=f"{kind} {1000 + j}",
+                carrier=rng.choice(CARRIERS),
+                stations=stations,
+                times=times,
+                delay=rng.choice([0, 0, 0, 1, 2, 5, 10, 30]),
+            )
+        )
+    return fleet
+
+
+def fmt_minutes(minutes: int) -> str:
+    minutes %= 1440
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def current_index(train: FakeTrain, now_min: int) -> int:
+    # index posledni stanice, kterou vlak projel (-1 = jeste nevyjel)
+    idx = -1
+    for j, (arr, _) in enumerate(train.times):
+        if (now_min - (arr + train.delay)) % 1440 < 720:
+            idx = j
+    return idx
+
+
+def routeinfo_html(train: FakeTrain, now_min: int) -> str:
+    idx = max(current_index(train, now_min), 0)
+    rows = []
+    for j, (name, (arr, dep)) in enumerate(zip(train.stations, train.times)):
+        cur = (
+            f'<span id="currentStation">{html.escape(name)}</span>' if j == idx else ""
+        )
+        rows.append(f"""<div class="row"><div>{cur or html.escape(name)}</div>
+<div class="times"><span>{fmt_minutes(arr + train.delay)}</span><span>({fmt_minutes(arr)})</span></div>
+<div class="times"><span>{fmt_minutes(dep + train.delay)}</span><span>({fmt_minutes(dep)})</span></div>
+</div>""")
+    return f"""<html><body>
+<div class="routeHeader"><div>{html.escape(train.name)}</div><div> {html.escape(train.carrier)} </div></div>
+<div class="route">
+{"".join(rows)}
+</div>
+</body></html>"""
+
+
+def event_minute(train: FakeTrain, idx: int) -> int:
+    # kdy (minuta od pulnoci) vlak dorazil do stanice `idx`
+    return (train.times[idx][0] + train.delay) % 1440
+
+
+def feed_feature(train: FakeTrain, idx: int):
+    # jeden zaznam z request2.php (OsVlaky), jen pole, ktera cte datel.py
+    kind, _, number = train.name.partition(" ")
+    arr, dep = train.times[idx]
+    nxt = min(idx + 1, len(train.stations) - 1)
+    x0, y0 = STATION_COORDS[train.stations[idx]]
+    x1, y1 = STATION_COORDS[train.stations[nxt]]
+    return {
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [(x0 + x1) / 2, (y0 + y1) / 2]},
+        "properties": {
+            "type": "V",
+            "a": idx / max(len(train.stations) - 1, 1) * 100,
+            "tt": kind,
+            "tn": number,
+            "na": "",
+            "fn": train.stations[0],
+            "ln": train.stations[-1],
+            "cna": train.stations[idx],
+            "de": train.delay,
+            "nna": train.stations[nxt],
+            "d": train.carrier,
+            "cp": fmt_minutes(dep),
+            "cr": fmt_minutes(dep + train.delay),
+            "nsn": train.stations[nxt],
+            "nst": fmt_minutes(train.times[nxt][0]),
+            "nsp": fmt_minutes(train.times[nxt][0] + train.delay),
+            "zst_sr70": str(540000 + STATIONS.index(train.stations[nxt])),
+        },
+    }
+
+
+ALERT_HTML = '<html><body><div class="alertTitle">Vlak nenalezen</div></body></html>'
+
+
+class FakeGrapp:
+    # grapp (token, seznam vlaku, RouteInfo) i mapy (request2.php) v jednom;
+    # umi pridat latenci, nahodne chyby a expiraci tokenu; `phases` je
+    # [(delka, latence, chybovost)], ktere se od startu stridaji dokola a
+    # prebiji `latency` a `error_rate`
+    def __init__(
+        self,
+        fleet,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        expiry_rate: float = 0.0,
+        recorded: str = None,
+        seed: int = 0,
+        phases=None,
+    ):
+        self.fleet = {t.id: t for t in fleet}
+        self.latency = latency
+        self.error_rate = error_rate
+        self.phases = phases
+        self.started = time.monotonic()
+        self.expiry_rate = expiry_rate
+        self.rng = random.Random(seed)
+        self.token = TOKEN
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.log = []  # [(cas, endpoint, status)]
+        self.recorded = None
+        self.feed_ticks = 0
+        if recorded:
+            self.recorded = load_recorded(recorded)
+
+    def now_min(self):
+        now = dt.datetime.now(TZ)
+        return now.hour * 60 + now.minute
+
+    def listed(self, train: FakeTrain, now_min: int):
+        idx = current_index(train, now_min)
+        return {
+            "Id": train.id,
+            "Title": train.name,
+            "Delay": train.delay,
+            "LastStation": train.stations[idx] if idx >= 0 else None,
+        }
+
+    def feed(self, now_min: int):
+        features = []
+        for t in self.fleet.values():
+            idx = current_index(t, now_min)
+            if idx < 0:
+                continue
+            # dojete vlaky ve feedu jeste chvili zustavaji
+            if (
+                idx == len(t.stations) - 1
+                and (now_min - event_minute(t, idx)) % 1440 > 10
+            ):
+                continue
+            features.append(feed_feature(t, idx))
+        return {"success": True, "result": features}
+
+    def handle(self, method, path, query, body):
+        status, ctype, payload = self.respond(method, path, query, body)
+        with self.lock:
+            self.requests += 1
+            self.log.append((time.time(), endpoint(path), status))
+        return status, ctype, payload
+
+    def conditions(self):
+        # -> (latence, chybovost) pro tuhle chvili
+        if not self.phases:
+            return self.latency, self.error_rate
+        elapsed = (time.monotonic() - self.started) % sum(p[0] for p in self.phases)
+        for duration, latency, error_rate in self.phases:
+            if elapsed < duration:
+                break
+            elapsed -= duration
+        return latency, error_rate
+
+    def respond(self, method, path, query, body):
+        latency, error_rate = self.conditions()
+        if latency:
+            time.sleep(latency)
+        if error_rate and self.rng.random() < error_rate:
+            # pretizeni/vypadek celeho serveru (chyby jednoho vlaku jsou jine)
+            return 503, "text/plain", "Service Unavailable"
+
+        if path == "/":
+            return (
+                200,
+                "text/html",
+                f'<html><body><input type="hidden" id="token" value="{self.token}"></body></html>',
+            )
+        if path == "/serverside/request2.php":
+            if self.recorded and self.recorded["feed"]:
+                ticks = self.recorded["feed"]
+                self.feed_ticks += 1
+                return 200, "application/json", ticks[self.feed_ticks % len(ticks)]
+            return 200, "application/json", json.dumps(self.feed(self.now_min()))
+        if m := re.fullmatch(r"/post/trains/GetTrainsWithFilter/(\w+)", path):
+            if self.expiry_rate and self.rng.random() < self.expiry_rate:
+                self.token = f"token{self.rng.randrange(10**9)}"
+            if m.group(1) != self.token:
+                return 200, "application/json", json.dumps({"Trains": []})
+            if self.recorded and self.recorded["trains"]:
+                return 200, "application/json", self.recorded["trains"]
+            now_min = self.now_min()
+            trains = [self.listed(t, now_min) for t in self.fleet.values()]
+            return 200, "application/json", json.dumps({"Trains": trains})
+        if m := re.fullmatch(r"/OneTrain/RouteInfo/(\w+)", path):
+            if m.group(1) != self.token:
+                return 403, "text/plain", "Forbidden"
+            train_id = int(query.get("trainId", ["0"])[0])
+            if self.recorded:
+                return (
+                    200,
+                    "text/html",
+                    self.recorded["routeinfo"].get(train_id, ALERT_HTML),
+                )
+            train = self.fleet.get(train_id)
+            if train is None:
+                return 200, "text/html", ALERT_HTML
+            return 200, "text/html", routeinfo_html(train, self.now_min())
+        return 404, "text/plain", "not found"
+
+
+def endpoint(path: str) -> str:
+    if path.startswith("/post/trains/GetTrainsWithFilter/"):
+        return "GetTrainsWithFilter"
+    if path.startswith("/OneTrain/RouteInfo/"):
+        return "RouteInfo"
+    if path == "/serverside/request2.php":
+        return "request2.php"
+    return path
+
+
+def load_recorded(directory: str):
+    # odpovedi z archivu (--archive), posledni verze od kazdeho vlaku
+    recorded = dict(trains=None, routeinfo=dict(), feed=[])
+    for rec in archive.iter_records(directory, "grapp"):
+        if rec.kind == "trains":
+            recorded["trains"] = rec.payload.decode("utf-8")
+        elif rec.kind == "routeinfo":
+            recorded["routeinfo"][rec.train_id] = rec.payload.decode("utf-8")
+    for rec in archive.iter_records(directory, "mapy", kind="feed"):
+        recorded["feed"].append(rec.payload.decode("utf-8"))
+    return recorded
+
+
+def make_handler(app):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def respond(self, method):
+            url = urlparse(self.path)
+            length = int(self.headers.get("content-length") or 0)
+            body = self.rfile.read(length) if length else b""
+            status, ctype, payload = app.handle(
+                method, url.path, parse_qs(url.query), body
+            )
+            data = payload.encode("utf-8")
+            gzipped = "gzip" in self.headers.get("accept-encoding", "")
+            if gzipped:
+                data = gzip.compress(data, compresslevel=1)
+            self.send_response(status)
+            self.send_header("content-type", f"{ctype}; charset=utf-8")
+            if gzipped:
+                self.send_header("content-encoding", "gzip")
+            self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self.respond("GET")
+
+        def do_POST(self):
+            self.respond("POST")
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def parse_phases(spec: str):
+    # "60:0.05:0,30:2:0" -> [(60.0, 0.05, 0.0), (30.0, 2.0, 0.0)]
+    return [tuple(float(j) for j in phase.split(":")) for phase in spec.split(",")]
+
+
+def start(app, port: int = 0):
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(app))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--trains", type=int, default=1500)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--expiry-rate", type=float, default=0.0)
+    parser.add_argument("--recorded", help="servuj odpovedi z archivu (--archive)")
+    parser.add_argument(
+        "--phases", help="delka:latence:chybovost,... (stridaji se dokola)"
+    )
+    args = parser.parse_args()
+
+    app = FakeGrapp(
+        make_fleet(args.trains, args.seed),
+        latency=args.latency,
+        error_rate=args.error_rate,
+        expiry_rate=args.expiry_rate,
+        recorded=args.recorded,
+        seed=args.seed,
+        phases=parse_phases(args.phases) if args.phases else None,
+    )
+    server, url = start(app, args.port)
+    print(f"fake server bezi na {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
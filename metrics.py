@@ -0,0 +1,204 @@
+import bisect
+import contextlib
+import http.server
+import threading
+import time
+
+# volitelny /metrics endpoint v textovem formatu Promethea; dokud se nezavola
+# serve(), jsou vsechny observe/set/inc jen jedno porovnani a nic se nesbira
+
+enabled = False
+
+# sekundy, od rychleho parsovani po pomale HTTP
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_families = dict()  # jmeno -> Family, v poradi registrace
+_lock = threading.Lock()
+_nulltimer = contextlib.nullcontext()
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = (f'{name}="{escape(value)}"' for name, value in zip(names, values))
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        if enabled:
+            with _lock:
+                self.value += amount
+
+    def render(self, name, labels):
+        yield f"{name}_total{labels} {self.value}"
+
+
+class Gauge:
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float):
+        if enabled:
+            self.value = value
+
+    def render(self, name, labels):
+        yield f"{name}{labels} {self.value}"
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # posledni je +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        if enabled:
+            with _lock:
+                self.counts[bisect.bisect_left(self.buckets, value)] += 1
+                self.sum += value
+
+    def time(self):
+        return _Timer(self) if enabled else _nulltimer
+
+    def render(self, name, labels):
+        # kumulativni buckety, le="..." se pridava k ostatnim labelum
+        inner = labels[1:-1] + "," if labels else ""
+        total = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            total += count
+            yield f'{name}_bucket{{{inner}le="{bound}"}} {total}'
+        yield f"{name}_sum{labels} {self.sum}"
+        yield f"{name}_count{labels} {total}"
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.t0)
+
+
+class Family:
+    # jedna metrika s (nepovinnymi) labely; bez labelu se chova primo jako
+    # Counter/Gauge/Histogram, s labely se deti ziskavaji pres labels(...)
+    def __init__(self, kind, name, doc, cls, labelnames=(), **kwargs):
+        self.kind = kind
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self.make = lambda: cls(**kwargs)
+        self.children = dict()
+        if not self.labelnames:
+            self.children[()] = self.make()
+
+    def labels(self, *values):
+        values = tuple(str(j) for j in values)
+        child = self.children.get(values)
+        if child is None:
+            with _lock:
+                child = self.children.setdefault(values, self.make())
+        return child
+
+    def __getattr__(self, attr):
+        # inc/set/observe/time bez labelu
+        return getattr(self.children[()], attr)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for values, child in list(self.children.items()):
+            yield from child.render(self.name, format_labels(self.labelnames, values))
+
+
+def register(family: Family) -> Family:
+    # oba kolektory importuji spolecne moduly, tak at jde registrovat dvakrat
+    return _families.setdefault(family.name, family)
+
+
+def counter(name, doc, labelnames=()) -> Family:
+    return register(Family("counter", name, doc, Counter, labelnames))
+
+
+def gauge(name, doc, labelnames=()) -> Family:
+    return register(Family("gauge", name, doc, Gauge, labelnames))
+
+
+def histogram(name, doc, labelnames=(), buckets=BUCKETS) -> Family:
+    return register(
+        Family("histogram", name, doc, Histogram, labelnames, buckets=buckets)
+    )
+
+
+def render() -> str:
+    lines = []
+    for family in list(_families.values()):
+        lines.extend(family.render())
+    return "\n".join(lines) + "\n"
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port: int, host: str = "127.0.0.1"):
+    # zapne sber a pusti endpoint ve vlakne na pozadi
+    global enabled
+    enabled = True
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def peak_rss():
+    # spicka RSS procesu (bajty) od minuleho volani: VmHWM z /proc a pak jeho
+    # vynulovani pres clear_refs (Linux); jinde None. V collector.py sdileji
+    # oba zdroje jeden proces, takze je to spicka od posledniho mereni kohokoli
+    try:
+        with open("/proc/self/status") as f:
+            peak = next(
+                int(line.split()[1]) * 1024 for line in f if line.startswith("VmHWM:")
+            )
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except (OSError, StopIteration):
+        return None
+    return peak
+
+
+# spolecne pro oba kolektory
+FETCH_SECONDS = histogram(
+    "grapper_fetch_seconds", "Delka HTTP pozadavku", ("endpoint",)
+)
+ERRORS = counter("grapper_errors", "Chyby podle druhu", ("kind",))
+DB_WRITE_SECONDS = histogram(
+    "grapper_db_write_seconds", "Delka zapisu jedne davky do sqlite"
+)
+DB_ROWS = counter("grapper_db_rows", "Zapsane radky (upserty a mazani)")
+PEAK_RSS = gauge(
+    "grapper_peak_rss_bytes", "Spicka RSS za posledni tick/kolo zdroje", ("source",)
+)
@@ -0,0 +1,278 @@
+import argparse
+import datetime as dt
+import gzip
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import stat
+import time
+
+import timeutil
+
+# volitelne deleni db po dnech nebo mesicich (GRAPPER_PARTITION=day|month):
+# vlaky.db -> vlaky-2023-01.db, vlaky-2023-02.db, ... Zapisuje se jen do
+# aktualniho oddilu. Pri prechodu do dalsiho se do nej prenesou zive radky
+# (ty, ktere cte start a dedup), takze se nikdy nesaha do historie. Stary
+# oddil se pak zkompaktuje (VACUUM) a prepne jen pro cteni. Oddily navic nad
+# GRAPPER_PARTITION_KEEP se presunou (gzip) do GRAPPER_PARTITION_ARCHIVE.
+# Jako jednu tabulku je cte open_view() (ATTACH + UNION ALL):
+# python partition.py list vlaky.db
+# python partition.py query vlaky.db "SELECT count(*) FROM vlaky"
+
+PERIOD = os.environ.get("GRAPPER_PARTITION", "")  # "" = jeden soubor jako driv
+KEEP = int(os.environ.get("GRAPPER_PARTITION_KEEP", "0"))  # 0 = nic nearchivovat
+ARCHIVE_DIR = os.environ.get("GRAPPER_PARTITION_ARCHIVE", "archiv")
+
+FORMATS = {"day": "%Y-%m-%d", "month": "%Y-%m"}
+LABEL = r"\d{4}-\d{2}(?:-\d{2})?"
+
+
+def label(ts: float, period: str) -> str:
+    return dt.datetime.fromtimestamp(ts, timeutil.TZ).strftime(FORMATS[period])
+
+
+def start(label: str) -> str:
+    # prvni den oddilu (YYYY-MM-DD)
+    return label if len(label) == 10 else label + "-01"
+
+
+def path_for(dbfile: str, label: str) -> str:
+    stem, ext = os.path.splitext(dbfile)
+    return f"{stem}-{label}{ext}"
+
+
+def partitions(dbfile: str):
+    # -> [(label, cesta)] existujicich oddilu, od nejstarsiho
+    stem, ext = os.path.splitext(dbfile)
+    directory = os.path.dirname(dbfile) or "."
+    pattern = re.compile(
+        re.escape(os.path.basename(stem)) + f"-({LABEL})" + re.escape(ext) + "$"
+    )
+    found = []
+    for name in os.listdir(directory):
+        if m := pattern.match(name):
+            found.append((m.group(1), os.path.join(os.path.dirname(dbfile), name)))
+    return sorted(found)
+
+
+def files(dbfile: str, since: str = None, until: str = None):
+    # puvodni nedeleny soubor (historie pred zapnutim deleni, bereme ho vzdy)
+    # + oddily, ktere zasahuji do [since, until] (dny nebo mesice YYYY-MM(-DD))
+    paths = [dbfile] if os.path.isfile(dbfile) else []
+    for lbl, path in partitions(dbfile):
+        if since is not None and lbl < since[: len(lbl)]:
+            continue
+        if until is not None and lbl > until[: len(lbl)]:
+            continue
+        paths.append(path)
+    return paths
+
+
+def writable(path: str) -> bool:
+    # podle prav, ne os.access (root muze zapisovat vsude)
+    return bool(os.stat(path).st_mode & stat.S_IWUSR)
+
+
+def initialised(conn, schema="main") -> bool:
+    return bool(
+        conn.execute(
+            f"SELECT count(*) FROM {schema}.sqlite_master WHERE type = 'table'"
+        ).fetchone()[0]
+    )
+
+
+def prepare(path, previous, schema, indexes=(), carry=None, copy=(), first=None):
+    # zalozi novy oddil a prenese do nej zive radky z predchoziho oddilu
+    # (vraci jejich pocet, None kdyz uz oddil existoval); `first` je jeho prvni
+    # den, v `carry` dostupny jako :start (hranice podle oddilu, ne podle hodin,
+    # at to sedi i pri replay);
+    # zalozeni, kopie i smazani z predchoziho jsou jedna transakce pres obe db
+    # (obe jsou v rollback journalu, ne ve WAL, takze je to atomicke), po
+    # padu uprostred se to proste zopakuje
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        conn.execute("PRAGMA busy_timeout=5000")
+        if initialised(conn):
+            return None
+        conn.execute("PRAGMA journal_mode=DELETE")
+        moved = 0
+        if previous is not None:
+            if not writable(previous):
+                logging.warning("Oddil %s je jen pro cteni, nic neprenasime", previous)
+                previous = None
+            else:
+                conn.execute("ATTACH DATABASE ? AS old", (previous,))
+                conn.execute("PRAGMA old.journal_mode=DELETE")
+        conn.execute("BEGIN")
+        conn.execute(schema)
+        for index in indexes:
+            conn.execute(index)
+        if previous is not None and initialised(conn, "old"):
+            # ciselniky (`copy`) se kopiruji cele a ve starem oddilu zustanou;
+            # predchozi oddil je v `carry` dostupny jako `old`
+            for table in copy:
+                conn.execute(f"INSERT INTO main.{table} SELECT * FROM old.{table}")
+            params = {"start": first}
+            for table, where in (carry or {}).items():
+                moved += conn.execute(
+                    f"INSERT INTO main.{table} SELECT * FROM old.{table} WHERE {where}",
+                    params,
+                ).rowcount
+                conn.execute(f"DELETE FROM old.{table} WHERE {where}", params)
+        conn.execute("COMMIT")
+        return moved
+    finally:
+        conn.close()
+
+
+def compact(path: str):
+    # uzavreny oddil: VACUUM, bez WAL (at jde otevrit i jen pro cteni) a bez
+    # prava zapisu
+    t0 = time.perf_counter()
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    mode = os.stat(path).st_mode
+    os.chmod(path, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+    logging.info(
+        "Oddil %s zkompaktovan na %d KiB za %.1fs",
+        path,
+        os.path.getsize(path) // 1024,
+        time.perf_counter() - t0,
+    )
+
+
+def archive_old(dbfile: str, current: str, keep: int, directory: str) -> int:
+    # nejstarsi oddily nad `keep` zabalime do `directory` a smazeme
+    old = [path for _, path in partitions(dbfile) if path != current]
+    old = old[: max(len(old) - (keep - 1), 0)]
+    if not old:
+        return 0
+    os.makedirs(directory, exist_ok=True)
+    for path in old:
+        target = os.path.join(directory, os.path.basename(path) + ".gz")
+        with open(path, "rb") as src, gzip.open(target + ".tmp", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(target + ".tmp", target)
+        os.remove(path)
+        logging.info("Oddil %s archivovan do %s", path, target)
+    return len(old)
+
+
+class Partitioned:
+    # jedna logicka db pres ThreadedWriter; current() vraci DbWriter pro
+    # aktualni oddil (bez deleni je to porad ten samy soubor), pri prechodu
+    # do dalsiho oddilu stary zavre, prenese zive radky a zkompaktuje ho.
+    # `carry` je {tabulka: WHERE} pro zive radky (prenasi se v tomto poradi),
+    # `copy` tabulky, ktere se kopiruji cele.
+    def __init__(
+        self,
+        tw,
+        dbfile: str,
+        schema: str,
+        indexes=(),
+        carry=None,
+        copy=(),
+        period: str = PERIOD,
+        keep: int = KEEP,
+        archive_dir: str = ARCHIVE_DIR,
+    ):
+        if period and period not in FORMATS:
+            raise ValueError(f"neznamy GRAPPER_PARTITION: {period}")
+        self.tw = tw
+        self.dbfile = dbfile
+        self.schema = schema
+        self.indexes = indexes
+        self.carry = carry
+        self.copy = copy
+        self.period = period
+        self.keep = keep
+        self.archive_dir = archive_dir
+        self.path, self.db = None, None
+
+    def current(self, now: float = None):
+        if not self.period:
+            lbl, path = None, self.dbfile
+        else:
+            lbl = label(now or time.time(), self.period)
+            path = path_for(self.dbfile, lbl)
+        if path == self.path:
+            return self.db
+        if self.db is not None:
+            self.db.close()
+        if self.period:
+            self.rotate(path, start(lbl))
+        self.db = self.tw.open(path, self.schema, self.indexes)
+        self.path = path
+        return self.db
+
+    def rotate(self, path: str, first: str):
+        older = [p for _, p in partitions(self.dbfile) if p < path]
+        if os.path.isfile(self.dbfile):
+            # pri zapnuti deleni nad existujici db prenasime z ni
+            older.insert(0, self.dbfile)
+        previous = older[-1] if older else None
+        moved = prepare(
+            path, previous, self.schema, self.indexes, self.carry, self.copy, first
+        )
+        if moved is not None:
+            logging.info("Novy oddil %s, prevzato %d radku z %s", path, moved, previous)
+        # uzavrene oddily (vcetne tech po padu) uz jen kompaktujeme
+        for closed in older:
+            if writable(closed):
+                compact(closed)
+        if self.keep:
+            archive_old(self.dbfile, path, self.keep, self.archive_dir)
+
+
+def open_view(dbfile: str, tables, since: str = None, until: str = None):
+    # spojeni, kde `tables` z vsech oddilu (a puvodniho souboru) vypadaji jako
+    # jedna tabulka (docasne view pres ATTACH); jen na cteni
+    conn = sqlite3.connect(":memory:")
+    paths = files(dbfile, since, until)
+    for j, path in enumerate(paths):
+        try:
+            conn.execute("ATTACH DATABASE ? AS ?", (path, f"p{j}"))
+        except sqlite3.OperationalError as e:
+            raise ValueError(
+                f"{path}: {e} ({len(paths)} oddilu, zuzte rozsah pres since/until)"
+            )
+    for table in tables:
+        parts = [
+            f"SELECT * FROM p{j}.{table}"
+            for j in range(len(paths))
+            if conn.execute(
+                f"SELECT 1 FROM p{j}.sqlite_master WHERE type = 'table' AND name = ?",
+                (table,),
+            ).fetchone()
+        ]
+        if not parts:
+            raise ValueError(f"tabulka {table} neni v zadnem oddilu {dbfile}")
+        conn.execute(f"CREATE TEMP VIEW {table} AS {' UNION ALL '.join(parts)}")
+    return conn
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=("list", "query"))
+    parser.add_argument("db", help="logicka db, napr. vlaky.db")
+    parser.add_argument("sql", nargs="?", default="SELECT count(*) FROM vlaky")
+    parser.add_argument("--table", action="append", help="tabulky do view")
+    parser.add_argument("--od", help="prvni den/mesic (YYYY-MM(-DD))")
+    parser.add_argument("--do", help="posledni den/mesic (YYYY-MM(-DD))")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for path in files(args.db, args.od, args.do):
+            state = "zapis" if writable(path) else "jen cteni"
+            print(f"{path:40} {os.path.getsize(path) // 1024:>10} KiB  {state}")
+    else:
+        conn = open_view(args.db, args.table or ["vlaky"], args.od, args.do)
+        for row in conn.execute(args.sql):
+            print("\t".join("" if j is None else str(j) for j in row))
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import re
+
+import metrics
+
+# surove odpovedi seznamu vlaku a feedu map: bajtove stejnou odpoved jako
+# minule vubec nedekodujeme (Digest) a zmenenou cteme po jednom prvku
+# (iter_array), takze cely strom objektu neni v pameti naraz
+
+UNCHANGED = metrics.counter(
+    "grapper_unchanged_payloads",
+    "Odpovedi bajtove stejne jako minule (nedekodovane)",
+    ("endpoint",),
+)
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+DECODER = json.JSONDecoder()
+
+
+class Digest:
+    # otisk posledni zpracovane odpovedi; unchanged() ho jen porovna, done()
+    # ho potvrdi az po uspesnem zpracovani (jinak by se odpoved, na ktere
+    # zpracovani spadlo, priste preskocila)
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.digest = None
+        self.pending = None
+        self.skipped = 0
+
+    def unchanged(self, body: bytes) -> bool:
+        self.pending = hashlib.blake2b(body, digest_size=16).digest()
+        if self.pending == self.digest:
+            self.skipped += 1
+            UNCHANGED.labels(self.endpoint).inc()
+            return True
+        return False
+
+    def done(self):
+        self.digest = self.pending
+
+
+def skip(text: str, pos: int) -> int:
+    return WHITESPACE.match(text, pos).end()
+
+
+def expect(text: str, pos: int, chars: str) -> str:
+    char = text[pos : pos + 1]
+    if not char or char not in chars:
+        raise json.JSONDecodeError(f"cekali jsme {chars!r}", text, pos)
+    return char
+
+
+def iter_array(data, key: str, rest: dict = None):
+    # prvky pole `key` z top-level objektu po jednom (raw_decode po prvcich);
+    # ostatni klice top-level objektu (male, napr. "success") se ulozi do
+    # `rest`, kompletni je az po vycerpani; chybne JSON -> JSONDecodeError
+    # jako u json.loads
+    text = data.decode("utf-8") if isinstance(data, (bytes, bytearray)) else data
+    decode = DECODER.raw_decode
+    pos = skip(text, 0)
+    expect(text, pos, "{")
+    pos = skip(text, pos + 1)
+    if text[pos : pos + 1] == "}":
+        return
+    while True:
+        expect(text, pos, '"')
+        name, pos = decode(text, pos)
+        pos = skip(text, pos)
+        expect(text, pos, ":")
+        pos = skip(text, pos + 1)
+        if name == key and text[pos : pos + 1] == "[":
+            pos = skip(text, pos + 1)
+            if text[pos : pos + 1] == "]":
+                pos += 1
+            else:
+                while True:
+                    item, pos = decode(text, pos)
+                    yield item
+                    # carka hned za prvkem je nejcastejsi, bez regexu
+                    if text[pos : pos + 1] == ",":
+                        pos += 1
+                        if text[pos : pos + 1] in " \t\n\r":
+                            pos = skip(text, pos)
+                        continue
+                    pos = skip(text, pos)
+                    if expect(text, pos, ",]") == "]":
+                        pos += 1
+                        break
+                    pos = skip(text, pos + 1)
+        else:
+            value, pos = decode(text, pos)
+            if rest is not None:
+                rest[name] = value
+        pos = skip(text, pos)
+        if expect(text, pos, ",}") == "}":
+            return
+        pos = skip(text, pos + 1)
@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+
+import metrics
+
+# stahovani -> parsovani -> zapis bezi soubezne a jsou spojene omezenymi
+# frontami; Stage meri, kolik casu pracovnici stupne opravdu pracovali (zbytek
+# cekali na vstup nebo na misto ve fronte za sebou)
+
+# nastavi se po SIGTERM (systemd stop), zdroje pak dodelaji rozdelane a skonci
+stopping = threading.Event()
+
+UTILISATION = metrics.gauge(
+    "grapper_stage_utilisation", "Vytizeni stupne v poslednim kole (0-1)", ("stage",)
+)
+
+
+class Stage:
+    def __init__(self, name: str, workers: int = 1):
+        self.name = name
+        self.workers = max(workers, 1)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.busy = 0.0
+        self.items = 0
+
+    def add(self, seconds: float, items: int = 1):
+        with self.lock:
+            self.busy += seconds
+            self.items += items
+
+    def utilisation(self, wall: float) -> float:
+        return self.busy / (wall * self.workers) if wall > 0 else 0.0
+
+
+def report(stages, wall: float) -> str:
+    parts = []
+    for stage in stages:
+        util = stage.utilisation(wall)
+        UTILISATION.labels(stage.name).set(util)
+        parts.append(f"{stage.name} {util:.0%} ({stage.items}x, {stage.workers}w)")
+    return ", ".join(parts)
+
+
+def report_rss(source: str):
+    # spicka pameti za kolo zdroje (viz metrics.peak_rss)
+    peak = metrics.peak_rss()
+    if peak is not None:
+        metrics.PEAK_RSS.labels(source).set(peak)
+        logging.info("Spicka RSS: %.1f MiB", peak / 2**20)
+
+
+def on_sigterm(signum, frame):
+    logging.info("SIGTERM, dodelame rozdelane kolo a koncime")
+    stopping.set()
+
+
+# AIMD strop pozadavku (viz RateController), vychozi hodnoty z prostredi
+RPS_MIN = float(os.environ.get("GRAPPER_RPS_MIN", "0.5"))
+RPS_MAX = float(os.environ.get("GRAPPER_RPS_MAX", "0"))  # 0 = dvojnasobek startu
+RPS_STEP = float(os.environ.get("GRAPPER_RPS_STEP", "0.1"))
+LATENCY_TARGET = float(os.environ.get("GRAPPER_LATENCY_TARGET", "1.0"))
+BREAKER_FAILURES = int(os.environ.get("GRAPPER_BREAKER_FAILURES", "5"))
+BREAKER_SECONDS = float(os.environ.get("GRAPPER_BREAKER_SECONDS", "15"))
+BREAKER_MAX_SECONDS = 300
+
+CLOSED, OPEN, HALF_OPEN = "zavreny", "otevreny", "zkousime"
+
+REQUEST_RATE = metrics.gauge(
+    "grapper_request_rate", "Aktualni strop pozadavku za sekundu (AIMD)"
+)
+BREAKER_OPEN = metrics.gauge(
+    "grapper_breaker_open", "Jistic: 0 zavreny, 1 otevreny, 0.5 zkusebni pozadavek"
+)
+BREAKER_TRIPS = metrics.counter("grapper_breaker_trips", "Kolikrat se jistic otevrel")
+
+
+class RateController:
+    # strop na pocet pozadavku za sekundu, sdileny vsemi workery (a v
+    # collector.py i vsemi zdroji), ktery se ridi odezvou serveru: kdo stahuje,
+    # hlasi success(trvani) nebo failure(). Dokud server odpovida do
+    # `latency_target`, strop roste o `step` rps za sekundu, pri chybe nebo
+    # timeoutu se vynasobi `backoff`, pri pomale odpovedi `slow_backoff`
+    # (nejvys jednou za odezvu, at jedna zaseknuta davka soubeznych pozadavku
+    # nesrazi strop hned na minimum). Po `failures` chybach za sebou se otevre jistic: wait()
+    # nepusti nic `breaker_seconds`, pak pusti jeden zkusebni pozadavek; kdyz
+    # projde, jistic se zavre, kdyz ne, otevre se na dvojnasobek.
+    def __init__(
+        self,
+        rps: float,
+        min_rps: float = RPS_MIN,
+        max_rps: float = RPS_MAX,
+        step: float = RPS_STEP,
+        backoff: float = 0.5,
+        slow_backoff: float = 0.8,
+        latency_target: float = LATENCY_TARGET,
+        failures: int = BREAKER_FAILURES,
+        breaker_seconds: float = BREAKER_SECONDS,
+    ):
+        self.rate = rps
+        self.min_rps = min(min_rps, rps)
+        self.max_rps = max(max_rps or 2 * rps, rps)
+        self.step = step
+        self.backoff = backoff
+        self.slow_backoff = slow_backoff
+        self.latency_target = latency_target
+        self.failures = failures
+        self.breaker_seconds = breaker_seconds
+        self.last_sent = 0.0
+        self.hold_until = 0.0
+        self.consecutive = 0
+        self.state = CLOSED
+        self.open_for = breaker_seconds
+        self.open_until = 0.0
+        REQUEST_RATE.set(self.rate)
+        BREAKER_OPEN.set(0)
+
+    async def wait(self):
+        while self.state != CLOSED:
+            now = time.monotonic()
+            if stopping.is_set():
+                # na SIGTERM necekame, az se jistic zavre; volajici uz nic
+                # noveho nezacne
+                return
+            if now < self.open_until:
+                # otevreno, nebo uz bezi zkusebni pozadavek
+                await asyncio.sleep(min(self.open_until - now, 1.0))
+                continue
+            # zkusebni pozadavek; kdyby se jeho vysledek nedozvedel (zruseni),
+            # po dalsich breaker_seconds pustime dalsi
+            self.state = HALF_OPEN
+            self.open_until = now + self.breaker_seconds
+            BREAKER_OPEN.set(0.5)
+            logging.info("Jistic: zkousime jeden pozadavek")
+            return
+        # interval se pocita az po probuzeni podle aktualniho stropu (sloty
+        # rezervovane pri nizkem stropu by brzdily i po jeho zvednuti); kdo se
+        # probudi prvni, jde, ostatni cekaji dal (mezi kontrolou a zapisem neni
+        # await, takze to je bezpecne i pro vic workeru v jedne smycce)
+        while True:
+            now = time.monotonic()
+            delay = self.last_sent + 1 / self.rate - now
+            if delay <= 0:
+                self.last_sent = now
+                return
+            await asyncio.sleep(delay)
+
+    def success(self, seconds: float = None):
+        # bez `seconds` se odezva neposuzuje (velke odpovedi jako seznam vlaku)
+        if self.state == OPEN:
+            # pozadavek poslany pred otevrenim; jistic zavre az zkusebni
+            return
+        if self.state == HALF_OPEN:
+            logging.info("Jistic zavren, strop %.2f rps", self.rate)
+            self.state = CLOSED
+            self.open_for = self.breaker_seconds
+            BREAKER_OPEN.set(0)
+        self.consecutive = 0
+        if seconds is not None and seconds > self.latency_target:
+            self.decrease(
+                self.slow_backoff, seconds, f"pomala odpoved ({seconds:.1f}s)"
+            )
+        else:
+            # rate pozadavku za sekundu po step / rate = step za sekundu
+            self.rate = min(self.max_rps, self.rate + self.step / self.rate)
+            REQUEST_RATE.set(self.rate)
+
+    def failure(self, error=None):
+        self.consecutive += 1
+        self.decrease(self.backoff, self.latency_target, repr(error))
+        if self.state == HALF_OPEN:
+            self.trip(min(self.open_for * 2, BREAKER_MAX_SECONDS))
+        elif self.state == CLOSED and self.consecutive >= self.failures:
+            self.trip(self.breaker_seconds)
+
+    def decrease(self, factor: float, hold: float, reason: str):
+        # odpovedi pozadavku poslanych pred snizenim uz nic nezmeni
+        now = time.monotonic()
+        if now < self.hold_until:
+            return
+        self.hold_until = now + hold
+        rate = max(self.min_rps, self.rate * factor)
+        if rate < self.rate:
+            logging.info(
+                "Strop pozadavku %.2f -> %.2f rps: %s", self.rate, rate, reason
+            )
+        self.rate = rate
+        REQUEST_RATE.set(self.rate)
+
+    def trip(self, seconds: float):
+        self.state = OPEN
+        self.open_for = seconds
+        self.open_until = time.monotonic() + seconds
+        BREAKER_TRIPS.inc()
+        BREAKER_OPEN.set(1)
+        logging.warning(
+            "Jistic otevren na %.0fs po %d chybach za sebou",
+            seconds,
+            self.consecutive,
+        )
+
+    def delay(self) -> float:
+        # za jak dlouho ma smysl zkusit dalsi pozadavek (misto pevneho cekani)
+        return max(self.open_until - time.monotonic(), 1 / self.rate)
+
+    def report(self) -> str:
+        out = f"{self.rate:.2f} rps (min {self.min_rps:g}, max {self.max_rps:g}), jistic {self.state}"
+        if self.state == OPEN:
+            out += f" jeste {max(self.open_until - time.monotonic(), 0):.0f}s"
+        return out
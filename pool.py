@@ -0,0 +1,241 @@
+import gzip
+import http.client
+import json
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from urllib.parse import urljoin, urlsplit
+from urllib.request import Request
+
+# jednoduchy HTTP klient s perzistentnimi spojenimi (keep-alive) per host,
+# urllib si pro kazdy pozadavek otvira nove TCP+TLS spojeni
+
+MAX_REDIRECTS = 5
+
+# chyby, ktere na znovupouzitem spojeni znamenaji, ze ho server mezitim zavrel
+STALE_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.CannotSendRequest,
+    ConnectionResetError,
+    BrokenPipeError,
+)
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, url: str):
+        super().__init__(f"HTTP {status}: {url}")
+        self.status = status
+        self.url = url
+
+
+@dataclass
+class Timing:
+    connect: float  # TCP + TLS handshake, nula kdyz jsme spojeni znovu pouzili
+    wait: float  # od odeslani pozadavku po hlavicky odpovedi
+    transfer: float  # cteni (a rozbaleni) tela
+    reused: bool
+    wire_bytes: int  # velikost tela tak, jak prislo (tj. komprimovane)
+
+
+@dataclass
+class Response:
+    status: int
+    url: str
+    headers: http.client.HTTPMessage
+    body: bytes
+    timing: Timing
+
+    def text(self) -> str:
+        return self.body.decode(self.headers.get_content_charset() or "utf-8")
+
+    def json(self):
+        return json.loads(self.body)
+
+    # aby sel objekt predat do CookieJar.extract_cookies
+    def info(self):
+        return self.headers
+
+
+def decode_body(body: bytes, encoding: str) -> bytes:
+    encoding = (encoding or "").lower()
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    if encoding == "deflate":
+        # nektere servery posilaji deflate bez zlib hlavicky
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    return body
+
+
+class Pool:
+    def __init__(
+        self, cookie_jar=None, context=None, timeout=10, max_idle=8, contexts=None
+    ):
+        self.cookie_jar = cookie_jar
+        self.context = context
+        # host -> ssl context, kdyz nektery host potrebuje jine nez ostatni
+        self.contexts = contexts or dict()
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.idle = dict()  # (scheme, host, port) -> [HTTPConnection]
+        self.lock = threading.Lock()
+        self.stats = dict()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = dict(
+                requests=0,
+                reused=0,
+                reconnects=0,
+                connect=0.0,
+                wait=0.0,
+                transfer=0.0,
+                wire_bytes=0,
+                body_bytes=0,
+            )
+
+    def report(self) -> str:
+        st = self.stats
+        n = max(st["requests"], 1)
+        return (
+            f"{st['requests']} pozadavku ({st['reused']} pres existujici spojeni, "
+            f"{st['reconnects']} reconnectu), handshake {st['connect']:.2f}s, "
+            f"cekani {st['wait']:.2f}s, prenos {st['transfer']:.2f}s "
+            f"(prumer {(st['connect'] + st['wait'] + st['transfer']) / n * 1000:.0f}ms), "
+            f"{st['wire_bytes'] / 1024:.0f} KiB po drate, "
+            f"{st['body_bytes'] / 1024:.0f} KiB rozbaleno"
+        )
+
+    def acquire(self, key):
+        with self.lock:
+            conns = self.idle.get(key)
+            if conns:
+                return conns.pop(), True
+
+        scheme, host, port = key
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(
+                host,
+                port,
+                timeout=self.timeout,
+                context=self.contexts.get(host, self.context),
+            )
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self.timeout)
+        return conn, False
+
+    def release(self, key, conn):
+        with self.lock:
+            conns = self.idle.setdefault(key, [])
+            if len(conns) < self.max_idle:
+                conns.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            for conns in self.idle.values():
+                for conn in conns:
+                    conn.close()
+            self.idle.clear()
+
+    def send(self, key, method, path, body, headers, timeout):
+        conn, reused = self.acquire(key)
+        if timeout is not None:
+            conn.timeout = timeout
+            if conn.sock:
+                conn.sock.settimeout(timeout)
+        t0 = time.perf_counter()
+        if conn.sock is None:
+            conn.connect()
+        t1 = time.perf_counter()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+            t2 = time.perf_counter()
+            raw = resp.read()
+        except STALE_ERRORS:
+            conn.close()
+            if not reused:
+                raise
+            # server nam mezitim zavrel spojeni, zkusime to jednou s novym
+            with self.lock:
+                self.stats["reconnects"] += 1
+            return self.send(key, method, path, body, headers, timeout)
+        except BaseException:
+            conn.close()
+            raise
+        t3 = time.perf_counter()
+
+        if resp.will_close:
+            conn.close()
+        else:
+            self.release(key, conn)
+
+        return (
+            resp,
+            raw,
+            Timing(
+                connect=t1 - t0,
+                wait=t2 - t1,
+                transfer=t3 - t2,
+                reused=reused,
+                wire_bytes=len(raw),
+            ),
+        )
+
+    def request(self, url, data=None, headers=None, method=None, timeout=None):
+        for _ in range(MAX_REDIRECTS + 1):
+            req = Request(url, data=data, headers=headers or {}, method=method)
+            req.add_header("Accept-Encoding", "gzip, deflate")
+            if self.cookie_jar is not None:
+                self.cookie_jar.add_cookie_header(req)
+
+            parts = urlsplit(url)
+            port = parts.port or (443 if parts.scheme == "https" else 80)
+            key = (parts.scheme, parts.hostname, port)
+            path = parts.path or "/"
+            if parts.query:
+                path += "?" + parts.query
+
+            resp, raw, timing = self.send(
+                key, req.get_method(), path, data, dict(req.header_items()), timeout
+            )
+            t0 = time.perf_counter()
+            body = decode_body(raw, resp.getheader("content-encoding"))
+            timing.transfer += time.perf_counter() - t0
+
+            response = Response(
+                status=resp.status,
+                url=url,
+                headers=resp.headers,
+                body=body,
+                timing=timing,
+            )
+            if self.cookie_jar is not None:
+                self.cookie_jar.extract_cookies(response, req)
+
+            with self.lock:
+                st = self.stats
+                st["requests"] += 1
+                st["reused"] += timing.reused
+                st["connect"] += timing.connect
+                st["wait"] += timing.wait
+                st["transfer"] += timing.transfer
+                st["wire_bytes"] += timing.wire_bytes
+                st["body_bytes"] += len(body)
+
+            if resp.status in (301, 302, 303, 307, 308):
+                url = urljoin(url, resp.getheader("location"))
+                if resp.status in (301, 302, 303) and data is not None:
+                    data, method = None, "GET"
+                continue
+            if resp.status >= 400:
+                raise HTTPError(resp.status, url)
+            return response
+
+        raise HTTPError(resp.status, url)
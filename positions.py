@@ -0,0 +1,349 @@
+import argparse
+import bisect
+import datetime as dt
+import itertools
+import os
+from dataclasses import dataclass
+
+import partition
+import timeutil
+import varint
+from timeutil import datetime_from_stringtime
+
+# casova rada poloh a zpozdeni z feedu map (datel.py, kazdych 15 s); pro
+# kazdy vlak a den se vzorky sbiraji v pameti a po CHUNK_SECONDS se pripoji
+# jako usek (radek s blobem, sloupce za sebou, delty jako varinty); useky
+# starsi nez DOWNSAMPLE_AFTER se proredi na jeden vzorek za DOWNSAMPLE_STEP
+# python positions.py vlak "EC 332" [--den 2023-01-30]
+# python positions.py sit [--cas "2023-01-30 15:00"]
+
+SCHEMA = """
+CREATE TABLE polohy (
+    den TEXT NOT NULL, -- den planovaneho odjezdu (jako v prehled.db)
+    cislo TEXT NOT NULL,
+    nazev TEXT NOT NULL,
+    provozovatel TEXT NOT NULL,
+    cas_od INT NOT NULL, -- unix cas prvniho vzorku
+    cas_do INT NOT NULL, -- kdy jsme vlak v useku videli naposledy
+    pocet INT NOT NULL,
+    uroven INT NOT NULL, -- 0 = vsechny vzorky, 1 = prorezane
+    data BLOB NOT NULL -- viz encode()
+)
+"""
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS polohy_vlak ON polohy(cislo, den, cas_od)",
+    "CREATE INDEX IF NOT EXISTS polohy_cas ON polohy(uroven, cas_od)",
+    "CREATE INDEX IF NOT EXISTS polohy_nove ON polohy(cas_do) WHERE uroven = 0",
+    "CREATE TABLE IF NOT EXISTS stanice (sr70 INTEGER PRIMARY KEY, nazev TEXT NOT NULL)",
+]
+# pri deleni db (partition.py) se kopiruje ciselnik stanic, rozpracovane
+# useky jsou jen v pameti, takze neni co prenaset
+COPY = ("stanice",)
+
+# jak casto se rozpracovane useky zapisou (tolik dat nanejvys ztratime pri padu)
+CHUNK_SECONDS = 300
+DOWNSAMPLE_AFTER = dt.timedelta(
+    hours=float(os.environ.get("GRAPPER_POSITIONS_DOWNSAMPLE_HOURS", "6"))
+)
+DOWNSAMPLE_STEP = 120
+# plne useky jsou nejvys CHUNK_SECONDS (+ tick) dlouhe, prorezane nejvys
+# hodinove, at snapshot nemusi hledat daleko
+DOWNSAMPLE_CHUNK = 3600
+MAX_SPAN = {0: CHUNK_SECONDS + 60, 1: DOWNSAMPLE_CHUNK + CHUNK_SECONDS + 60}
+# vlak v case T je ve snapshotu, kdyz jsme ho videli nejdyl tolik pred T
+SNAPSHOT_GAP = 60
+
+COORD = 100_000  # stupne na cela cisla, 1e-5 stupne je kolem metru
+PROGRESS = 100  # `a` (procenta trasy) na setiny
+
+
+@dataclass
+class Sample:
+    ts: int
+    lon: float
+    lat: float
+    progress: float  # procenta trasy (`a`)
+    delay: int  # minuty (`de`)
+    next_station: int  # SR70 pristi stanice (`zst_sr70`), 0 = nevime
+
+
+def encode(rows) -> bytes:
+    # pocet vzorku a pak sloupce (cas, lon, lat, a, zpozdeni, sr70) jeden za
+    # druhym, kazdy jako delty; `rows` jsou cela cisla jako z to_row()
+    out = bytearray()
+    varint.put(out, len(rows))
+    for column in zip(*rows):
+        varint.put_column(out, column)
+    return bytes(out)
+
+
+def decode(data: bytes):
+    count, pos = varint.get(data, 0)
+    columns = []
+    for _ in range(len(Sample.__dataclass_fields__)):
+        column, pos = varint.get_column(data, pos, count)
+        columns.append(column)
+    return list(zip(*columns))
+
+
+def to_sample(row) -> Sample:
+    ts, lon, lat, progress, delay, sr70 = row
+    return Sample(ts, lon / COORD, lat / COORD, progress / PROGRESS, delay, sr70)
+
+
+def to_row(el, ts: int):
+    # zaznam z feedu -> (klic vlaku bez dne, nazev pristi stanice, radek),
+    # None kdyz v zaznamu neco chybi
+    props = el["properties"]
+    try:
+        lon, lat = el["geometry"]["coordinates"][:2]
+        key = (props["tt"] + " " + props["tn"], props["na"], props["d"])
+        row = (
+            ts,
+            round(float(lon) * COORD),
+            round(float(lat) * COORD),
+            round(float(props.get("a") or 0) * PROGRESS),
+            int(props.get("de") or 0),
+            int(props.get("zst_sr70") or 0),
+        )
+    except (KeyError, TypeError, ValueError):
+        return None
+    return key, props.get("nna"), row
+
+
+class OpenChunk:
+    __slots__ = ("rows", "last", "last_seen")
+
+    def __init__(self):
+        self.rows = []
+        self.last = None  # posledni vzorek (zustava i po zapisu useku)
+        self.last_seen = 0
+
+
+class PositionStore:
+    # zapis z datel.py; `db` je Writer/DbWriter (pri deleni db ho zdroj vymenuje)
+    def __init__(self, db):
+        self.db = db
+        self.open = dict()  # (den, cislo, nazev, provozovatel) -> OpenChunk
+        self.stations = {j[0] for j in db.conn.execute("SELECT sr70 FROM stanice")}
+        self.last_flush = None
+        self.last_downsample = 0
+        self.last_tick = None
+
+    def add(self, features, fetched_at: float, now: dt.datetime) -> int:
+        # jeden tick feedu, vraci pocet novych vzorku
+        added = sum(self.add_feature(el, fetched_at, now) for el in features)
+        self.tick_done(fetched_at)
+        return added
+
+    def add_feature(self, el, fetched_at: float, now: dt.datetime) -> bool:
+        # jeden vlak z ticku (datel.py je dava po jednom, jak se dekoduji),
+        # tick uzavre tick_done(); stojici vlak (beze zmeny) dalsi vzorek
+        # nedostane, jen se posune cas_do
+        if el["properties"].get("type") != "V":
+            return False
+        ts = int(fetched_at)
+        parsed = to_row(el, ts)
+        planned = datetime_from_stringtime(el["properties"].get("cp", ""), now)
+        if parsed is None or planned is None:
+            return False
+        key, station_name, row = parsed
+        key = (planned.date().isoformat(),) + key
+        chunk = self.open.get(key)
+        if chunk is None:
+            chunk = self.open[key] = OpenChunk()
+        chunk.last_seen = ts
+        if row[-1] and row[-1] not in self.stations and station_name:
+            self.stations.add(row[-1])
+            self.db.add(
+                "INSERT OR IGNORE INTO stanice VALUES (?, ?)", (row[-1], station_name)
+            )
+        if chunk.rows and chunk.last[1:] == row[1:]:
+            return False
+        chunk.rows.append(row)
+        chunk.last = row
+        return True
+
+    def touch(self, fetched_at: float):
+        # tick bajtove stejny jako minule (viz payload.Digest): vlaky z neho
+        # stoji, posune se jim jen cas_do (usek po zapisu zacne posledni polohou)
+        ts = int(fetched_at)
+        for chunk in self.open.values():
+            if chunk.last_seen == self.last_tick:
+                if not chunk.rows:
+                    chunk.rows.append((ts,) + chunk.last[1:])
+                chunk.last_seen = ts
+        self.tick_done(fetched_at)
+
+    def tick_done(self, fetched_at: float):
+        ts = int(fetched_at)
+        self.last_tick = ts
+        if self.last_flush is None:
+            self.last_flush = ts
+        if ts - self.last_flush >= CHUNK_SECONDS:
+            self.flush(ts)
+        if ts - self.last_downsample >= DOWNSAMPLE_CHUNK:
+            self.downsample(ts)
+
+    def flush(self, ts: int = None) -> int:
+        # zapise rozpracovane useky (bez `ts` vsechny, napr. pri vypnuti);
+        # kazdy vlak, ktery jede dal, zacne novy usek prvnim dalsim vzorkem
+        written = 0
+        for key, chunk in list(self.open.items()):
+            if chunk.rows:
+                self.db.add(
+                    "INSERT INTO polohy VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?)",
+                    key
+                    + (
+                        chunk.rows[0][0],
+                        chunk.last_seen,
+                        len(chunk.rows),
+                        encode(chunk.rows),
+                    ),
+                )
+                written += 1
+            if not chunk.rows or ts is None:
+                # od minuleho zapisu jsme vlak nevideli (nebo koncime)
+                del self.open[key]
+            else:
+                chunk.rows = []
+        self.db.flush()
+        self.last_flush = ts
+        return written
+
+    def downsample(self, ts: int) -> int:
+        # useky starsi nez DOWNSAMPLE_AFTER spojime po vlacich a hodinach do
+        # jednoho prorezaneho useku (prvni vzorek v kazdem DOWNSAMPLE_STEP a
+        # posledni); novy usek i smazani starych jdou v jedne transakci
+        self.last_downsample = ts
+        cutoff = ts - DOWNSAMPLE_AFTER.total_seconds()
+        groups = dict()
+        for rowid, *key, start, end, data in self.db.conn.execute(
+            """SELECT rowid, den, cislo, nazev, provozovatel, cas_od, cas_do, data
+            FROM polohy WHERE uroven = 0 AND cas_do < ?""",
+            (cutoff,),
+        ):
+            group = groups.setdefault(
+                tuple(key) + (start // DOWNSAMPLE_CHUNK,), [[], [], 0]
+            )
+            group[0].append(rowid)
+            group[1].extend(decode(data))
+            group[2] = max(group[2], end)
+        for key, (rowids, rows, end) in groups.items():
+            rows.sort()
+            kept = [
+                row
+                for j, row in enumerate(rows)
+                if j == 0
+                or j == len(rows) - 1
+                or row[0] // DOWNSAMPLE_STEP != rows[j - 1][0] // DOWNSAMPLE_STEP
+            ]
+            self.db.add(
+                "INSERT INTO polohy VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?)",
+                key[:4] + (rows[0][0], end, len(kept), encode(kept)),
+            )
+            for rowid in rowids:
+                self.db.add("DELETE FROM polohy WHERE rowid = ?", (rowid,))
+        self.db.flush()
+        return len(groups)
+
+
+class PositionReader:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def stations(self) -> dict:
+        return dict(self.conn.execute("SELECT sr70, nazev FROM stanice"))
+
+    def trajectory(self, train_no: str, day: str = None, since=None, until=None):
+        # -> {(den, cislo, nazev, provozovatel): [Sample]} (cislo jako "EC 332")
+        sql = "SELECT den, cislo, nazev, provozovatel, data FROM polohy WHERE cislo = ?"
+        params = [train_no]
+        if day is not None:
+            sql += " AND den = ?"
+            params.append(day)
+        if since is not None:
+            sql += " AND cas_do >= ?"
+            params.append(since)
+        if until is not None:
+            sql += " AND cas_od <= ?"
+            params.append(until)
+        out = dict()
+        for *key, data in self.conn.execute(sql + " ORDER BY cas_od", params):
+            samples = out.setdefault(tuple(key), [])
+            samples.extend(
+                to_sample(row)
+                for row in decode(data)
+                if (since is None or row[0] >= since)
+                and (until is None or row[0] <= until)
+            )
+        for samples in out.values():
+            samples.sort(key=lambda s: s.ts)
+        return out
+
+    def snapshot(self, at: float):
+        # -> {(den, cislo, nazev, provozovatel): Sample}, posledni vzorek kazdeho
+        # vlaku, ktery v case `at` jel; useky jsou nejvys MAX_SPAN dlouhe, takze
+        # staci ty, co zacaly nejdyl MAX_SPAN pred `at`
+        out = dict()
+        sql = """SELECT den, cislo, nazev, provozovatel, data FROM polohy
+            WHERE uroven = ? AND cas_od BETWEEN ? AND ? AND cas_do >= ?"""
+        rows = itertools.chain.from_iterable(
+            self.conn.execute(sql, (level, at - span, at, at - SNAPSHOT_GAP))
+            for level, span in MAX_SPAN.items()
+        )
+        for *key, data in rows:
+            decoded = decode(data)
+            j = bisect.bisect_right([row[0] for row in decoded], at) - 1
+            if j < 0:
+                continue
+            key = tuple(key)
+            if key not in out or out[key].ts < decoded[j][0]:
+                out[key] = to_sample(decoded[j])
+        return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("vlak", help="trajektorie jednoho vlaku")
+    p.add_argument("cislo", help='napr. "EC 332"')
+    p.add_argument("--den", help="den odjezdu (YYYY-MM-DD)")
+    p = sub.add_parser("sit", help="kde byly vsechny vlaky v jeden okamzik")
+    p.add_argument("--cas", help='"YYYY-MM-DD HH:MM" (prazsky cas), default ted')
+    for p in sub.choices.values():
+        p.add_argument("--db", default="polohy.db")
+    args = parser.parse_args()
+
+    fmt = lambda ts: dt.datetime.fromtimestamp(ts, timeutil.TZ).strftime("%H:%M:%S")
+    if args.cmd == "vlak":
+        until = None
+        if args.den:
+            # vlak muze dojet az dalsi den (a ten byt v dalsim oddilu)
+            until = dt.date.fromisoformat(args.den) + dt.timedelta(days=1)
+            until = until.isoformat()
+        conn = partition.open_view(args.db, ("polohy", "stanice"), args.den, until)
+        reader = PositionReader(conn)
+        names = reader.stations()
+        for key, samples in reader.trajectory(args.cislo, args.den).items():
+            print(" ".join(key))
+            for s in samples:
+                print(
+                    f"  {fmt(s.ts)} {s.lat:9.5f} {s.lon:9.5f} {s.progress:6.2f}% "
+                    f"{s.delay:+4d} min -> {names.get(s.next_station, s.next_station)}"
+                )
+    else:
+        at = dt.datetime.now(timeutil.TZ)
+        if args.cas:
+            at = dt.datetime.fromisoformat(args.cas).replace(tzinfo=timeutil.TZ)
+        day = at.date().isoformat()
+        conn = partition.open_view(args.db, ("polohy", "stanice"), day, day)
+        reader = PositionReader(conn)
+        names = reader.stations()
+        snap = reader.snapshot(at.timestamp())
+        print(f"{len(snap)} vlaku v {at:%Y-%m-%d %H:%M}")
+        for (_, train_no, name, _), s in sorted(snap.items()):
+            print(
+                f"{train_no:<10} {name[:20]:<20} {s.lat:9.5f} {s.lon:9.5f} "
+                f"{s.delay:+4d} min -> {names.get(s.next_station, s.next_station)}"
+            )
@@ -0,0 +1,280 @@
+import argparse
+import math
+import sqlite3
+import sys
+
+import partition
+
+# souhrny zpozdeni pro analytiku nad vlaky.db (viz dotaz v dl.py), at se
+# nemusi pokazde prochazet cela tabulka vlaky; udrzuji je triggery primo v db,
+# takze sedi s tabulkou vlaky i po upsertech a mazani z jakehokoli zapisovace
+# python rollup.py dopravci [--od 2023-01-01 --do 2023-01-31]
+# python rollup.py trasy
+# python rollup.py overit  (porovna souhrny s prepoctem z tabulky vlaky)
+# python rollup.py prepocitat  (zahodi souhrny a spocita je znovu)
+# pri deleni db (partition.py) ma souhrny kazdy oddil, soucty z oddilu se
+# sectou az v Pythonu (viz merge)
+
+# tabulka -> sloupce klice a jejich hodnoty z radku vlaku (den = den, kdy
+# jsme vlak naposledy zapsali, tj. kdy dojel)
+ROLLUPS = {
+    "souhrn_dopravci": {
+        "den": "substr({row}.aktualizovano, 1, 10)",
+        "provozovatel": "{row}.provozovatel",
+    },
+    "souhrn_trasy": {
+        "stanice_vychozi": "{row}.stanice_vychozi",
+        "stanice_cilova": "{row}.stanice_cilova",
+    },
+}
+
+# agregaty a jejich prispevek jednoho dojeteho vlaku (pocet_zpozdeni kvuli
+# prumeru, avg() v puvodnim dotazu ignoruje NULL)
+COUNTERS = {
+    "pocet": "1",
+    "pocet_zpozdeni": "{row}.zpozdeni_prijezd IS NOT NULL",
+    "soucet_zpozdeni": "coalesce({row}.zpozdeni_prijezd, 0)",
+    "pod_5min": "coalesce({row}.zpozdeni_prijezd <= 5, 0)",
+    "pod_15min": "coalesce({row}.zpozdeni_prijezd <= 15, 0)",
+}
+
+
+def create_table(table):
+    keys = ", ".join(f"{key} TEXT NOT NULL" for key in ROLLUPS[table])
+    counters = ", ".join(f"{name} NUMERIC NOT NULL" for name in COUNTERS)
+    return f"""CREATE TABLE IF NOT EXISTS {table} (
+        {keys}, {counters}, PRIMARY KEY ({", ".join(ROLLUPS[table])})
+    )"""
+
+
+def add_row(table, row, where):
+    # INSERT ... SELECT potrebuje WHERE pred ON CONFLICT (jinak je to nejednoznacne)
+    columns = list(ROLLUPS[table]) + list(COUNTERS)
+    values = [expr.format(row=row) for expr in ROLLUPS[table].values()]
+    values += [expr.format(row=row) for expr in COUNTERS.values()]
+    updates = ", ".join(f"{name} = {name} + excluded.{name}" for name in COUNTERS)
+    return f"""INSERT INTO {table} ({", ".join(columns)})
+        SELECT {", ".join(values)} WHERE {where}
+        ON CONFLICT ({", ".join(ROLLUPS[table])}) DO UPDATE SET {updates};"""
+
+
+def remove_row(table, row, where):
+    updates = ", ".join(
+        f"{name} = {name} - ({expr.format(row=row)})" for name, expr in COUNTERS.items()
+    )
+    keys = " AND ".join(
+        f"{key} = {expr.format(row=row)}" for key, expr in ROLLUPS[table].items()
+    )
+    return f"UPDATE {table} SET {updates} WHERE {keys} AND {where};"
+
+
+def backfill(table):
+    # souhrn z tabulky vlaky; jen kdyz je souhrn prazdny (nova tabulka nad
+    # existujici db), jinak uz ho udrzuji triggery
+    keys = [expr.format(row="vlaky") for expr in ROLLUPS[table].values()]
+    sums = [f"sum({expr.format(row='vlaky')})" for expr in COUNTERS.values()]
+    return f"""INSERT INTO {table} ({", ".join(list(ROLLUPS[table]) + list(COUNTERS))})
+        SELECT {", ".join(keys + sums)} FROM vlaky
+        WHERE dojel IS TRUE AND NOT EXISTS (SELECT 1 FROM {table})
+        GROUP BY {", ".join(str(j + 1) for j in range(len(keys)))}"""
+
+
+def trigger(name, event, when, body):
+    return f"""CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON vlaky
+        WHEN {when} BEGIN {" ".join(body)} END"""
+
+
+# pro writer.connect (indexes): vsechno je IF NOT EXISTS / idempotentni
+STATEMENTS = (
+    [create_table(table) for table in ROLLUPS]
+    + [backfill(table) for table in ROLLUPS]
+    + [
+        trigger(
+            "souhrn_vlozeni",
+            "INSERT",
+            "NEW.dojel IS TRUE",
+            [add_row(table, "NEW", "TRUE") for table in ROLLUPS],
+        ),
+        # nedojete vlaky se aktualizuji porad, ty souhrny nezajimaji
+        trigger(
+            "souhrn_zmena",
+            "UPDATE",
+            "OLD.dojel IS TRUE OR NEW.dojel IS TRUE",
+            [remove_row(table, "OLD", "OLD.dojel IS TRUE") for table in ROLLUPS]
+            + [add_row(table, "NEW", "NEW.dojel IS TRUE") for table in ROLLUPS],
+        ),
+        trigger(
+            "souhrn_smazani",
+            "DELETE",
+            "OLD.dojel IS TRUE",
+            [remove_row(table, "OLD", "TRUE") for table in ROLLUPS],
+        ),
+    ]
+)
+
+# soucty za jeden oddil (viz merge), z nich se dopocita totez co dotaz v dl.py
+SUMS = """sum(pocet), sum(pocet_zpozdeni), sum(soucet_zpozdeni), sum(pod_5min),
+    sum(pod_15min)"""
+
+REPORT_CARRIERS = f"""
+SELECT provozovatel, {SUMS}
+FROM souhrn_dopravci
+WHERE den >= ? AND den <= ?
+GROUP BY 1
+"""
+
+REPORT_ROUTES = f"""
+SELECT stanice_vychozi, stanice_cilova, {SUMS}
+FROM souhrn_trasy
+GROUP BY 1, 2
+"""
+
+# pro overeni: stejne soucty primo z tabulky vlaky (cely scan)
+RAW_SUMS = """count(*), count(zpozdeni_prijezd), coalesce(sum(zpozdeni_prijezd), 0),
+    sum(case when zpozdeni_prijezd <= 5 then 1 else 0 end),
+    sum(case when zpozdeni_prijezd <= 15 then 1 else 0 end)"""
+
+RAW_CARRIERS = f"""
+SELECT provozovatel, {RAW_SUMS}
+FROM vlaky
+WHERE dojel is TRUE AND substr(aktualizovano, 1, 10) >= ? AND substr(aktualizovano, 1, 10) <= ?
+GROUP BY 1
+"""
+
+RAW_ROUTES = f"""
+SELECT stanice_vychozi, stanice_cilova, {RAW_SUMS}
+FROM vlaky
+WHERE dojel is TRUE
+GROUP BY 1, 2
+"""
+
+# bez --od/--do bereme vsechno (dny jsou ISO retezce)
+FIRST_DAY, LAST_DAY = "0000-00-00", "9999-99-99"
+
+
+def merge(results, keys: int):
+    # soucty z oddilu (radky: `keys` sloupcu klice a SUMS) secte a dopocita
+    # radky reportu: (nazev, jizd, prumerne zpozdeni, pod 5 min, pod 15 min)
+    totals = dict()
+    for rows in results:
+        for row in rows:
+            acc = totals.setdefault(row[:keys], [0] * 5)
+            for j, value in enumerate(row[keys:]):
+                acc[j] += value or 0
+    out = [
+        (
+            " - ".join(key),
+            count,
+            delay / delayed if delayed else None,
+            under5 / count,
+            under15 / count,
+        )
+        for key, (count, delayed, delay, under5, under15) in totals.items()
+        if count > 0
+    ]
+    out.sort(key=lambda row: (-row[1], row[0]))
+    return out
+
+
+def carriers(conns, since=FIRST_DAY, until=LAST_DAY):
+    return merge(
+        (conn.execute(REPORT_CARRIERS, (since, until)).fetchall() for conn in conns), 1
+    )
+
+
+def routes(conns):
+    return merge((conn.execute(REPORT_ROUTES).fetchall() for conn in conns), 2)
+
+
+def recompute(conn):
+    with conn:
+        for table in ROLLUPS:
+            conn.execute(f"DELETE FROM {table}")
+            conn.execute(backfill(table))
+
+
+def same(a, b) -> bool:
+    if a is None or b is None:
+        return a is b
+    if isinstance(a, str) or isinstance(b, str):
+        return a == b
+    return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9)
+
+
+def compare(rollup, raw):
+    # -> [(klic, ze souhrnu, z vlaku)] pro radky, ktere nesedi
+    rollup = {row[0]: row for row in rollup}
+    raw = {row[0]: row for row in raw}
+    diffs = []
+    for key in sorted(rollup.keys() | raw.keys()):
+        a, b = rollup.get(key), raw.get(key)
+        if a is None or b is None or not all(map(same, a, b)):
+            diffs.append((key, a, b))
+    return diffs
+
+
+def verify(conns, since=FIRST_DAY, until=LAST_DAY):
+    # nad bezici stahovackou cteme kazdy oddil v jedne transakci, at souhrny
+    # a vlaky sedi
+    results = [[], [], [], []]
+    for conn in conns:
+        with conn:
+            conn.execute("BEGIN")
+            results[0].append(conn.execute(REPORT_CARRIERS, (since, until)).fetchall())
+            results[1].append(conn.execute(RAW_CARRIERS, (since, until)).fetchall())
+            results[2].append(conn.execute(REPORT_ROUTES).fetchall())
+            results[3].append(conn.execute(RAW_ROUTES).fetchall())
+    return compare(merge(results[0], 1), merge(results[1], 1)) + compare(
+        merge(results[2], 2), merge(results[3], 2)
+    )
+
+
+def print_report(rows):
+    print(f"{'':40} {'jizd':>7} {'zpozdeni':>9} {'pod 5min':>9} {'pod 15min':>9}")
+    for name, count, delay, under5, under15 in rows:
+        delay = "" if delay is None else f"{delay:.2f}"
+        print(f"{name[:40]:40} {count:7} {delay:>9} {under5:9.2f} {under15:9.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "command", choices=("dopravci", "trasy", "overit", "prepocitat")
+    )
+    parser.add_argument("--db", default="vlaky.db")
+    parser.add_argument("--od", default=FIRST_DAY, help="prvni den (YYYY-MM-DD)")
+    parser.add_argument("--do", default=LAST_DAY, help="posledni den (YYYY-MM-DD)")
+    parser.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args()
+
+    if args.command == "prepocitat":
+        # zkompaktovane oddily jsou jen pro cteni, ty uz se nemeni
+        for path in partition.files(args.db):
+            if not partition.writable(path):
+                print(f"{path}: jen pro cteni, preskakuji")
+                continue
+            conn = sqlite3.connect(path)
+            conn.execute("PRAGMA busy_timeout=5000")
+            recompute(conn)
+            conn.close()
+            print(f"{path}: prepocitano")
+        sys.exit()
+
+    since = None if args.od == FIRST_DAY else args.od
+    until = None if args.do == LAST_DAY else args.do
+    # po oddilech a soucty az tady: ATTACH vsech oddilu (partition.open_view)
+    # narazi na strop 10 db, dni v mesici je vic
+    paths = partition.files(args.db, since, until)
+    if not paths:
+        parser.error(f"{args.db} neexistuje ani jako oddily")
+    conns = [sqlite3.connect(path) for path in paths]
+    if args.command == "dopravci":
+        print_report(carriers(conns, args.od, args.do)[: args.limit])
+    elif args.command == "trasy":
+        print_report(routes(conns)[: args.limit])
+    else:
+        diffs = verify(conns, args.od, args.do)
+        for key, rollup, raw in diffs:
+            print(f"{key}: souhrn {rollup}, vlaky {raw}")
+        print(f"nesedi {len(diffs)} radku" if diffs else "souhrny sedi")
+        sys.exit(1 if diffs else 0)
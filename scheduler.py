@@ -0,0 +1,79 @@
+import heapq
+import itertools
+import time
+
+
+class Scheduler:
+    # halda (termin, poradi, polozka) + slovnik aktualnich terminu; pri
+    # preplanovani nebo odebrani zustane v halde stary zaznam a zahodi se az
+    # pri popu, takze vsechno je O(log n)
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.heap = []
+        self.due = dict()
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.due)
+
+    def __contains__(self, item):
+        return item in self.due
+
+    def schedule(self, item, at: float):
+        self.due[item] = at
+        heapq.heappush(self.heap, (at, next(self.counter), item))
+        # at halda neroste nad miru starymi zaznamy
+        if len(self.heap) > 2 * len(self.due) + 1024:
+            self.heap = [
+                (at, next(self.counter), item) for item, at in self.due.items()
+            ]
+            heapq.heapify(self.heap)
+
+    def remove(self, item):
+        self.due.pop(item, None)
+
+    def drop_stale(self):
+        while self.heap:
+            at, _, item = self.heap[0]
+            if self.due.get(item) == at:
+                return
+            heapq.heappop(self.heap)
+
+    def pop_due(self, now: float = None) -> list:
+        now = self.clock() if now is None else now
+        ret = []
+        self.drop_stale()
+        while self.heap and self.heap[0][0] <= now:
+            _, _, item = heapq.heappop(self.heap)
+            del self.due[item]
+            ret.append(item)
+            self.drop_stale()
+        return ret
+
+    def next_due(self):
+        self.drop_stale()
+        return self.heap[0][0] if self.heap else None
+
+
+class Backoff:
+    # po chybe polozky (vlaku) ji naplanuje az za `base` sekund, po kazde dalsi
+    # chybe za sebou za dvojnasobek (nejvys `cap`); uspech pocitadlo vynuluje
+    def __init__(self, sched: Scheduler, base: float, cap: float):
+        self.sched = sched
+        self.base = base
+        self.cap = cap
+        self.failures = dict()  # polozka -> chyb za sebou
+
+    def failed(self, item) -> float:
+        count = self.failures[item] = self.failures.get(item, 0) + 1
+        delay = min(self.base * 2 ** (count - 1), self.cap)
+        self.sched.schedule(item, self.sched.clock() + delay)
+        return delay
+
+    def succeeded(self, item):
+        self.failures.pop(item, None)
+
+    def forget(self, keep):
+        # pocitadla polozek, ktere uz nesledujeme (napr. vlaky mimo seznam)
+        for item in self.failures.keys() - keep:
+            del self.failures[item]
@@ -0,0 +1,113 @@
+import math
+import os
+import struct
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+# binarni snapshot planovaciho stavu dl.py, at po restartu nemusime znovu
+# stahovat vsechno; hlavicka (magic, verze, cas ulozeni, pocet) a pak zaznamy
+# pevne delky + nazev vlaku (utf-8 s delkou)
+
+MAGIC = b"GRPS"
+VERSION = 1
+HEADER = struct.Struct("<4sBdI")
+# id, termin (NaN = nenaplanovany), otisk ze seznamu, cas stazeni RouteInfo
+# (0 = nikdy), planovany prijezd v minutach od pulnoci (0xFFFF = nevime),
+# priznaky, delka nazvu
+ENTRY = struct.Struct("<qdQdHBB")
+
+ARRIVED = 1
+HAS_ROUTE = 2  # vlak uz mame stazeny (jinak v all_routes je None)
+HAS_STATE = 4  # otisk ze seznamu neni None
+
+NO_ARRIVAL = 0xFFFF
+
+
+class SnapshotError(Exception):
+    ...
+
+
+@dataclass
+class TrainState:
+    id: int
+    name: str
+    due: Optional[float]
+    listed_state: Optional[int]
+    last_fetch: float
+    arrival_minute: Optional[int]
+    has_route: bool
+    arrived: bool
+
+
+def save(path: str, entries) -> int:
+    # zapis do docasneho souboru a os.replace, takze na disku je vzdycky
+    # cely stary nebo cely novy snapshot, nikdy pulka
+    chunks = []
+    for e in entries:
+        # nazev se musi vejit do bajtu s delkou (a nesmi se useknout v pulce znaku)
+        name = e.name.encode("utf-8")[:255].decode("utf-8", "ignore").encode("utf-8")
+        flags = (
+            (ARRIVED if e.arrived else 0)
+            | (HAS_ROUTE if e.has_route else 0)
+            | (HAS_STATE if e.listed_state is not None else 0)
+        )
+        chunks.append(
+            ENTRY.pack(
+                e.id,
+                math.nan if e.due is None else e.due,
+                e.listed_state or 0,
+                e.last_fetch,
+                NO_ARRIVAL if e.arrival_minute is None else e.arrival_minute,
+                flags,
+                len(name),
+            )
+        )
+        chunks.append(name)
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, time.time(), len(chunks) // 2))
+        f.write(b"".join(chunks))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return len(chunks) // 2
+
+
+def load(path: str):
+    # -> (cas ulozeni, [TrainState]), SnapshotError kdyz je soubor k nicemu
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise SnapshotError("useknuta hlavicka")
+    magic, version, saved_at, count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise SnapshotError(f"neznamy format {magic!r} v{version}")
+
+    entries = []
+    offset = HEADER.size
+    for _ in range(count):
+        if offset + ENTRY.size > len(data):
+            raise SnapshotError("useknuty zaznam")
+        tid, due, state, last_fetch, arrival, flags, namelen = ENTRY.unpack_from(
+            data, offset
+        )
+        offset += ENTRY.size
+        name = data[offset : offset + namelen].decode("utf-8")
+        offset += namelen
+        entries.append(
+            TrainState(
+                id=tid,
+                name=name,
+                due=None if math.isnan(due) else due,
+                listed_state=state if flags & HAS_STATE else None,
+                last_fetch=last_fetch,
+                arrival_minute=None if arrival == NO_ARRIVAL else arrival,
+                has_route=bool(flags & HAS_ROUTE),
+                arrived=bool(flags & ARRIVED),
+            )
+        )
+    if offset != len(data):
+        raise SnapshotError("data navic za poslednim zaznamem")
+    return saved_at, entries
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# moduly jsou ploche v koreni repozitare
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,47 @@
+import datetime as dt
+import json
+import os
+import sqlite3
+
+import pytest
+
+import datel
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(__file__)), "fixtures")
+
+
+def recorded_ticks():
+    # ulozene ticky feedu: nove vlaky ve vychozi stanici i na ceste, posun,
+    # zpozdeni, jiny typ, cas bez nuly na zacatku, prechod pres pulnoc a
+    # prazdny tick
+    with open(os.path.join(FIXTURES, "feed", "ticks.jsonl"), encoding="utf-8") as f:
+        for line in f:
+            tick = json.loads(line)
+            yield dt.datetime.fromtimestamp(tick["ts"], datel.SZ_TZ), tick["body"]
+
+
+def replay(fn):
+    # -> [(radky, KnownTrains.keys)] po kazdem ticku
+    conn = sqlite3.connect(":memory:")
+    conn.execute(datel.SQLITE_TRAINS)
+    known, snapshot, out = None, dict(), []
+    for now, body in recorded_ticks():
+        if known is None:
+            known = datel.KnownTrains(conn, now.date())
+        snapshot, changed, _ = datel.diff_snapshot(snapshot, body["result"])
+        known.roll(now.date())
+        out.append((fn(changed, known, now), set(known.keys)))
+    return out
+
+
+@pytest.mark.skipif(datel.np is None, reason="tick_rows_batch potrebuje numpy")
+def test_batch_matches_rows():
+    rows, batch = replay(datel.tick_rows), replay(datel.tick_rows_batch)
+    assert len(rows) == 4
+    for j, ((a, known_a), (b, known_b)) in enumerate(zip(rows, batch)):
+        assert a == b, f"tick {j}"
+        assert known_a == known_b, f"tick {j}"
+    # nove vlaky ve vychozi stanici se zalozi, na ceste se preskoci
+    assert 0 < len(rows[0][0]) < 10
+    # prazdny tick
+    assert rows[2][0] == []
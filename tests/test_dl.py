@@ -0,0 +1,115 @@
+import asyncio
+import datetime as dt
+import functools
+import os
+import sqlite3
+import time
+
+import archive
+import dl
+import partition
+import pipeline
+import pool
+import timeutil
+import writer
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(__file__)), "fixtures")
+
+
+def fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES, "routeinfo", name), encoding="utf-8") as f:
+        return f.read()
+
+
+def make_source(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(dl, "parser_pool", lambda: None)
+    tw = writer.ThreadedWriter()
+    limiter = pipeline.RateController(100, min_rps=100, max_rps=100)
+    source = dl.GrappSource(dl.Session(), tw, limiter)
+    # seznam vlaku "mame", kolo jen stahuje naplanovane
+    source.last_listed = time.time()
+    return source, tw
+
+
+def test_parse_failure_backs_off(tmp_path, monkeypatch):
+    source, tw = make_source(tmp_path, monkeypatch)
+    bad, good = dl.Train(id=1, name="Os 1"), dl.Train(id=2, name="Os 2")
+    pages = {bad: fixture("three_spans.html"), good: fixture("running.html")}
+    monkeypatch.setattr(dl, "fetch_route", lambda session, train: pages[train])
+    try:
+        for train in pages:
+            source.all_routes[train] = None
+            source.sched.schedule(train, 0)
+
+        asyncio.run(source.step())
+        due = source.sched.due[bad]
+        assert due >= time.time() + dl.RETRY - 5
+        assert source.retry.failures == {bad: 1}
+        assert source.all_routes[good] is not None
+
+        # dalsi chyba za sebou = dvojnasobny odklad
+        source.sched.schedule(bad, 0)
+        asyncio.run(source.step())
+        assert source.sched.due[bad] >= time.time() + 2 * dl.RETRY - 5
+        assert source.retry.failures == {bad: 2}
+    finally:
+        source.close()
+        tw.close()
+
+
+def test_train_error_does_not_slow_others(tmp_path, monkeypatch):
+    source, tw = make_source(tmp_path, monkeypatch)
+    source.limiter = pipeline.RateController(50, min_rps=1, max_rps=50)
+    bad = dl.Train(id=1000000, name="Os 0")
+    page = fixture("running.html")
+
+    def fetch_route(session, train):
+        if train == bad:
+            raise pool.HTTPError(500, "RouteInfo")
+        return page
+
+    monkeypatch.setattr(dl, "fetch_route", fetch_route)
+    try:
+        for j in range(5):
+            for train in [bad] + [dl.Train(id=j * 10 + k, name="Os") for k in range(3)]:
+                source.all_routes.setdefault(train, None)
+                source.sched.schedule(train, 0)
+            asyncio.run(source.step())
+        # chyba jednoho vlaku neni chyba serveru: strop ani jistic se nehnou,
+        # vlak dostane vlastni odklad
+        assert source.limiter.rate == 50
+        assert source.limiter.state == pipeline.CLOSED
+        assert source.retry.failures[bad] == 5
+        assert source.sched.due[bad] > time.time() + dl.RETRY
+    finally:
+        source.close()
+        tw.close()
+
+
+def test_server_wide_errors():
+    assert dl.server_wide(pool.HTTPError(503, "RouteInfo"))
+    assert dl.server_wide(TimeoutError())
+    assert not dl.server_wide(pool.HTTPError(500, "RouteInfo"))
+    assert not dl.server_wide(pool.HTTPError(404, "RouteInfo"))
+
+
+def test_replay_partitions(tmp_path, monkeypatch):
+    # zaznamy jdou do oddilu podle sveho casu, ne podle hodin
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(
+        partition, "Partitioned", functools.partial(partition.Partitioned, period="day")
+    )
+    raw = archive.Archive(str(tmp_path / "archiv"), dl.ARCHIVE_SOURCE)
+    day = dt.datetime(2023, 1, 30, 12, tzinfo=timeutil.TZ)
+    for j, name in enumerate(("arrived.html", "running.html")):
+        ts = (day + dt.timedelta(days=j)).timestamp()
+        raw.append("routeinfo", fixture(name), ts=ts, train_id=j + 1, name=f"Os {j}")
+    raw.close()
+
+    dl.replay(str(tmp_path / "archiv"))
+    assert not os.path.exists("vlaky.db") and not os.path.exists("prubehy.db")
+    for j, label in enumerate(("2023-01-30", "2023-01-31")):
+        conn = sqlite3.connect(partition.path_for("vlaky.db", label))
+        assert conn.execute("SELECT id FROM vlaky").fetchall() == [(j + 1,)]
+        assert os.path.exists(partition.path_for("prubehy.db", label))
@@ -0,0 +1,147 @@
+import datetime as dt
+import sqlite3
+from types import SimpleNamespace
+
+import datel
+import dl
+import partition
+import rollup
+import timeline
+import timeutil
+import writer
+
+DAY = dt.date(2023, 1, 30)
+
+
+def at(day: dt.date, hour: int) -> dt.datetime:
+    return dt.datetime.combine(day, dt.time(hour), tzinfo=timeutil.TZ)
+
+
+def train(tid: int, updated: dt.datetime, arrived: bool):
+    ts = updated.isoformat()
+    return (
+        ts,
+        ts,
+        tid,
+        f"Os {tid}",
+        "CD",
+        "A",
+        "B",
+        "10:00",
+        "10:00",
+        "12:00",
+        "12:05",
+        120,
+        0,
+        5,
+        arrived,
+    )
+
+
+def test_arrived_trains_stay_in_their_day(tmp_path):
+    dbfile = str(tmp_path / "vlaky.db")
+    tw = writer.ThreadedWriter()
+    try:
+        parts = partition.Partitioned(
+            tw,
+            dbfile,
+            dl.SQLITE_TRAINS,
+            rollup.STATEMENTS,
+            {"vlaky": dl.CARRY_TRAINS},
+            period="day",
+        )
+        db = parts.current(at(DAY, 12).timestamp())
+        db.add(dl.UPSERT_TRAIN, train(1, at(DAY, 12), True))
+        db.add(dl.UPSERT_TRAIN, train(2, at(DAY, 23), False))
+        # v oddilu za D+1 vlak 2 dojede
+        db = parts.current(at(DAY + dt.timedelta(days=1), 1).timestamp())
+        db.add(dl.UPSERT_TRAIN, train(2, at(DAY + dt.timedelta(days=1), 1), True))
+        db.flush()
+    finally:
+        tw.close()
+
+    day, next_day = DAY.isoformat(), (DAY + dt.timedelta(days=1)).isoformat()
+    for since, until, trains in ((day, day, 1), (next_day, next_day, 1)):
+        paths = partition.files(dbfile, since, until)
+        assert len(paths) == 1
+        conn = writer.connect(paths[0], dl.SQLITE_TRAINS)
+        assert conn.execute("SELECT count(*) FROM vlaky").fetchone()[0] == trains
+        (report,) = rollup.carriers([conn], since, until)
+        assert report[0] == "CD" and report[1] == 1
+
+
+def test_datel_carries_trains_on_the_way(tmp_path):
+    dbfile = str(tmp_path / "prehled.db")
+    row = lambda number, latest: (
+        at(DAY, 23).isoformat(),
+        at(DAY, 23).isoformat(),
+        number,
+        "",
+        "CD",
+        DAY.isoformat(),
+        "A",
+        "B",
+        "",
+        "",
+        latest,
+        None,
+        None,
+    )
+    tw = writer.ThreadedWriter()
+    try:
+        parts = partition.Partitioned(
+            tw,
+            dbfile,
+            datel.SQLITE_TRAINS,
+            datel.SQLITE_INDEXES,
+            {"vlaky": datel.CARRY_TRAINS},
+            period="day",
+        )
+        db = parts.current(at(DAY, 23).timestamp())
+        db.add(datel.UPSERT_TRAIN, row("Os 1", "B"))
+        db.add(datel.UPSERT_TRAIN, row("Os 2", "A"))
+        db.flush()
+        db = parts.current(at(DAY + dt.timedelta(days=1), 1).timestamp())
+        carried = db.conn.execute("SELECT cislo FROM vlaky").fetchall()
+    finally:
+        tw.close()
+    assert carried == [("Os 2",)]
+
+
+def test_timeline_within_span(tmp_path):
+    # jizda se dnem odjezdu D, ktera jede pres pulnoc, skonci v oddilu D+2
+    dbfile = str(tmp_path / "prubehy.db")
+    days = [DAY + dt.timedelta(days=j) for j in range(4)]
+    tw = writer.ThreadedWriter()
+    try:
+        parts = partition.Partitioned(
+            tw,
+            dbfile,
+            timeline.SCHEMA,
+            timeline.INDEXES,
+            timeline.CARRY,
+            timeline.COPY,
+            period="day",
+        )
+        store = timeline.TimelineStore(parts.current(at(days[0], 12).timestamp()))
+        route = SimpleNamespace(names=("A", "B"), times=(1380,) * 4 + (1440,) * 4)
+        store.store(dl.Train(1, "Os 1"), None, route, at(days[0], 23))
+        for day in days[1:]:
+            store.db = parts.current(at(day, 1).timestamp())
+            if day == days[1]:
+                later = SimpleNamespace(
+                    names=route.names, times=route.times[:-1] + (5,)
+                )
+                store.store(dl.Train(1, "Os 1"), route, later, at(day, 1))
+        store.db.flush()
+    finally:
+        tw.close()
+
+    tables = ("jizdy", "stanice", "zastaveni")
+    since, until = days[0].isoformat(), (days[0] + timeline.SPAN).isoformat()
+    reader = timeline.TimelineReader(partition.open_view(dbfile, tables, since, until))
+    assert [r[0] for r in reader.at_station("B", since)] == [1]
+    (last,) = partition.files(dbfile, until, until)
+    assert sqlite3.connect(last).execute("SELECT den FROM jizdy").fetchall() == [
+        (since,)
+    ]
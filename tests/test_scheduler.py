@@ -0,0 +1,81 @@
+import scheduler
+
+
+class Clock:
+    # hodiny, ktere se posouvaji jen rucne
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_pop_due_in_order():
+    clock = Clock()
+    sched = scheduler.Scheduler(clock)
+    for item, at in (("c", 1030), ("a", 1010), ("b", 1020), ("d", 1020)):
+        sched.schedule(item, at)
+    assert sched.pop_due() == []
+    assert sched.next_due() == 1010
+    clock.now = 1020
+    # stejny termin v poradi naplanovani
+    assert sched.pop_due() == ["a", "b", "d"]
+    assert len(sched) == 1 and "c" in sched and "a" not in sched
+    assert sched.pop_due(now=1030) == ["c"]
+    assert sched.next_due() is None
+
+
+def test_reschedule_and_remove():
+    clock = Clock()
+    sched = scheduler.Scheduler(clock)
+    sched.schedule("a", 1010)
+    sched.schedule("b", 1020)
+    sched.schedule("a", 1030)  # odlozeni
+    sched.schedule("b", 1005)  # a naopak
+    sched.schedule("c", 1010)
+    sched.remove("c")
+    sched.remove("x")  # neni naplanovane, nic se nestane
+    assert len(sched) == 2
+    assert sched.next_due() == 1005
+    assert sched.pop_due(now=1020) == ["b"]
+    assert sched.pop_due(now=1030) == ["a"]
+    # stare zaznamy z haldy uz nic nevrati
+    assert sched.pop_due(now=2000) == []
+    assert sched.heap == []
+
+
+def test_heap_is_compacted():
+    sched = scheduler.Scheduler(Clock())
+    for j in range(5000):
+        sched.schedule("a", 1000 + j)
+    assert len(sched.heap) <= 2 * len(sched) + 1024
+    assert sched.pop_due(now=10000) == ["a"]
+
+
+def test_backoff_doubles_up_to_cap():
+    clock = Clock()
+    sched = scheduler.Scheduler(clock)
+    retry = scheduler.Backoff(sched, base=60, cap=200)
+    assert [retry.failed("a") for _ in range(4)] == [60, 120, 200, 200]
+    assert sched.due["a"] == clock.now + 200
+    assert sched.pop_due(now=clock.now + 199) == []
+    assert sched.pop_due(now=clock.now + 200) == ["a"]
+
+    # uspech pocitadlo vynuluje, dalsi chyba zase od zacatku
+    retry.succeeded("a")
+    clock.now += 500
+    assert retry.failed("a") == 60
+    assert sched.due["a"] == 1560
+
+
+def test_backoff_is_per_item():
+    clock = Clock()
+    sched = scheduler.Scheduler(clock)
+    retry = scheduler.Backoff(sched, base=10, cap=1000)
+    retry.failed("a")
+    retry.failed("a")
+    retry.failed("b")
+    assert sched.pop_due(now=1010) == ["b"]
+    assert sched.pop_due(now=1020) == ["a"]
+    retry.forget({"b"})
+    assert retry.failures == {"b": 1}
@@ -0,0 +1,60 @@
+import sqlite3
+
+import pytest
+
+import writer
+
+SCHEMA = "CREATE TABLE t (id INT PRIMARY KEY, nazev TEXT NOT NULL)"
+INSERT = "INSERT INTO t VALUES (?, ?)"
+
+
+def count(path) -> int:
+    return sqlite3.connect(path).execute("SELECT count(*) FROM t").fetchone()[0]
+
+
+def test_bad_row_is_skipped(tmp_path):
+    path = str(tmp_path / "t.db")
+    db = writer.Writer(writer.connect(path, SCHEMA))
+    db.add(INSERT, (1, "a"))
+    db.add(INSERT, (2, None))
+    db.add(INSERT, (3, "c"))
+    assert db.flush() == 2
+    db.add(INSERT, (4, "d"))
+    assert db.flush() == 1
+    assert count(path) == 3
+
+
+def test_locked_db_keeps_batch(tmp_path, monkeypatch):
+    monkeypatch.setattr(writer, "PRAGMAS", ["journal_mode=WAL", "busy_timeout=0"])
+    path = str(tmp_path / "t.db")
+    db = writer.Writer(writer.connect(path, SCHEMA))
+    db.add(INSERT, (1, "a"))
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN EXCLUSIVE")
+    with pytest.raises(sqlite3.OperationalError):
+        db.flush()
+    db.add(INSERT, (2, "b"))
+    other.execute("COMMIT")
+    # nic se neztratilo, ani co prislo po chybe
+    assert db.flush() == 2
+    assert count(path) == 2
+
+
+def test_threaded_writer_keeps_batch(tmp_path, monkeypatch):
+    monkeypatch.setattr(writer, "PRAGMAS", ["journal_mode=WAL", "busy_timeout=0"])
+    path = str(tmp_path / "t.db")
+    writer.connect(path, SCHEMA).close()
+    tw = writer.ThreadedWriter()
+    try:
+        db = tw.open(path, SCHEMA)
+        other = sqlite3.connect(path, isolation_level=None)
+        other.execute("BEGIN EXCLUSIVE")
+        db.add(INSERT, (1, "a"))
+        with pytest.raises(sqlite3.OperationalError):
+            db.flush()
+        db.add(INSERT, (2, "b"))
+        other.execute("COMMIT")
+        db.flush()
+        assert count(path) == 2
+    finally:
+        tw.close()
@@ -0,0 +1,278 @@
+import argparse
+import datetime as dt
+from dataclasses import dataclass
+
+import partition
+import timeutil
+import varint
+
+# casy na vsech zastavkach (dl.py uklada do vlaky.db jen prvni a posledni),
+# jeden radek na vlak a den s kompaktnim blobem, prepisuje se jen kdyz se
+# prubeh zmeni; zastaveni je index podle stanice, at je rychle i
+# "vsechna zpozdeni v Praze hl.n. dnes":
+# python timeline.py stanice "Praha hl.n." [--den 2023-01-30]
+# python timeline.py vlak 12345 [--den 2023-01-30]
+
+SCHEMA = """
+CREATE TABLE jizdy (
+    den TEXT NOT NULL, -- den odjezdu z vychozi stanice
+    vlak INT NOT NULL, -- id z grappu
+    nazev TEXT NOT NULL,
+    aktualizovano TIMESTAMP NOT NULL,
+    zmen INT NOT NULL, -- kolikrat jsme prubeh zapsali
+    prubeh BLOB NOT NULL, -- viz encode()
+    PRIMARY KEY (den, vlak)
+)
+"""
+INDEXES = [
+    "CREATE TABLE IF NOT EXISTS stanice (id INTEGER PRIMARY KEY, nazev TEXT UNIQUE NOT NULL)",
+    """CREATE TABLE IF NOT EXISTS zastaveni (
+        stanice INT NOT NULL,
+        den TEXT NOT NULL,
+        vlak INT NOT NULL,
+        poradi INT NOT NULL,
+        PRIMARY KEY (stanice, den, vlak)
+    ) WITHOUT ROWID""",
+]
+# pri deleni db (partition.py): ciselnik stanic se kopiruje cely, jizdy, ktere
+# jeste muzou zmenit, se prenesou i se svymi radky v indexu (nejdriv index,
+# pak jizdy, podle kterych se vybira); jizda nevi, jestli vlak dojel, takze se
+# prenasi vsechny zapsane den pred novym oddilem (:start, viz partition.prepare):
+# vlak jede nejvys 21 hodin, jizda s dnem odjezdu D se meni nejpozdeji v D+1
+# a skonci tak nejdal v oddilu D+2 (viz SPAN)
+LIVE = "aktualizovano >= date(:start, '-1 day')"
+SPAN = dt.timedelta(days=2)
+CARRY = {
+    "zastaveni": f"""EXISTS (SELECT 1 FROM old.jizdy j WHERE j.den = zastaveni.den
+        AND j.vlak = zastaveni.vlak AND j.{LIVE})""",
+    "jizdy": LIVE,
+}
+COPY = ("stanice",)
+
+UPSERT_TIMELINE = """INSERT INTO jizdy VALUES (?, ?, ?, ?, 1, ?)
+    ON CONFLICT (den, vlak) DO UPDATE SET
+        aktualizovano=excluded.aktualizovano,
+        zmen=zmen+1,
+        prubeh=excluded.prubeh
+"""
+
+VERSION = 1
+DAY = 24 * 60
+
+
+def wrap(minutes: int) -> int:
+    # rozdil casu v minutach pres pulnoc, do [-12h, 12h)
+    return (minutes + DAY // 2) % DAY - DAY // 2
+
+
+def encode(station_ids, times) -> bytes:
+    # verze, pocet stanic a pro kazdou stanici: id, planovany prijezd (delta od
+    # planovaneho odjezdu z predchozi), planovany odjezd (delta od prijezdu),
+    # zpozdeni prijezdu a zpozdeni odjezdu; `times` je v poradi StoredRoute
+    # (po ctyrech: plan. odjezd, odjezd, plan. prijezd, prijezd)
+    out = bytearray((VERSION,))
+    varint.put(out, len(station_ids))
+    previous = 0
+    for j, station in enumerate(station_ids):
+        pd, ad, pa, aa = times[4 * j : 4 * j + 4]
+        varint.put(out, station)
+        varint.put(out, wrap(pa - previous))
+        varint.put(out, wrap(pd - pa))
+        varint.put(out, wrap(aa - pa))
+        varint.put(out, wrap(ad - pd))
+        previous = pd
+    return bytes(out)
+
+
+def decode(data: bytes, upto: int = None):
+    # -> [(id stanice, plan. prijezd, prijezd, plan. odjezd, odjezd)], casy
+    # v minutach od pulnoci; s `upto` jen prvnich upto + 1 stanic (delty se
+    # musi projit od zacatku, ale dal uz ne)
+    if data[0] != VERSION:
+        raise ValueError(f"neznama verze prubehu: {data[0]}")
+    count, pos = varint.get(data, 1)
+    if upto is not None:
+        count = min(count, upto + 1)
+    stops, previous = [], 0
+    for _ in range(count):
+        station, pos = varint.get(data, pos)
+        pa, pos = varint.get(data, pos)
+        pd, pos = varint.get(data, pos)
+        arrival_delay, pos = varint.get(data, pos)
+        departure_delay, pos = varint.get(data, pos)
+        pa = (previous + pa) % DAY
+        pd = (pa + pd) % DAY
+        stops.append(
+            (station, pa, (pa + arrival_delay) % DAY, pd, (pd + departure_delay) % DAY)
+        )
+        previous = pd
+    return stops
+
+
+def departure_day(minute: int, now: dt.datetime) -> dt.date:
+    # den odjezdu z vychozi stanice: posledni vyskyt toho casu pred `now`
+    # (s rezervou, vlaky jsou v seznamu i chvili pred odjezdem), stejne jako
+    # time_diff predpokladame, ze vlak nejede dyl nez 21 hodin
+    now = now.astimezone(timeutil.TZ)
+    departure = dt.datetime.combine(
+        now.date(), timeutil.from_minutes(minute), tzinfo=timeutil.TZ
+    )
+    if departure - now > dt.timedelta(hours=3):
+        departure -= dt.timedelta(days=1)
+    return departure.date()
+
+
+@dataclass
+class Stop:
+    station: str
+    order: int
+    planned_arrival: dt.time
+    actual_arrival: dt.time
+    planned_departure: dt.time
+    actual_departure: dt.time
+
+    @property
+    def arrival_delay(self) -> int:
+        return wrap(
+            timeutil.to_minutes(self.actual_arrival)
+            - timeutil.to_minutes(self.planned_arrival)
+        )
+
+    @property
+    def departure_delay(self) -> int:
+        return wrap(
+            timeutil.to_minutes(self.actual_departure)
+            - timeutil.to_minutes(self.planned_departure)
+        )
+
+
+class TimelineStore:
+    # zapis prubehu z dl.py; id stanic pridelujeme sami (do db pise jen jeden
+    # proces), `db` je Writer/DbWriter (pri deleni db ho zdroj vymenuje)
+    def __init__(self, db):
+        self.db = db
+        self.stations = dict(
+            (name, sid)
+            for sid, name in db.conn.execute("SELECT id, nazev FROM stanice")
+        )
+
+    def station_id(self, name: str) -> int:
+        sid = self.stations.get(name)
+        if sid is None:
+            sid = self.stations[name] = len(self.stations) + 1
+            self.db.add("INSERT OR IGNORE INTO stanice VALUES (?, ?)", (sid, name))
+        return sid
+
+    def store(self, train, previous, route, now: dt.datetime) -> bool:
+        # `previous` a `route` jsou StoredRoute (predchozi muze byt None nebo
+        # jen stub), zapisujeme jen zmenu
+        if not route.names:
+            return False
+        if (
+            previous is not None
+            and previous.names == route.names
+            and previous.times == route.times
+        ):
+            return False
+        day = departure_day(route.times[0], now).isoformat()
+        ids = [self.station_id(name) for name in route.names]
+        self.db.add(
+            UPSERT_TIMELINE,
+            (day, train.id, train.name, now.isoformat(), encode(ids, route.times)),
+        )
+        if previous is None or previous.names != route.names:
+            # nova jizda nebo zmena trasy, index se prepise
+            self.db.add(
+                "DELETE FROM zastaveni WHERE den = ? AND vlak = ?", (day, train.id)
+            )
+            for order, sid in enumerate(ids):
+                self.db.add(
+                    "INSERT OR IGNORE INTO zastaveni VALUES (?, ?, ?, ?)",
+                    (sid, day, train.id, order),
+                )
+        return True
+
+
+class TimelineReader:
+    def __init__(self, conn):
+        self.conn = conn
+        self.names = dict(conn.execute("SELECT id, nazev FROM stanice"))
+
+    def stops(self, data: bytes, upto: int = None):
+        t = timeutil.from_minutes
+        return [
+            Stop(self.names.get(sid, str(sid)), order, t(pa), t(aa), t(pd), t(ad))
+            for order, (sid, pa, aa, pd, ad) in enumerate(decode(data, upto))
+        ]
+
+    def timeline(self, train_id: int, day: str = None):
+        # -> [(den, nazev, [Stop])]
+        sql = "SELECT den, nazev, prubeh FROM jizdy WHERE vlak = ?"
+        params = [train_id]
+        if day is not None:
+            sql += " AND den = ?"
+            params.append(day)
+        return [
+            (den, name, self.stops(data))
+            for den, name, data in self.conn.execute(sql + " ORDER BY den", params)
+        ]
+
+    def at_station(self, name: str, day: str):
+        # -> [(id vlaku, nazev, Stop)] pro vsechny vlaky, ktere v `day`
+        # (den odjezdu) jedou pres stanici `name`
+        row = self.conn.execute("SELECT id FROM stanice WHERE nazev = ?", (name,))
+        row = row.fetchone()
+        if row is None:
+            return []
+        rows = self.conn.execute(
+            """SELECT z.vlak, j.nazev, z.poradi, j.prubeh
+            FROM zastaveni z JOIN jizdy j ON j.den = z.den AND j.vlak = z.vlak
+            WHERE z.stanice = ? AND z.den = ?""",
+            (row[0], day),
+        )
+        return [
+            (train_id, train_name, self.stops(data, order)[-1])
+            for train_id, train_name, order, data in rows
+        ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("stanice", help="vsechny vlaky pres stanici v dany den")
+    p.add_argument("nazev")
+    p = sub.add_parser("vlak", help="prubeh jednoho vlaku")
+    p.add_argument("id", type=int)
+    for p in sub.choices.values():
+        p.add_argument("--db", default="prubehy.db")
+        p.add_argument("--den", help="den odjezdu (YYYY-MM-DD), default dnes")
+    args = parser.parse_args()
+
+    day = args.den or dt.datetime.now(timeutil.TZ).date().isoformat()
+    # pri deleni db muze byt jizda az v oddilu o SPAN dal (viz LIVE)
+    until = (dt.date.fromisoformat(day) + SPAN).isoformat()
+    since = day
+    if args.cmd == "vlak" and args.den is None:
+        since = until = day = None
+    tables = ("jizdy", "stanice", "zastaveni")
+    reader = TimelineReader(partition.open_view(args.db, tables, since, until))
+    fmt = lambda tm: tm.strftime("%H:%M")
+
+    if args.cmd == "stanice":
+        rows = sorted(
+            reader.at_station(args.nazev, day), key=lambda r: r[2].planned_arrival
+        )
+        for train_id, name, stop in rows:
+            print(
+                f"{name:<30} prijezd {fmt(stop.planned_arrival)} {stop.arrival_delay:+4d}"
+                f"  odjezd {fmt(stop.planned_departure)} {stop.departure_delay:+4d}"
+            )
+    else:
+        for den, name, stops in reader.timeline(args.id, day):
+            print(f"{name} ({den})")
+            for stop in stops:
+                print(
+                    f"  {stop.station:<30} {fmt(stop.planned_arrival)} "
+                    f"{stop.arrival_delay:+4d}  {fmt(stop.planned_departure)} "
+                    f"{stop.departure_delay:+4d}"
+                )
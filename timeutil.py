@@ -0,0 +1,50 @@
+import datetime as dt
+import zoneinfo
+
+# casy z grappu i z map jsou jen hodiny a minuty (bez data) v prazskem case,
+# tady je spolecne dohadovani, ke kteremu dni patri
+
+TZ = zoneinfo.ZoneInfo("Europe/Prague")
+
+
+def time_diff(planned, actual):
+    today = dt.datetime.today()
+    a = dt.datetime.combine(today, planned)
+    b = dt.datetime.combine(today, actual)
+    # musime nejak resit dojezdy po pulnoci (nemame datum, jen cas)
+    # tak budem hadat, ze kdyz jsme vic jak tri hodiny pozadu, tak to
+    # bude asi dalsi den (tj. vlak nesmi jet vic jak 21 hodin)
+    # testy:
+    #   a=23:59, b=0:12 (13)
+    #   a=0:05, b=23:59 (-6) -- tady bude vetsi delta, protoze zpozdeni muze byt velky
+    if b < a and a - b > dt.timedelta(hours=3):
+        b += dt.timedelta(days=1)
+    if b > a and b - a > dt.timedelta(hours=12):
+        a += dt.timedelta(days=1)
+    return (b - a).total_seconds() / 60
+
+
+# e.g. 15:03 -> 2023-01-30 15:03 or 2023-01-29 15:03 (whichever is more likely depending on `now`)
+def datetime_from_stringtime(tm, now):
+    today = now.date()
+    yesterday = today - dt.timedelta(days=1)
+    tomorrow = today + dt.timedelta(days=1)
+    for day in [today, yesterday, tomorrow]:
+        hour, _, minute = tm.partition(":")
+        cmb = dt.datetime.combine(
+            day, dt.time(hour=int(hour), minute=int(minute)), tzinfo=TZ
+        )
+        diff = max(now, cmb) - min(now, cmb)
+        if diff.total_seconds() < 8 * 3600:
+            return cmb
+
+    # raise ValueError(f"cannot match time to day: {tm}")
+    return None
+
+
+def to_minutes(tm: dt.time) -> int:
+    return tm.hour * 60 + tm.minute
+
+
+def from_minutes(minutes: int) -> dt.time:
+    return dt.time(minutes // 60, minutes % 60)
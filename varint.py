@@ -0,0 +1,47 @@
+# zigzag varinty (jako v protobufu) pro kompaktni bloby v timeline.py a
+# positions.py: male hodnoty (i zaporne) zaberou bajt, delty po sobe
+# jdoucich hodnot jsou skoro vzdycky male
+
+
+def put(out: bytearray, value: int):
+    value = (value << 1) ^ (value >> 63)
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def get(data: bytes, pos: int):
+    # -> (hodnota, pozice za ni)
+    value, shift = 0, 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return (value >> 1) ^ -(value & 1), pos
+        shift += 7
+
+
+def put_column(out: bytearray, values):
+    # cely sloupec jako delty od predchozi hodnoty (prvni od nuly)
+    previous = 0
+    for value in values:
+        put(out, value - previous)
+        previous = value
+
+
+def get_column(data: bytes, pos: int, count: int):
+    # -> (seznam hodnot, pozice za sloupcem)
+    values, value = [], 0
+    for _ in range(count):
+        byte = data[pos]
+        if byte < 0x80:
+            # jednobajtove delty jsou skoro vsechny, bez volani get()
+            pos += 1
+            value += (byte >> 1) ^ -(byte & 1)
+        else:
+            delta, pos = get(data, pos)
+            value += delta
+        values.append(value)
+    return values, pos
@@ -0,0 +1,221 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import metrics
+import pipeline
+
+# WAL = ctenari (analytika, sqlite3 shell) neblokuji zapis a naopak,
+# synchronous=NORMAL je ve WAL bezpecne (pri padu prijdeme nanejvys o posledni
+# transakci, db se nerozbije)
+PRAGMAS = [
+    "journal_mode=WAL",
+    "synchronous=NORMAL",
+    "cache_size=-32000",  # 32 MiB
+    "busy_timeout=5000",
+]
+
+
+def connect(dbfile: str, schema: str, indexes=()) -> sqlite3.Connection:
+    dbexists = os.path.isfile(dbfile)
+    conn = sqlite3.connect(dbfile)
+    for pragma in PRAGMAS:
+        conn.execute("PRAGMA " + pragma)
+    if not dbexists:
+        conn.execute(schema)
+    # indexy zakladame i nad existujici db (IF NOT EXISTS)
+    with conn:
+        for index in indexes:
+            conn.execute(index)
+    return conn
+
+
+# chyby jednoho radku (spatna data), ne cele db
+BAD_ROW = (
+    sqlite3.IntegrityError,
+    sqlite3.InterfaceError,
+    sqlite3.DataError,
+    sqlite3.ProgrammingError,
+)
+
+
+class Writer:
+    # sbira zapisy z jednoho kola a zapise je naraz v jedne transakci
+    # (executemany po blocich stejneho SQL, poradi zapisu zustava zachovane)
+    def __init__(self, conn: sqlite3.Connection, flush_every: int = 5000):
+        self.conn = conn
+        self.flush_every = flush_every
+        self.pending = []  # [(sql, [params, ...]), ...]
+        self.rows = 0
+
+    def add(self, sql: str, params):
+        if self.pending and self.pending[-1][0] == sql:
+            self.pending[-1][1].append(params)
+        else:
+            self.pending.append((sql, [params]))
+        self.rows += 1
+        if self.rows >= self.flush_every:
+            self.flush()
+
+    def add_many(self, sql: str, rows):
+        # cely seznam radku se stejnym SQL (napr. jeden tick datel.py)
+        rows = list(rows)
+        if not rows:
+            return
+        if self.pending and self.pending[-1][0] == sql:
+            self.pending[-1][1].extend(rows)
+        else:
+            self.pending.append((sql, rows))
+        self.rows += len(rows)
+        if self.rows >= self.flush_every:
+            self.flush()
+
+    def flush(self) -> int:
+        if not self.pending:
+            return 0
+        # spatne radky se preskoci (jinak by shodily i vsechny dalsi flushe),
+        # pri chybe cele db (zamcena, plny disk) davka zustane na priste:
+        # volajici uz ji ma za zapsanou (napr. dojete vlaky se znovu nestahuji)
+        pending, written = self.pending, self.rows
+        self.pending, self.rows = [], 0
+        try:
+            try:
+                with metrics.DB_WRITE_SECONDS.time(), self.conn:
+                    for sql, params in pending:
+                        self.conn.executemany(sql, params)
+            except BAD_ROW as e:
+                logging.warning(
+                    "Davka %d zmen neprosla (%r), zapisujeme po radcich", written, e
+                )
+                written = self.write_rows(pending)
+        except Exception:
+            # transakce se odvolala cela, i kdyz selhala az pri zapisu po radcich
+            logging.error("Zapis %d zmen selhal, zkusime je pri dalsim flush", written)
+            self.pending = pending + self.pending
+            self.rows += written
+            raise
+        metrics.DB_ROWS.inc(written)
+        logging.info("Zapsano %d zmen do db", written)
+        return written
+
+    def write_rows(self, pending) -> int:
+        # chyba radku v sqlite zrusi jen ten jeden prikaz, ne celou transakci
+        written = 0
+        with metrics.DB_WRITE_SECONDS.time(), self.conn:
+            for sql, params in pending:
+                for row in params:
+                    try:
+                        self.conn.execute(sql, row)
+                        written += 1
+                    except BAD_ROW as e:
+                        metrics.ERRORS.labels(type(e).__name__).inc()
+                        logging.error("Preskakujeme radek (%r): %r", e, row)
+        return written
+
+
+class ThreadedWriter:
+    # jedno vlakno, ktere zapisuje do vsech db (kazda ma svuj Writer a svoje
+    # spojeni); zapisy se jen vkladaji do omezene fronty (kdyz je plna,
+    # volajici pocka = backpressure), flush() pocka, az je vsechno predtim
+    # vlozene v db. Pro jednotlive db viz open().
+    def __init__(self, maxsize: int = 10000):
+        self.queue = queue.Queue(maxsize)
+        self.stage = pipeline.Stage("zapis")
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name="writer")
+        self.thread.start()
+
+    def run(self):
+        dbs = dict()
+        while True:
+            kind, dbfile, payload, done = self.queue.get()
+            t0 = time.perf_counter()
+            rows = 0
+            try:
+                # zapisy prijimame i po chybe, Writer je drzi do dalsiho flush
+                if kind == "add":
+                    dbs[dbfile].add(*payload)
+                    rows = 1
+                elif kind == "add_many":
+                    dbs[dbfile].add_many(*payload)
+                    rows = len(payload[1])
+                elif kind == "open":
+                    schema, indexes = payload
+                    dbs[dbfile] = Writer(connect(dbfile, schema, indexes))
+                elif kind == "release":
+                    # jen jedna db (viz partition.py), writer bezi dal
+                    db = dbs.pop(dbfile)
+                    try:
+                        db.flush()
+                    finally:
+                        db.conn.close()
+                else:  # flush, close
+                    for name, db in dbs.items():
+                        if dbfile is None or name == dbfile:
+                            db.flush()
+            except Exception as e:
+                # vlakno nechame bezet, at se producenti nezaseknou na plne
+                # fronte; chybu vyhodime pri dalsim flush()/close()
+                logging.exception("Zapis do db selhal")
+                self.error = e
+            self.stage.add(time.perf_counter() - t0, rows)
+            if kind == "close":
+                for db in dbs.values():
+                    db.conn.close()
+            if done is not None:
+                done.set()
+            if kind == "close":
+                return
+
+    def check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def request(self, kind: str, dbfile=None, payload=None):
+        done = threading.Event()
+        self.queue.put((kind, dbfile, payload, done))
+        done.wait()
+        self.check()
+
+    def open(self, dbfile: str, schema: str, indexes=()) -> "DbWriter":
+        self.request("open", dbfile, (schema, indexes))
+        return DbWriter(self, dbfile)
+
+    def flush(self):
+        self.request("flush")
+
+    def close(self):
+        if self.thread.is_alive():
+            self.request("close")
+            self.thread.join()
+
+
+class DbWriter:
+    # zapisy do jedne db pres ThreadedWriter, rozhrani jako Writer; `conn` je
+    # zvlastni spojeni jen na cteni (ve WAL neblokuje zapis ani naopak)
+    def __init__(self, owner: ThreadedWriter, dbfile: str):
+        self.owner = owner
+        self.dbfile = dbfile
+        self.conn = sqlite3.connect(dbfile, check_same_thread=False)
+        self.conn.execute("PRAGMA busy_timeout=5000")
+
+    def add(self, sql: str, params):
+        self.owner.queue.put(("add", self.dbfile, (sql, params), None))
+
+    def add_many(self, sql: str, rows):
+        # jedna polozka ve fronte pro vsechny radky
+        rows = list(rows)
+        if rows:
+            self.owner.queue.put(("add_many", self.dbfile, (sql, rows), None))
+
+    def flush(self):
+        self.owner.request("flush", self.dbfile)
+
+    def close(self):
+        # zapise, co zbyva, a zavre obe spojeni; writer pak do db uz nesaha
+        self.conn.close()
+        self.owner.request("release", self.dbfile)